@@ -0,0 +1,91 @@
+"""
+Tiles per second, memory and GUI stalls of the PROCESS and THREAD worker backends.
+
+Every configuration runs in a fresh interpreter: a RenderService of the given backend and number of workers
+renders a batch of tiles of a generated text document, while a 5 ms timer of the GUI thread records
+its longest stall. The memory is the proportional set size (PSS) of the GUI process and the worker processes,
+so the pages shared between them are not counted twice.
+
+    python benchmarks/bench_backend.py [--pdf FILE] [--workers 2 4 8] [--tiles 160]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+def memory_mb(pid):
+    # PSS if the kernel reports it, RSS otherwise
+    for path, field in [('/proc/%d/smaps_rollup' % pid, 'Pss:'), ('/proc/%d/status' % pid, 'VmRSS:')]:
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            continue
+    return 0.0
+
+def run(filename, backend, worker_num, tile_count):
+    from common import QtCore, application, pump, load_page_sizes
+    app = application()
+    from renderservice import RenderService
+    service = RenderService(worker_num, backend)
+    sizes = load_page_sizes(service, filename)
+    received = [0]
+    service.tilesRendered.connect(lambda doc_id, tiles: received.__setitem__(0, received[0] + len(tiles)))
+
+    longest_stall = [0.0]
+    last_tick = [time.perf_counter()]
+    def tick():
+        now = time.perf_counter()
+        longest_stall[0] = max(longest_stall[0], now - last_tick[0])
+        last_tick[0] = now
+    timer = QtCore.QTimer()
+    timer.timeout.connect(tick)
+
+    service.beginViewport(1, 1)
+    for k in range(tile_count):
+        page_no = (k // 4) % len(sizes)
+        roi = QtCore.QRectF((k % 2) * 612.0, (k // 2 % 2) * 792.0, 612.0, 792.0)
+        service.requestRenderPage(1, page_no, 144.0, roi, 16 + k % 4, float(k))
+    time_0 = time.perf_counter()
+    last_tick[0] = time_0
+    timer.start(5)
+    service.submitViewport(1)
+    pump(300, lambda: received[0] >= tile_count)
+    elapsed = time.perf_counter() - time_0
+    timer.stop()
+
+    memory = memory_mb(os.getpid()) + sum(memory_mb(p.pid) for p in multiprocessing.active_children())
+    print("%-7s x%d: %6.1f tiles/s, %5.0f MB, longest GUI stall %3.0f ms" % (
+        backend, worker_num, received[0] / elapsed, memory, longest_stall[0] * 1000
+        ))
+    sys.stdout.flush()
+    service.stop()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--tiles', type=int, default=160)
+    parser.add_argument('--run', nargs=2, default=None, help=argparse.SUPPRESS) # backend, worker number
+    args = parser.parse_args()
+
+    if args.run is not None:
+        run(args.pdf, args.run[0], int(args.run[1]), args.tiles)
+        return
+
+    from common import temp_path, write_text_pdf
+    filename = args.pdf or write_text_pdf(temp_path('text-200.pdf'), 200)
+    print("document: %s, %d tiles of 612 x 792 at 144 dpi, %d cores" % (os.path.basename(filename), args.tiles, os.cpu_count()))
+    for worker_num in args.workers:
+        for backend in ['PROCESS', 'THREAD']:
+            subprocess.run([
+                sys.executable, os.path.abspath(__file__), '--pdf', filename, '--tiles', str(args.tiles),
+                '--run', backend, str(worker_num),
+                ], check=False)
+
+if __name__ == '__main__':
+    main()
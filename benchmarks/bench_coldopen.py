@@ -0,0 +1,104 @@
+"""
+Cold open of a large scanned document, with the mapped file loader and with PDFium reading the file itself.
+
+Every mode runs in a fresh interpreter. The document is dropped from the OS page cache first, then a RenderService
+loads it, reads the page sizes and renders one tile on each of 8 pages spread over the document.
+The time to the first tile and to all of them is reported, with the bytes read from the storage
+(read_bytes of /proc/<pid>/io) and through read() (rchar) by the workers.
+
+    python benchmarks/bench_coldopen.py [--pdf FILE] [--pages 150] [--workers 4]
+
+The default document is generated once, about 3 MB per page. Dropping the whole page cache needs root,
+otherwise the pages of the document are dropped by posix_fadvise(), which only works for clean pages.
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+def drop_file_cache(filename):
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return 'all'
+    except OSError:
+        pass
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return 'document'
+
+def io_counters(pid):
+    counters = {}
+    with open('/proc/%d/io' % pid) as f:
+        for line in f:
+            key, value = line.split(':')
+            counters[key] = int(value)
+    return counters
+
+def run(filename, mode, worker_num):
+    from common import QtCore, application, pump
+    application()
+    import pdfworker
+    pdfworker.MAP_DOCUMENT_FILE = mode == 'mapped'
+    from renderservice import RenderService
+    service = RenderService(worker_num, 'PROCESS')
+    pump(0.5)
+    dropped = drop_file_cache(filename)
+    workers = [p.pid for p in multiprocessing.active_children()]
+    before = {pid: io_counters(pid) for pid in workers}
+
+    page_counts = [None]
+    tile_times = []
+    service.pageSizesReceived.connect(lambda fname, doc_id, n, start, sizes: page_counts.__setitem__(0, n))
+    service.tilesRendered.connect(lambda doc_id, tiles: tile_times.extend(time.perf_counter() for tile in tiles))
+    time_0 = time.perf_counter()
+    service.setDocument(filename)
+    service.requestGetPageSizes()
+    pump(120, lambda: page_counts[0] is not None)
+    service.beginViewport(1, 1)
+    for k in range(8):
+        page_no = k * page_counts[0] // 8
+        service.requestRenderPage(1, page_no, 72.0, QtCore.QRectF(0, 0, 595, 842), 1, float(k))
+    service.submitViewport(1)
+    pump(300, lambda: len(tile_times) >= 8)
+
+    storage_bytes = 0
+    read_bytes = 0
+    for pid in workers:
+        after = io_counters(pid)
+        storage_bytes += after['read_bytes'] - before[pid]['read_bytes']
+        read_bytes += after['rchar'] - before[pid]['rchar']
+    print("%-7s first tile %.3f s, 8 tiles %.3f s, storage reads %.1f MB, read() %.1f MB (%s cache dropped)" % (
+        mode, tile_times[0] - time_0, tile_times[-1] - time_0, storage_bytes / 2**20, read_bytes / 2**20, dropped
+        ))
+    sys.stdout.flush()
+    service.stop()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--pages', type=int, default=150)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS) # mode
+    args = parser.parse_args()
+
+    if args.run is not None:
+        run(args.pdf, args.run, args.workers)
+        return
+
+    from common import temp_path, write_scan_pdf
+    filename = args.pdf or write_scan_pdf(temp_path('scan-%d.pdf' % args.pages), args.pages)
+    print("document: %s, %.0f MB, %d workers" % (os.path.basename(filename), os.path.getsize(filename) / 2**20, args.workers))
+    for mode in ['file', 'mapped']:
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), '--pdf', filename, '--workers', str(args.workers), '--run', mode,
+            ], check=False)
+
+if __name__ == '__main__':
+    main()
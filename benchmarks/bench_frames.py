@@ -0,0 +1,97 @@
+"""
+Frame times of a DocGraphicsView while it shows the transient (scaled) tiles of zoom transitions.
+
+After every zoom step the view is scrolled for some frames, each frame is a scroll, the viewport change
+and a synchronous repaint, before the tiles at the new dpi arrive. The frames with transient tiles on screen
+are reported. For the same transient tiles, the pixel work of the former per-frame scaling
+(QPixmap -> QImage -> numpy copy -> bilinear resize -> QPixmap, as with cv2.warpAffine) is timed separately.
+
+    python benchmarks/bench_frames.py [--pdf FILE] [--zooms 8] [--frames 15]
+"""
+import argparse
+import os
+import time
+
+from common import QtCore, QtGui, application, pump, load_page_sizes, percentiles, temp_path, write_text_pdf
+import numpy as np
+
+def transient_pixmaps(view):
+    # the cached pixmaps shown by the transient layers of the visible pages, with their display ratio
+    result = []
+    for page_no in view.current_visible_regions:
+        item = view.page_items[page_no]
+        if item is None:
+            continue
+        for entry in item.cached_pixmaps.values():
+            if entry['item'] is not None:
+                result.append([entry['pixmap'], entry['ratio']])
+    return result
+
+def former_scaling(pixmaps):
+    for pixmap, ratio in pixmaps:
+        img = pixmap.toImage()
+        ptr = img.constBits()
+        ptr.setsize(img.byteCount())
+        pixels = np.array(np.frombuffer(ptr, dtype=np.uint8).reshape(img.height(), img.bytesPerLine()))
+        copied = QtGui.QImage(pixels.data, img.width(), img.height(), img.bytesPerLine(), img.format())
+        width = max(int(img.width() * ratio + 0.5), 1)
+        height = max(int(img.height() * ratio + 0.5), 1)
+        scaled = copied.scaled(width, height, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation)
+        QtGui.QPixmap.fromImage(scaled)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--zooms', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=15)
+    args = parser.parse_args()
+    filename = args.pdf or write_text_pdf(temp_path('text-200.pdf'), 200)
+
+    application()
+    from renderservice import sharedRenderService
+    from docgraphicsview import DocGraphicsView
+    service = sharedRenderService()
+    sizes = load_page_sizes(service, filename)
+
+    view = DocGraphicsView(None)
+    view.resize(1200, 900)
+    view.show()
+    view.setDocument(filename, 96, sizes)
+    pump(2)
+
+    scroll_bar = view.verticalScrollBar()
+    frame_times = []
+    former_times = []
+    transient_counts = []
+    for zoom in range(args.zooms):
+        (view.zoomIn if zoom % 2 == 0 else view.zoomOut)()
+        for k in range(args.frames):
+            time_0 = time.perf_counter()
+            scroll_bar.setValue(scroll_bar.value() + 20)
+            view.onViewportChanged()
+            view.viewport().repaint()
+            elapsed = time.perf_counter() - time_0
+            pixmaps = transient_pixmaps(view)
+            if len(pixmaps) == 0:
+                continue
+            frame_times.append(elapsed)
+            transient_counts.append(len(pixmaps))
+            time_0 = time.perf_counter()
+            former_scaling(pixmaps)
+            former_times.append(time.perf_counter() - time_0)
+        # the tiles at the new dpi
+        pump(1.5)
+
+    print("document: %s, %d zoom steps, %d frames with transient tiles (%.1f tiles per frame)" % (
+        os.path.basename(filename), args.zooms, len(frame_times), np.mean(transient_counts) if transient_counts else 0
+        ))
+    p50, p95 = percentiles(frame_times)
+    print("frame time:                       median %.2f ms, p95 %.2f ms" % (p50 * 1000, p95 * 1000))
+    p50, p95 = percentiles(former_times)
+    print("former per-frame scaling (extra): median %.2f ms, p95 %.2f ms" % (p50 * 1000, p95 * 1000))
+
+    view.close()
+    service.stop()
+
+if __name__ == '__main__':
+    main()
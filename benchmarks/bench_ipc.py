@@ -0,0 +1,95 @@
+"""
+Serialization cost of the render requests of one viewport change (one scroll tick of one view).
+
+    viewport     the current protocol: a RenderBatch packed into RENDER_REQUEST_DTYPE records,
+                 one pickled VIEWPORT message for each worker, unpacked by unpack_render_requests()
+    per-tile     the former protocol: one pickled RENDER command for each tile,
+                 with its QRectF and the whole map of the visible regions (QRectF of each visible page)
+
+Both sides are timed, the GUI side (build and pickle) and the worker side (unpickle and decode).
+
+    python benchmarks/bench_ipc.py [--pages 4] [--patches 16] [--prefetch 64] [--workers 2] [--ticks 500]
+"""
+import argparse
+import pickle
+import time
+
+from common import QtCore, application
+
+def viewport_tiles(pages, patches, prefetch):
+    # [(page_no, dpi, roi, patch_id, priority), ...] of the visible pages and the prefetched ones
+    tiles = []
+    for k in range(pages * patches + prefetch):
+        page_no = k // patches
+        i, j = divmod(k % patches, 4)
+        roi = QtCore.QRectF(j * 306.0, i * 396.0, 306.0, 396.0)
+        tiles.append((page_no, 144.0, roi, 16 + k % patches, float(k)))
+    return tiles
+
+def send_viewport(tiles, worker_num, generation):
+    from renderbatch import RenderBatch
+    batch = RenderBatch(generation, worker_num)
+    for page_no, dpi, roi, patch_id, priority in tiles:
+        batch.add((page_no + patch_id) % worker_num, page_no, dpi, roi, patch_id, priority)
+    return [pickle.dumps(['VIEWPORT', [1, generation, batch.pack(i)]]) for i in range(worker_num)]
+
+def receive_viewport(messages):
+    from renderbatch import unpack_render_requests
+    count = 0
+    for message in messages:
+        command, (owner, generation, requests) = pickle.loads(message)
+        for page_no, patch_id, dpi, priority, x, y, w, h in unpack_render_requests(requests):
+            QtCore.QRectF(x, y, w, h)
+            count += 1
+    return count
+
+def send_per_tile(tiles, pages):
+    visible_regions = {page_no: QtCore.QRectF(0, 0, 1224, 1584) for page_no in range(pages)}
+    return [pickle.dumps(['RENDER', [page_no, dpi, roi, visible_regions]]) for page_no, dpi, roi, patch_id, priority in tiles]
+
+def receive_per_tile(messages):
+    count = 0
+    for message in messages:
+        command, (page_no, dpi, roi, visible_regions) = pickle.loads(message)
+        count += 1
+    return count
+
+def measure(send, receive, ticks):
+    send_time = 0.0
+    receive_time = 0.0
+    nbytes = 0
+    for tick in range(ticks):
+        time_0 = time.perf_counter()
+        messages = send(tick)
+        time_1 = time.perf_counter()
+        receive(messages)
+        receive_time += time.perf_counter() - time_1
+        send_time += time_1 - time_0
+        nbytes += sum(len(message) for message in messages)
+    return send_time / ticks, receive_time / ticks, nbytes / ticks, len(messages)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=4)
+    parser.add_argument('--patches', type=int, default=16)
+    parser.add_argument('--prefetch', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--ticks', type=int, default=500)
+    args = parser.parse_args()
+    application()
+
+    tiles = viewport_tiles(args.pages, args.patches, args.prefetch)
+    results = [
+        ['viewport', measure(lambda tick: send_viewport(tiles, args.workers, tick), receive_viewport, args.ticks)],
+        ['per-tile', measure(lambda tick: send_per_tile(tiles, args.pages), receive_per_tile, args.ticks)],
+        ]
+    print("%d tiles per tick (%d visible pages of %d patches, %d prefetched), %d workers" % (
+        len(tiles), args.pages, args.patches, args.prefetch, args.workers
+        ))
+    for name, (send_time, receive_time, nbytes, messages) in results:
+        print("%-9s GUI side %.3f ms, worker side %.3f ms, %d messages, %.1f KB per tick" % (
+            name, send_time * 1000, receive_time * 1000, messages, nbytes / 1024
+            ))
+
+if __name__ == '__main__':
+    main()
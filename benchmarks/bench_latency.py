@@ -0,0 +1,140 @@
+"""
+Request to paint latency of the tiles, and the wakeups of the idle workers and GUI thread.
+
+A DocGraphicsView jumps to random pages of a generated text document. For every jump it measures
+the time from the viewport change to the first paint showing all visible patches, and for every visible tile
+the time from its request to the first paint after it arrived. Then everything is left idle and
+the context switches of the workers and of the GUI thread are counted.
+
+    python benchmarks/bench_latency.py [--pdf FILE] [--jumps 30] [--idle 3]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+from common import QtCore, application, pump, load_page_sizes, percentiles, temp_path, write_text_pdf
+
+def context_switches(path):
+    with open(path) as f:
+        for line in f:
+            if line.startswith('voluntary_ctxt_switches'):
+                return int(line.split()[1])
+    return 0
+
+class PaintWatcher(QtCore.QObject):
+    def __init__(self, callback):
+        super(PaintWatcher, self).__init__()
+        self.callback = callback
+
+    def eventFilter(self, obj, ev):
+        if ev.type() == QtCore.QEvent.Paint:
+            self.callback()
+        return False
+
+def screen_complete(view):
+    # all patches of the visible regions are shown at the current rendering dpi
+    if len(view.current_visible_regions) == 0:
+        return False
+    for page_no, roi in view.current_visible_regions.items():
+        item = view.page_items[page_no]
+        if item is None:
+            return False
+        positions, patches = item.get_roi_patches(roi)
+        needed = set(item.get_patch_id(i, j, item.patch_col_num) for i, j in positions)
+        info = view.rendered_info.get(page_no)
+        if info is None or info[0] != float(view.current_rendering_dpi[page_no]) or not needed <= info[1]:
+            return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--jumps', type=int, default=30)
+    parser.add_argument('--idle', type=float, default=3.0)
+    args = parser.parse_args()
+    filename = args.pdf or write_text_pdf(temp_path('text-200.pdf'), 200)
+
+    app = application()
+    from renderservice import sharedRenderService
+    from docgraphicsview import DocGraphicsView
+    service = sharedRenderService()
+    sizes = load_page_sizes(service, filename)
+
+    view = DocGraphicsView(None)
+    view.resize(1200, 900)
+    view.show()
+    view.setDocument(filename, 96, sizes)
+    pump(2)
+
+    # the request time of the visible tiles, and their arrival
+    requested = {}
+    arrived = []
+    tile_latencies = []
+    request_render_page = service.requestRenderPage
+    def requestRenderPage(owner, page_no, dpi, roi, patch_id, priority):
+        if page_no in view.current_visible_regions:
+            requested.setdefault((page_no, dpi, patch_id), time.perf_counter())
+        return request_render_page(owner, page_no, dpi, roi, patch_id, priority)
+    service.requestRenderPage = requestRenderPage
+    def onTilesRendered(doc_id, tiles):
+        arrived.extend((page_no, dpi, patch_id) for page_no, dpi, patch_id, roi, pixmap in tiles)
+    service.tilesRendered.connect(onTilesRendered)
+
+    jump = {'start': None}
+    screen_latencies = []
+    def onPaint():
+        now = time.perf_counter()
+        for key in arrived:
+            request_time = requested.pop(key, None)
+            if request_time is not None:
+                tile_latencies.append(now - request_time)
+        del arrived[:]
+        if jump['start'] is not None and screen_complete(view):
+            screen_latencies.append(now - jump['start'])
+            jump['start'] = None
+    watcher = PaintWatcher(onPaint)
+    view.viewport().installEventFilter(watcher)
+
+    rng = random.Random(0)
+    timeouts = 0
+    for k in range(args.jumps):
+        requested.clear()
+        view.gotoPage(rng.randrange(len(sizes)))
+        jump['start'] = time.perf_counter()
+        view.onViewportChanged()
+        if not pump(10, lambda: jump['start'] is None):
+            timeouts += 1
+            jump['start'] = None
+        pump(0.1)
+
+    # idle, in a plain event loop as in the application
+    pump(0.5)
+    workers = [p.pid for p in multiprocessing.active_children()]
+    gui_thread = '/proc/self/task/%d/status' % threading.get_native_id()
+    before = [context_switches('/proc/%d/status' % pid) for pid in workers] + [context_switches(gui_thread)]
+    loop = QtCore.QEventLoop()
+    QtCore.QTimer.singleShot(int(args.idle * 1000), loop.quit)
+    loop.exec_()
+    after = [context_switches('/proc/%d/status' % pid) for pid in workers] + [context_switches(gui_thread)]
+    wakeups = [(b - a) / args.idle for a, b in zip(before, after)]
+
+    print("document: %s, %d pages, %d jumps (%d timed out)" % (os.path.basename(filename), len(sizes), args.jumps, timeouts))
+    p50, p95 = percentiles(screen_latencies)
+    print("jump to complete screen: median %.1f ms, p95 %.1f ms" % (p50 * 1000, p95 * 1000))
+    p50, p95 = percentiles(tile_latencies)
+    print("visible tile request to paint (%d tiles): median %.1f ms, p95 %.1f ms" % (len(tile_latencies), p50 * 1000, p95 * 1000))
+    if workers:
+        print("idle wakeups per second: workers %s, GUI thread %.1f" % (
+            ' '.join('%.1f' % w for w in wakeups[:-1]), wakeups[-1]
+            ))
+    else:
+        print("idle wakeups per second: GUI thread %.1f" % wakeups[-1])
+
+    view.close()
+    service.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Time per megapixel and copies of the pixels from PDFium to a QImage on the GUI side.
+
+Three ways of getting a tile of a generated text document, all in this process:
+    pdfium      FPDF_RenderPageBitmapWithMatrix into a fresh bitmap, nothing else (the floor)
+    direct      PdfInternalWorker.render() straight into a shared tile slot in the native BGRx order,
+                wrapped by the GUI side (the current path)
+    swizzle+png the former path: a fresh bitmap, BGRA -> RGBA into a new array, a QImage over it,
+                PNG encoded in the worker and decoded on the GUI side
+
+    python benchmarks/bench_render.py [--pdf FILE] [--tiles 40] [--dpi 144] [--size 1024]
+"""
+import argparse
+import ctypes
+import os
+import time
+
+from common import QtCore, QtGui, application, temp_path, write_text_pdf
+import numpy as np
+
+def render_fresh_bitmap(PDFIUM, page, dpi, size):
+    zoom = dpi / 72.0
+    bitmap = PDFIUM.FPDFBitmap_Create(size, size, 0)
+    PDFIUM.FPDFBitmap_FillRect(bitmap, 0, 0, size, size, 0xFFFFFFFF)
+    matrix = PDFIUM.FS_MATRIX(zoom, 0, 0, zoom, 0, 0)
+    clip = PDFIUM.FS_RECTF(0, 0, size, size)
+    PDFIUM.FPDF_RenderPageBitmapWithMatrix(bitmap, page, matrix, clip, PDFIUM.FPDF_LCD_TEXT | PDFIUM.FPDF_ANNOT)
+    return bitmap
+
+def swizzle_png(PDFIUM, bitmap, size):
+    buffer = PDFIUM.FPDFBitmap_GetBuffer(bitmap)
+    pixels = np.frombuffer(ctypes.cast(buffer, ctypes.POINTER(ctypes.c_ubyte * (size * size * 4))).contents, dtype=np.uint8)
+    # cv2.cvtColor(BGRA2RGBA) made a new array, the same with numpy
+    rgba = np.ascontiguousarray(pixels.reshape(size, size, 4)[:, :, [2, 1, 0, 3]])
+    img = QtGui.QImage(rgba.data, size, size, size * 4, QtGui.QImage.Format_RGBA8888)
+    buf = QtCore.QBuffer()
+    buf.open(QtCore.QIODevice.WriteOnly)
+    img.save(buf, 'PNG')
+    data = bytes(buf.data())
+    # the GUI side
+    received = QtGui.QImage()
+    received.loadFromData(data, 'PNG')
+    return received, len(data)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--tiles', type=int, default=40)
+    parser.add_argument('--dpi', type=float, default=144.0)
+    parser.add_argument('--size', type=int, default=1024)
+    args = parser.parse_args()
+    filename = args.pdf or write_text_pdf(temp_path('text-200.pdf'), 200)
+    application()
+
+    from pdfworker import PdfInternalWorker, PDFIUM
+    from sharedtiles import SharedTileRing
+    from utils import file_identity
+
+    ring = SharedTileRing()
+    worker = PdfInternalWorker(None, None, ring)
+    worker.set_document(filename, file_identity(filename))
+    page_count = PDFIUM.FPDF_GetPageCount(worker.doc)
+    megapixels = args.tiles * args.size * args.size / 1e6
+    results = []
+
+    # warm up the page handles and the font cache
+    for k in range(min(args.tiles, page_count)):
+        worker.page_cache.get_page(k % page_count)
+
+    time_0 = time.perf_counter()
+    for k in range(args.tiles):
+        bitmap = render_fresh_bitmap(PDFIUM, worker.page_cache.get_page(k % page_count), args.dpi, args.size)
+        PDFIUM.FPDFBitmap_Destroy(bitmap)
+    results.append(['pdfium', time.perf_counter() - time_0, 0, None])
+
+    time_0 = time.perf_counter()
+    copies = 0
+    for k in range(args.tiles):
+        img, roi, tile = worker.render(k % page_count, args.dpi, QtCore.QRectF(0, 0, args.size, args.size))
+        if tile is None:
+            tile = ring.put_image(img) # no free slot, one copy
+            copies += 1
+        received = ring.get_image(tile)
+        assert received is not None and received.width() == img.width()
+        ring.release(tile)
+        worker.bitmap_pool.release(img)
+    results.append(['direct', time.perf_counter() - time_0, copies / args.tiles, None])
+
+    time_0 = time.perf_counter()
+    png_bytes = 0
+    for k in range(args.tiles):
+        bitmap = render_fresh_bitmap(PDFIUM, worker.page_cache.get_page(k % page_count), args.dpi, args.size)
+        received, nbytes = swizzle_png(PDFIUM, bitmap, args.size)
+        png_bytes += nbytes
+        PDFIUM.FPDFBitmap_Destroy(bitmap)
+    # the swizzled array, the PNG encoding, its pickle through the queue and the decoding
+    results.append(['swizzle+png', time.perf_counter() - time_0, 4, png_bytes / args.tiles])
+
+    print("document: %s, %d tiles of %d x %d at %.0f dpi" % (os.path.basename(filename), args.tiles, args.size, args.size, args.dpi))
+    for name, elapsed, copies, nbytes in results:
+        line = "%-12s %7.1f ms/MP, %.1f copies of the pixels per tile" % (name, elapsed * 1000 / megapixels, copies)
+        if nbytes is not None:
+            line += ", %.0f KB of PNG per tile" % (nbytes / 1024)
+        print(line)
+
+    with worker.pdf_lock:
+        worker.bitmap_pool.clear()
+        worker.close_document()
+    ring.close()
+    ring.unlink()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Characters per second of the text geometry extraction, on a generated dense two-column document.
+
+    get_text_objects  PdfInternalWorker.get_text_objects(), the text, char rects, line rects and ranges as arrays
+                      (the text page is loaded by the first call and included)
+    per-char          the former extraction loop on the loaded text pages: four new c_double and a
+                      FPDFText_GetUnicode and FPDFText_GetCharBox call for every character, boxes in lists
+
+    python benchmarks/bench_text.py [--pdf FILE] [--pages 20]
+"""
+import argparse
+import ctypes
+import os
+import time
+
+from common import application, temp_path, write_text_pdf
+
+def extract_per_char(PDFIUM, textpage):
+    count = PDFIUM.FPDFText_CountChars(textpage)
+    text = []
+    rects = []
+    for i in range(count):
+        text.append(chr(PDFIUM.FPDFText_GetUnicode(textpage, i)))
+        left = ctypes.c_double()
+        right = ctypes.c_double()
+        bottom = ctypes.c_double()
+        top = ctypes.c_double()
+        PDFIUM.FPDFText_GetCharBox(textpage, i, ctypes.byref(left), ctypes.byref(right), ctypes.byref(bottom), ctypes.byref(top))
+        rects.append([left.value, top.value, right.value - left.value, bottom.value - top.value])
+    return ''.join(text), rects
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--pages', type=int, default=20)
+    args = parser.parse_args()
+    filename = args.pdf or write_text_pdf(temp_path('text-200.pdf'), 200)
+    application()
+
+    from pdfworker import PdfInternalWorker, PDFIUM
+    from sharedtiles import LocalTileRing
+    from utils import file_identity
+
+    worker = PdfInternalWorker(None, None, LocalTileRing())
+    worker.set_document(filename, file_identity(filename))
+    pages = range(min(args.pages, PDFIUM.FPDF_GetPageCount(worker.doc)))
+
+    chars = 0
+    lines = 0
+    time_0 = time.perf_counter()
+    for page_no in pages:
+        text, char_rects, line_rects, line_ranges = worker.get_text_objects(worker.doc, page_no)
+        chars += len(text)
+        lines += len(line_rects)
+    elapsed = time.perf_counter() - time_0
+
+    time_0 = time.perf_counter()
+    for page_no in pages:
+        extract_per_char(PDFIUM, worker.page_cache.get_text_page(page_no))
+    per_char_elapsed = time.perf_counter() - time_0
+
+    print("document: %s, %d pages, %.0f chars and %.0f lines per page" % (
+        os.path.basename(filename), len(pages), chars / len(pages), lines / len(pages)
+        ))
+    print("get_text_objects  %9.0f chars/s, %.1f ms per page" % (chars / elapsed, elapsed * 1000 / len(pages)))
+    print("per-char          %9.0f chars/s, %.1f ms per page (boxes and text only)" % (
+        chars / per_char_elapsed, per_char_elapsed * 1000 / len(pages)
+        ))
+
+    with worker.pdf_lock:
+        worker.close_document()
+
+if __name__ == '__main__':
+    main()
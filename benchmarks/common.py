@@ -0,0 +1,165 @@
+"""
+Helpers of the benchmark scripts: the kuafu modules on the path, an offscreen QApplication,
+an event pump, and generated documents so that every run measures the same input.
+"""
+import os
+import sys
+import time
+import tempfile
+
+# the modules of kuafu import each other by their plain names, as when the application is run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kuafu'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+import numpy as np
+
+_app = None
+
+def application():
+    global _app
+    if _app is None:
+        _app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+    return _app
+
+def pump(seconds, until=None):
+    # run the event loop for some time, or until the condition is met, return whether it was met
+    app = application()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        app.processEvents(QtCore.QEventLoop.AllEvents, 5)
+        if until is not None and until():
+            return True
+        time.sleep(0.0005)
+    return until is not None and until()
+
+def load_page_sizes(service, filename, timeout=60):
+    # set the document of a RenderService and wait for all its page sizes
+    sizes = []
+    def onSizes(fname, doc_id, page_counts, start, pages_size_inch):
+        if start == 0:
+            del sizes[:]
+        sizes.extend(pages_size_inch.tolist())
+        total[0] = page_counts
+    total = [None]
+    service.pageSizesReceived.connect(onSizes)
+    service.setDocument(filename)
+    service.requestGetPageSizes()
+    pump(timeout, lambda: total[0] is not None and len(sizes) == total[0])
+    service.pageSizesReceived.disconnect(onSizes)
+    return sizes
+
+def percentiles(values, ps=(50, 95)):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return [float('nan')] * len(ps)
+    return [float(np.percentile(values, p)) for p in ps]
+
+def temp_path(name):
+    directory = os.path.join(tempfile.gettempdir(), 'kuafu-benchmarks')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+class PdfWriter(object):
+    """
+    A minimal PDF file writer, the objects are written as they are added.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(b'%PDF-1.4\n')
+        self.offsets = []
+
+    def reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def add(self, body, number=None):
+        if number is None:
+            number = self.reserve()
+        self.offsets[number - 1] = self.file.tell()
+        self.file.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        return number
+
+    def add_stream(self, data, entries=b''):
+        return self.add(b'<< /Length %d %s >>\nstream\n' % (len(data), entries) + data + b'\nendstream')
+
+    def close(self, page_numbers, pages_number):
+        kids = b' '.join(b'%d 0 R' % n for n in page_numbers)
+        self.add(b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_numbers)), pages_number)
+        catalog = self.add(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_number)
+        xref = self.file.tell()
+        self.file.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        self.file.write(b''.join(b'%010d 00000 n \n' % offset for offset in self.offsets))
+        self.file.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(self.offsets) + 1, catalog, xref
+            ))
+        self.file.close()
+
+WORDS = b'the of quadtree render tile page worker cache latency viewport scroll pixel document glyph'.split()
+
+def text_lines(rng, count, width):
+    lines = []
+    for i in range(count):
+        line = b''
+        while len(line) < width:
+            line += WORDS[rng.integers(len(WORDS))] + b' '
+        lines.append(line[:width])
+    return lines
+
+def write_text_pdf(path, page_count, columns=2, lines=90, line_chars=48, seed=0):
+    # pages of dense text in columns, like a two-column paper (about 8600 glyphs per page by default)
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    writer = PdfWriter(path)
+    pages_number = writer.reserve()
+    font = writer.add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    page_numbers = []
+    column_width = 540 / columns
+    for page_no in range(page_count):
+        ops = [b'BT /F1 7 Tf 8 TL']
+        for col in range(columns):
+            ops.append(b'1 0 0 1 %.1f 760 Tm' % (36 + col * column_width))
+            for line in text_lines(rng, lines, line_chars):
+                ops.append(b'(' + line + b") '")
+        ops.append(b'ET')
+        # some vector graphics, a figure box in each column
+        for col in range(columns):
+            ops.append(b'0.2 0.3 0.8 RG 1 w %.1f 40 %.1f 20 re S' % (36 + col * column_width, column_width - 12))
+        contents = writer.add_stream(b'\n'.join(ops))
+        page_numbers.append(writer.add(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (
+                pages_number, font, contents
+                )))
+    writer.close(page_numbers, pages_number)
+    return path
+
+def write_scan_pdf(path, page_count, width=2480, height=3508, seed=1):
+    # pages of full page grayscale JPEG images, like a scanned book at 300 dpi
+    if os.path.exists(path):
+        return path
+    application()
+    rng = np.random.default_rng(seed)
+    jpegs = []
+    for k in range(4):
+        pixels = (rng.random((height, width)) * 60 + 180).astype(np.uint8)
+        pixels[::40, :] = 20
+        img = QtGui.QImage(pixels.tobytes(), width, height, width, QtGui.QImage.Format_Grayscale8)
+        buf = QtCore.QBuffer()
+        buf.open(QtCore.QIODevice.WriteOnly)
+        img.save(buf, 'JPEG', 80)
+        jpegs.append(bytes(buf.data()))
+    writer = PdfWriter(path)
+    pages_number = writer.reserve()
+    page_numbers = []
+    for page_no in range(page_count):
+        image = writer.add_stream(jpegs[page_no % len(jpegs)], b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode' % (
+            width, height
+            ))
+        contents = writer.add_stream(b'q 595 0 0 842 0 0 cm /Im0 Do Q')
+        page_numbers.append(writer.add(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>' % (
+                pages_number, image, contents
+                )))
+    writer.close(page_numbers, pages_number)
+    return path
@@ -3,8 +3,10 @@ from PyQt5 import QtCore
 from PyQt5 import QtGui
 # from PyQt5 import QtOpenGL
 
-from pdfworker import PdfWorker
+from renderservice import sharedRenderService
 from page import PageGraphicsItem
+from diskcache import TileDiskCache, TileDiskReader, DEFAULT_DISK_CACHE_BYTES
+from tilecache import shared_tile_cache
 
 from utils import debug
 
@@ -12,6 +14,39 @@ import math
 import time
 import numpy as np
 
+# a page without any content is rendered at a fraction of its dpi first, as a whole,
+# it is shown in the transient layer until the patches at the full dpi arrive
+COARSE_DPI_RATIO = 0.25
+# at most this many pixels on the long side of the page, so that it stays about a screen
+# and fits in a shared tile slot at any zoom level
+COARSE_MAX_PIXELS = 1024
+# only for pages split into more patch columns than this, a page of a few patches is rendered as fast
+COARSE_MIN_PATCH_COLS = 2
+COARSE_PATCH_ID = 1 # the root patch, covering the whole page
+COARSE_PRIORITY_BOOST = 1e9 # rendered before all patches at the full dpi
+
+# the screens ahead of the scrolling are requested after all visible patches,
+# as many as scrolled in PREFETCH_LOOKAHEAD_SECONDS at the current speed, at least one
+PREFETCH_PRIORITY_OFFSET = 1e6
+PREFETCH_LOOKAHEAD_SECONDS = 0.5
+PREFETCH_MAX_SCREENS = 3
+SCROLL_IDLE_SECONDS = 0.3
+
+# in fitting width mode, pages are rendered at discrete dpi levels 72 * sqrt(2)^k, at or above the displayed dpi,
+# and the tiles are scaled to the displayed size, so they stay valid when the window is resized a little.
+# the fixed zoom levels are rendered at their exact dpi, without scaling
+DPI_LEVEL_BASE = 72.0
+DPI_LEVEL_TOLERANCE = 0.02 # in levels, a dpi slightly above a level is still rendered at that level
+
+def snap_to_dpi_levels(dpi):
+    levels = np.ceil(np.log2(np.asarray(dpi) / DPI_LEVEL_BASE) * 2 - DPI_LEVEL_TOLERANCE)
+    return DPI_LEVEL_BASE * np.exp2(levels / 2)
+
+# only the pages within this many screens above and below the viewport keep their items,
+# the others are recycled for the pages coming into view
+PAGE_ITEM_MARGIN_SCREENS = PREFETCH_MAX_SCREENS + 1
+MAX_FREE_PAGE_ITEMS = 16
+
 class BaseDocGraphicsView(QtWidgets.QGraphicsView):
     viewportChanged = QtCore.pyqtSignal(str, int, dict)
     zoomRatioChanged = QtCore.pyqtSignal(float)
@@ -19,7 +54,7 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
     emptyLeadingPageChanged = QtCore.pyqtSignal(int)
     focusIn = QtCore.pyqtSignal()
 
-    def __init__(self, parent, render_num):
+    def __init__(self, parent):
         super(BaseDocGraphicsView, self).__init__(parent)
 
         # self.setViewport(QtOpenGL.QGLWidget()) # opengl
@@ -36,33 +71,50 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
 
         self.setScene(self.scene)
 
-        self.page_items = [] # instances of PageGraphicsItem
+        self.page_items = [] # instances of PageGraphicsItem, None for the pages without item
+        self.live_pages = set() # pages having an item
+        self.free_page_items = [] # recycled items, hidden in the scene
+        # page objects are kept here, the items of the pages come and go
+        self.page_text_objects = {}
+        self.page_link_objects = {}
 
         self.current_filename = None
+        self.doc_id = None # file_identity() of the document, the tiles in the shared cache are keyed by it
 
         self.page_counts = 0
-        self.pages_size_inch = [] # (width, height) in inch, invarient
-        self.current_pages_size_pix = [] # varient depends on the view
-        self.current_pages_rect = [] # one for flag and 4 for scene coordinates
+        # the layout of all pages as arrays, computed in bulk by computePagesDPI() and __rearrangePages()
+        self.pages_size_inch = np.zeros((0, 2)) # (width, height) in inch, invarient
+        self.current_display_dpi = np.zeros(0) # varient depends on the view
+        self.current_pages_size_pix = np.zeros((0, 2), dtype=np.int64)
+        self.current_rendering_dpi = np.zeros(0) # the dpi levels the pages are rendered at
+        self.current_pages_render_size = np.zeros((0, 2), dtype=np.int64)
+        self.current_pages_rect = np.zeros((0, 4)) # (x, y, w, h) in scene coordinates
+        self.pages_initialized = np.zeros(0, dtype=bool) # the page item is placed at its rect
+        self.row_tops = np.zeros(0) # scene y range of each row of pages, sorted, for binary search
+        self.row_bottoms = np.zeros(0)
         self.pageMarkedAsCurrent = 0
 
         self.current_visible_regions = {}
+        self.current_viewport_center = QtCore.QPointF(0, 0) # in scene coordinates
+        self.last_scroll_state = None # [time, horizontal value, vertical value]
+        self.scroll_velocity = [0.0, 0.0] # pixels per second
+        self.scroll_direction = [0, 1] # the direction of the last movement, down by default
         self.view_column_count = 1
         self.leading_empty_pages = 0
 
-        self.render_num = render_num
-        self.render_list = []
-        self.rendered_info = {}
-        self.current_rendering_dpi = []
+        self.render_service = sharedRenderService()
+        self.rendered_info = {} # page_no -> [dpi, set of patch ids shown]
+        self.tile_cache = shared_tile_cache
+        self.render_generation = 0 # requests of older generations are cancelled in the workers
+        self.tile_disk_reader = None
+        self.disk_checked_patches = set() # (page_no, dpi, patch_id) already looked up in the disk cache
         self.current_highlighted_pages = []
 
         self.historyViews = []
         self.currentViewIdx = 0
-        
-        for i in range(self.render_num):
-            tmpWorker = PdfWorker()
-            tmpWorker.renderedImageReceived.connect(self.onRenderedImageReceived)
-            self.render_list.append(tmpWorker)
+
+        # tiles rendered for any view are broadcast to all views
+        self.render_service.tilesRendered.connect(self.onTilesRendered)
 
         self.screen_dpi = 0
 
@@ -120,17 +172,34 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         }
         return viewStatus
 
+    def setTileCacheDir(self, cache_dir, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+        if self.tile_disk_reader is None:
+            self.tile_disk_reader = TileDiskReader(TileDiskCache(cache_dir, max_bytes))
+            self.tile_disk_reader.tileLoaded.connect(self.onTileLoadedFromDisk)
+        self.render_service.setTileCache(cache_dir, max_bytes)
+
     def setDocument(self, filename, screen_dpi, pages_size_inch, viewStatus=None):
         # clear information
+        self.tile_cache.detach(self)
         self.scene.clear()
         self.page_items = []
-        self.pages_size_inch = [] # (width, height) in inch, invarient
-        self.current_pages_size_pix = [] # varient depends on the view
-        self.current_pages_rect = []
+        self.live_pages = set()
+        self.free_page_items = []
+        self.page_text_objects = {}
+        self.page_link_objects = {}
+        self.pages_size_inch = np.zeros((0, 2))
+        self.current_display_dpi = np.zeros(0)
+        self.current_pages_size_pix = np.zeros((0, 2), dtype=np.int64)
+        self.current_rendering_dpi = np.zeros(0)
+        self.current_pages_render_size = np.zeros((0, 2), dtype=np.int64)
+        self.current_pages_rect = np.zeros((0, 4))
+        self.pages_initialized = np.zeros(0, dtype=bool)
+        self.row_tops = np.zeros(0)
+        self.row_bottoms = np.zeros(0)
         self.pageMarkedAsCurrent = 0
         self.current_visible_regions = {}
-        self.current_rendering_dpi = []
         self.rendered_info = {}
+        self.disk_checked_patches = set()
         self.current_highlighted_pages = []
         self.historyViews = []
         self.currentViewIdx = 0
@@ -152,15 +221,16 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         self.current_filename = filename
         self.screen_dpi = screen_dpi
 
-        # reSET for all render processes
-        for rd in self.render_list:
-            rd.setDocument(self.current_filename)
+        # the workers reload the document only if it is not loaded yet
+        self.render_service.setDocument(self.current_filename)
+        self.doc_id = self.render_service.doc_id
 
         # time_0 = time.time()
         self.page_counts = len(pages_size_inch)
-        self.pages_size_inch = pages_size_inch
+        self.pages_size_inch = np.array(pages_size_inch, dtype=np.float64).reshape(-1, 2)
 
         self.page_items = [None] * self.page_counts
+        self.pages_initialized = np.zeros(self.page_counts, dtype=bool)
         # # init only when needed
         # for i in range(self.page_counts):
         #     pageItem = PageGraphicsItem(i)
@@ -172,6 +242,19 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         self.saveCurrentView()
         self.refreshSignals()
 
+    def updatePageSizes(self, start, pages_size_inch):
+        # the real sizes replacing the estimated ones, the page under the anchor stays in place
+        end = start + len(pages_size_inch)
+        if end > self.page_counts:
+            return
+        changed = np.any(self.pages_size_inch[start:end] != pages_size_inch, axis=1)
+        if not changed.any():
+            return
+        self.pages_size_inch[start:end] = pages_size_inch
+        # the tiles of the pages were rendered for the estimated sizes
+        self.tile_cache.removePages(self.doc_id, set((start + np.flatnonzero(changed)).tolist()))
+        self.redrawPages()
+
     def onViewportChanged(self):
         self.currentViewChanged = True
         # 
@@ -182,15 +265,16 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
             return
         vRegions = {}
         for pg_no in self.current_visible_regions:
-            _, x, y, w, h = self.current_pages_rect[pg_no]
+            x, y, w, h = self.current_pages_rect[pg_no]
             rect = self.current_visible_regions[pg_no]
             normalized_rect = [rect.x() / w, rect.y()/ h, rect.width() / w, rect.height() / h]
             vRegions[pg_no] = normalized_rect
         self.viewportChanged.emit(self.current_filename, self.page_counts, vRegions)
+        debug("Tile cache: %d tiles, %.1f MB, hit rate %.1f%%" % (
+            len(self.tile_cache.entries), self.tile_cache.total_bytes / 1024 / 1024, self.tile_cache.hitRate() * 100
+            ))
 
     def computePagesDPI(self):
-        self.current_rendering_dpi = []
-        self.current_pages_size_pix =[]
         assert(self.page_counts > 0)
         assert(len(self.pages_size_inch) == self.page_counts)
 
@@ -203,37 +287,44 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
             viewWidth -= (self.horispacing * (self.view_column_count + 1))
             viewWidth /= self.view_column_count
             
-            avg_zLevel = 0 # compute the nearest zoom level for fitting width mode
-            for i in range(self.page_counts):
-                dpi = viewWidth / self.pages_size_inch[i][0]
-                height = self.pages_size_inch[i][1] * dpi
-                self.current_rendering_dpi.append(dpi)
-                self.current_pages_size_pix.append([int(viewWidth), int(height)])
-                # 
-                avg_zLevel += (dpi / self.screen_dpi)
+            dpi = viewWidth / self.pages_size_inch[:, 0]
+            pages_size_pix = np.stack((np.full(self.page_counts, viewWidth), self.pages_size_inch[:, 1] * dpi), axis=1)
             # 
-            avg_zLevel /= self.page_counts
+            # the nearest zoom level for fitting width mode
+            avg_zLevel = np.mean(dpi / self.screen_dpi)
             candi_zLevels = np.array(self.zoom_levels)
             diff = np.abs(candi_zLevels - avg_zLevel)
             self.current_zoom_index = int(np.argmin(diff))
         else:
             zLevel = self.zoom_levels[self.current_zoom_index]
-            dpi = self.screen_dpi * zLevel # every page will have the same dpi
-            for i in range(self.page_counts):
-                width = self.pages_size_inch[i][0] * dpi
-                height = self.pages_size_inch[i][1] * dpi
-                self.current_rendering_dpi.append(dpi)
-                self.current_pages_size_pix.append([int(width), int(height)])
+            dpi = np.full(self.page_counts, self.screen_dpi * zLevel) # every page will have the same dpi
+            pages_size_pix = self.pages_size_inch * dpi[:, None]
+        self.current_display_dpi = dpi
+        self.current_pages_size_pix = pages_size_pix.astype(np.int64)
+        self.current_rendering_dpi = snap_to_dpi_levels(dpi) if self.fitwidth_flag else dpi
+        self.current_pages_render_size = (self.pages_size_inch * self.current_rendering_dpi[:, None]).astype(np.int64)
 
     def getVisibleRegions(self):
         visRect = self.viewport().rect() # visible area
         visRect = self.mapToScene(visRect).boundingRect() # change to scene coordinates
-        # 
+        self.current_viewport_center = visRect.center()
+        self.current_visible_regions = self.getRegionsInRect(visRect)
+
+    def getPagesInRows(self, top, bottom):
+        # the pages in the rows intersecting [top, bottom) of the scene, by binary search over the rows
+        first_row = int(np.searchsorted(self.row_bottoms, top, side='right'))
+        last_row = int(np.searchsorted(self.row_tops, bottom, side='left'))
+        first_page = max(first_row * self.view_column_count - self.leading_empty_pages, 0)
+        last_page = min(last_row * self.view_column_count - self.leading_empty_pages, self.page_counts)
+        return range(first_page, last_page)
+
+    def getRegionsInRect(self, sceneRect):
+        # the parts of the pages in sceneRect, in item coordinates
         regions = {}
-        for pg_no in range(self.page_counts):
-            flag, x, y, w, h = self.current_pages_rect[pg_no]
+        for pg_no in self.getPagesInRows(sceneRect.top(), sceneRect.bottom()):
+            x, y, w, h = self.current_pages_rect[pg_no]
             pageRect = QtCore.QRectF(x, y, w, h)
-            intsec = visRect.intersected(pageRect)
+            intsec = sceneRect.intersected(pageRect)
             # change to item coordinate
             intsec = QtCore.QRectF(
                 intsec.x() - x, intsec.y() - y, 
@@ -242,19 +333,31 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
             if intsec.isEmpty():
                 continue
             regions[pg_no] = intsec
-
-        self.current_visible_regions = regions
+        return regions
 
     def initializePage(self, page_no):
         if self.page_items[page_no] is None:
-            pageItem = PageGraphicsItem(page_no)
-            self.scene.addItem(pageItem)
+            if self.free_page_items:
+                pageItem = self.free_page_items.pop()
+                pageItem.pageIdx = page_no
+            else:
+                pageItem = PageGraphicsItem(page_no)
+                self.scene.addItem(pageItem)
+            if page_no in self.page_text_objects:
+                pageItem.setTextObjects(self.page_text_objects[page_no])
+            if page_no in self.page_link_objects:
+                pageItem.setLinkObjects(self.page_link_objects[page_no])
             self.page_items[page_no] = pageItem
+            self.live_pages.add(page_no)
         # 
-        if not self.current_pages_rect[page_no][0]:
-            _, x, y, w, h = self.current_pages_rect[page_no]
-            self.page_items[page_no].initialize(x, y, w, h)
-            self.current_pages_rect[page_no][0] = True
+        if not self.pages_initialized[page_no]:
+            x, y, w, h = self.current_pages_rect[page_no]
+            render_w, render_h = self.current_pages_render_size[page_no]
+            render_scale = self.current_display_dpi[page_no] / self.current_rendering_dpi[page_no]
+            if not self.page_items[page_no].initialize(x, y, w, h, int(render_w), int(render_h), float(render_scale)):
+                # the shown tiles are moved to the transient layer, everything should be re-rendered
+                self.rendered_info.pop(page_no, None)
+            self.pages_initialized[page_no] = True
 
     def renderCurrentVisiblePages(self):
         self.getVisibleRegions()
@@ -269,64 +372,265 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
             # initilize page first
             self.initializePage(page_no)
             self.page_items[page_no].updateTransientItems(self.current_visible_regions[page_no])
+            # keep the tiles on screen at the recent end of the shared cache
+            for key in self.page_items[page_no].tileKeys():
+                self.tile_cache.touch(key)
+
+        # a new generation makes all pending requests of this view outdated
+        self.render_generation += 1
+        self.render_service.beginViewport(id(self), self.render_generation)
 
         for page_no in self.current_visible_regions:
-            history_dpi = 0
-            history_roi_list = []
-            if page_no in self.rendered_info:
-                history_dpi, history_roi_list = self.rendered_info[page_no]
-                
-            # split roi to small patches
             roi_raw = self.current_visible_regions[page_no]
-            patch_positions, patches = self.page_items[page_no].get_roi_patches(roi_raw)
-            patch_col_num = self.page_items[page_no].patch_col_num
+            if self.requestPagePatches(page_no, roi_raw, 0, False):
+                self.page_items[page_no].updateTransientItems(roi_raw)
+
+        # then the screens ahead in the scrolling direction, after all visible patches
+        self.prefetchAhead()
+        self.render_service.submitViewport(id(self))
+
+        self.recyclePageItems()
+
+    def recyclePageItems(self):
+        # the number of items in the scene is bounded by the pages around the viewport, not the document length
+        visRect = self.mapToScene(self.viewport().rect()).boundingRect()
+        margin = visRect.height() * PAGE_ITEM_MARGIN_SCREENS
+        kept_pages = self.getPagesInRows(visRect.top() - margin, visRect.bottom() + margin)
+        far_pages = [page_no for page_no in self.live_pages if page_no not in kept_pages]
+        for page_no in far_pages:
+            self.releasePageItem(page_no)
+        if len(far_pages) > 0:
+            debug("%d page items recycled, %d alive, %d free" % (len(far_pages), len(self.live_pages), len(self.free_page_items)))
+
+    def releasePageItem(self, page_no):
+        pageItem = self.page_items[page_no]
+        self.page_items[page_no] = None
+        self.live_pages.discard(page_no)
+        self.pages_initialized[page_no] = False
+        self.rendered_info.pop(page_no, None)
+        # the pixmaps stay in the shared tile cache, ready if the page comes back
+        for key in pageItem.tileKeys():
+            self.tile_cache.release(key, self)
+        if len(self.free_page_items) < MAX_FREE_PAGE_ITEMS:
+            pageItem.reset()
+            self.free_page_items.append(pageItem)
+        else:
+            self.scene.removeItem(pageItem)
+
+    def setPageTextObjects(self, page_no, text_objects):
+        self.page_text_objects[page_no] = text_objects
+        if self.page_items[page_no] is not None:
+            self.page_items[page_no].setTextObjects(text_objects)
+
+    def setPageLinkObjects(self, page_no, link_objects):
+        self.page_link_objects[page_no] = link_objects
+        if self.page_items[page_no] is not None:
+            self.page_items[page_no].setLinkObjects(link_objects)
+
+    def requestPagePatches(self, page_no, roi_raw, priority_offset, prefetch):
+        # request the patches of the page intersecting roi_raw (in item coordinates),
+        # return True if any pixmap is added to the transient layer
+        page_x, page_y = self.current_pages_rect[page_no, :2]
+        center_x = self.current_viewport_center.x()
+        center_y = self.current_viewport_center.y()
+        history_dpi = 0
+        history_patch_ids = set()
+        if page_no in self.rendered_info:
+            history_dpi, history_patch_ids = self.rendered_info[page_no]
+            
+        # split roi to small patches, in the rendering coordinates
+        patch_positions, patches = self.page_items[page_no].get_roi_patches(roi_raw)
+        patch_col_num = self.page_items[page_no].patch_col_num
+        render_scale = self.page_items[page_no].render_scale
+
+        dpi = float(self.current_rendering_dpi[page_no])
+        transient_added = False
+
+        # a coarse image first for a page showing nothing yet (not needed if the page is only a few patches)
+        if not prefetch and self.page_items[page_no].isBlank() and patch_col_num > COARSE_MIN_PATCH_COLS:
+            roi_center = roi_raw.center()
+            priority = abs(page_x + roi_center.x() - center_x) + abs(page_y + roi_center.y() - center_y)
+            transient_added |= self.requestCoarsePage(page_no, dpi, priority - COARSE_PRIORITY_BOOST)
+
+        for i in range(len(patches)):
+            pRow, pCol = patch_positions[i]
+            roi = patches[i]
+            patch_id = self.page_items[page_no].get_patch_id(pRow, pCol, patch_col_num)
+
+            # already shown, no need to render
+            if dpi == history_dpi and patch_id in history_patch_ids:
+                continue
 
-            dpi = self.current_rendering_dpi[page_no]
-            for i in range(len(patches)):
-                pRow, pCol = patch_positions[i]
-                pIdx = pRow * patch_col_num + pCol
-                roi = patches[i]
+            # rendered before (maybe by another view), take it from the shared tile cache
+            cached_tile = self.tile_cache.lookup((self.doc_id, page_no, dpi, patch_id))
+            if cached_tile is not None:
+                pixmap, dx, dy = cached_tile
+                self.addTile(page_no, dpi, patch_id, pixmap, dx, dy)
+                continue
 
-                # already cached, no need to render
-                if dpi == history_dpi and roi in history_roi_list:
-                    continue
+            # show the tile saved on disk at once, the fresh rendering requested below will replace it
+            if not prefetch and self.tile_disk_reader and (page_no, dpi, patch_id) not in self.disk_checked_patches:
+                self.disk_checked_patches.add((page_no, dpi, patch_id))
+                self.tile_disk_reader.request(self.render_generation, self.doc_id, page_no, dpi, patch_id)
 
-                # assign render index according to the page number and the patch position
-                prefixNum = page_no % self.render_num
-                render_idx = (prefixNum + pIdx) % self.render_num
+            # patches nearer to the viewport center are rendered first (L1 distance in scene coordinates)
+            roi_center = roi.center() * render_scale
+            priority = abs(page_x + roi_center.x() - center_x) + abs(page_y + roi_center.y() - center_y)
 
-                self.render_list[render_idx].requestRenderPage(page_no, dpi, roi, self.current_visible_regions)
+            render_idx = self.render_service.requestRenderPage(
+                id(self), page_no, dpi, roi, patch_id, priority + priority_offset
+                )
+            debug("<- Render %d Requested : <page:%d> <dpi:%.2f> <roi_raw: %.1f %.1f %.1f %.1f> <roi: %.1f %.1f %.1f %.1f> <prefetch: %d>" % (
+                render_idx, page_no, dpi, 
+                roi_raw.left(), roi_raw.top(), roi_raw.width(), roi_raw.height(), 
+                roi.left(), roi.top(), roi.width(), roi.height(), prefetch
+                ))
+
+        return transient_added
+
+    def prefetchAhead(self):
+        # the faster the scrolling, the more screens ahead are prefetched
+        visRect = self.mapToScene(self.viewport().rect()).boundingRect()
+        dir_x, dir_y = self.scroll_direction
+        if dir_x != 0:
+            step = visRect.width()
+            speed = abs(self.scroll_velocity[0])
+        else:
+            step = visRect.height()
+            speed = abs(self.scroll_velocity[1])
+        if step <= 0:
+            return
+        screens = min(PREFETCH_MAX_SCREENS, max(1.0, speed * PREFETCH_LOOKAHEAD_SECONDS / step))
+        length = screens * step
+        #
+        if dir_x > 0:
+            aheadRect = QtCore.QRectF(visRect.right(), visRect.top(), length, visRect.height())
+        elif dir_x < 0:
+            aheadRect = QtCore.QRectF(visRect.left() - length, visRect.top(), length, visRect.height())
+        elif dir_y < 0:
+            aheadRect = QtCore.QRectF(visRect.left(), visRect.top() - length, visRect.width(), length)
+        else:
+            aheadRect = QtCore.QRectF(visRect.left(), visRect.bottom(), visRect.width(), length)
+        #
+        regions = self.getRegionsInRect(aheadRect)
+        for page_no in regions:
+            # the tiles are added to the page item, ready before it becomes visible
+            self.initializePage(page_no)
+            self.requestPagePatches(page_no, regions[page_no], PREFETCH_PRIORITY_OFFSET, True)
+
+    def updateScrollVelocity(self):
+        now = time.time()
+        hValue = self.horizontalScrollBar().value()
+        vValue = self.verticalScrollBar().value()
+        last_state = self.last_scroll_state
+        self.last_scroll_state = [now, hValue, vValue]
+        if last_state is None:
+            return
+        t0, h0, v0 = last_state
+        dt = now - t0
+        if dt <= 0:
+            return
+        dh = hValue - h0
+        dv = vValue - v0
+        if dt > SCROLL_IDLE_SECONDS:
+            self.scroll_velocity = [0.0, 0.0] # a new scrolling starts
+        else:
+            # smoothed, the handler is called every 20 ms while scrolling
+            vx, vy = self.scroll_velocity
+            self.scroll_velocity = [0.5 * vx + 0.5 * dh / dt, 0.5 * vy + 0.5 * dv / dt]
+        # keep the direction of the last movement
+        if abs(dh) > abs(dv):
+            self.scroll_direction = [1 if dh > 0 else -1, 0]
+        elif dv != 0:
+            self.scroll_direction = [0, 1 if dv > 0 else -1]
+
+    def requestCoarsePage(self, page_no, dpi, priority):
+        # return True if the coarse image is already in the shared tile cache and added
+        coarse_dpi = self.coarseDpi(page_no, dpi)
+        cached_tile = self.tile_cache.lookup((self.doc_id, page_no, coarse_dpi, COARSE_PATCH_ID))
+        if cached_tile is not None:
+            pixmap, dx, dy = cached_tile
+            self.addCoarseTile(page_no, coarse_dpi, pixmap, dx, dy)
+            return True
+        w_inch, h_inch = self.pages_size_inch[page_no]
+        roi = QtCore.QRectF(0, 0, w_inch * coarse_dpi, h_inch * coarse_dpi)
+        self.render_service.requestRenderPage(
+            id(self), page_no, coarse_dpi, roi, COARSE_PATCH_ID, priority
+            )
+        debug("<- Coarse Render Requested : <page:%d> <dpi:%.2f>" % (page_no, coarse_dpi))
+        return False
+
+    def coarseDpi(self, page_no, dpi):
+        w_inch, h_inch = self.pages_size_inch[page_no]
+        return float(min(dpi * COARSE_DPI_RATIO, COARSE_MAX_PIXELS / max(w_inch, h_inch, 1e-3)))
+
+    def addCoarseTile(self, page_no, coarse_dpi, pixmap, dx, dy):
+        key = (self.doc_id, page_no, coarse_dpi, COARSE_PATCH_ID)
+        ratio = self.current_display_dpi[page_no] / coarse_dpi
+        self.page_items[page_no].addCachedPixmap(COARSE_PATCH_ID, pixmap, dx, dy, ratio, key)
+        self.tile_cache.attach(key, self)
+
+    def onTileLoadedFromDisk(self, doc_id, page_no, dpi, patch_id, tile):
+        # the fresh rendering may already be shown, or the page changed while the file was read
+        if doc_id != self.doc_id or page_no >= len(self.current_rendering_dpi):
+            return
+        if dpi != self.current_rendering_dpi[page_no] or self.page_items[page_no] is None or not self.pages_initialized[page_no]:
+            return
+        if page_no in self.rendered_info and self.rendered_info[page_no][0] == dpi and patch_id in self.rendered_info[page_no][1]:
+            return
+        tile_dpi, tile_roi, image = tile
+        debug("<- Tile loaded from disk : <page:%d> <dpi:%.2f> <patch:%d>" % (page_no, tile_dpi, patch_id))
+        pixmap = QtGui.QPixmap.fromImage(image)
+        # the dpi is quantized in the cache, scale the tile to the displayed size
+        ratio = self.current_display_dpi[page_no] / tile_dpi
+        self.page_items[page_no].addCachedPixmap(patch_id, pixmap, tile_roi.x(), tile_roi.y(), ratio)
+        if page_no in self.current_visible_regions:
+            self.page_items[page_no].updateTransientItems(self.current_visible_regions[page_no])
 
-                debug("<- Render %d Requested : <page:%d> <dpi:%.2f> <roi_raw: %.1f %.1f %.1f %.1f> <roi: %.1f %.1f %.1f %.1f>" % (
-                    render_idx, page_no, dpi, 
-                    roi_raw.left(), roi_raw.top(), roi_raw.width(), roi_raw.height(), 
-                    roi.left(), roi.top(), roi.width(), roi.height()
-                    ))
+    def onTilesRendered(self, doc_id, tiles):
+        # a batch of tiles from a worker, all added in this call so that the scene is repainted once
+        if doc_id != self.doc_id:
+            debug("document changed: %s -> %s" % (doc_id, self.doc_id))
+            return
+        for page_no, dpi, patch_id, roi, pixmap in tiles:
+            self.addRenderedTile(page_no, dpi, patch_id, roi, pixmap)
 
-    def onRenderedImageReceived(self, filename, page_no, dpi, roi, image):
+    def addRenderedTile(self, page_no, dpi, patch_id, roi, pixmap):
         debug("-> Rendering Completed : <page:%d> <dpi:%.2f> <roi: %.1f %.1f %.1f %.1f>" % (
             page_no, dpi, roi.left(), roi.top(), roi.width(), roi.height()
         ))
 
-        if filename != self.current_filename:
-            debug("file name changed: %s -> %s" % (filename, self.current_filename))
-            return
-
         # if page_no not in self.current_visible_regions:
         #     debug("become unvisible: %d. skipping" % page_no)
         #     return
         
-        if page_no in self.rendered_info \
-           and self.rendered_info[page_no][0] == dpi \
-           and roi in self.rendered_info[page_no][1]:
-            debug("duplicated rendering. skipping")
+        if len(self.current_rendering_dpi) == 0:
             return
 
-        if len(self.current_rendering_dpi) == 0:
+        # the coarse image of a page, shown in the transient layer
+        current_dpi = float(self.current_rendering_dpi[page_no])
+        if patch_id == COARSE_PATCH_ID and dpi == self.coarseDpi(page_no, current_dpi):
+            if not self.pages_initialized[page_no] or not self.page_items[page_no].isBlank():
+                return
+            self.addCoarseTile(page_no, dpi, pixmap, roi.x(), roi.y())
+            if page_no in self.current_visible_regions:
+                self.page_items[page_no].updateTransientItems(self.current_visible_regions[page_no])
             return
+
         # too late, the current rendering dpi is already changed
-        if dpi != self.current_rendering_dpi[page_no]:
-            debug("unmatched DPI: %.2f -> %.2f. skipping" % (dpi, self.current_rendering_dpi[page_no]))
+        if dpi != current_dpi:
+            debug("unmatched DPI: %.2f -> %.2f. skipping" % (dpi, current_dpi))
+            return
+
+        # the tile may be requested by another view for a page not shown here,
+        # or the page is not placed in the current layout yet
+        if self.page_items[page_no] is None or not self.pages_initialized[page_no]:
+            return
+
+        if page_no in self.rendered_info \
+           and self.rendered_info[page_no][0] == dpi \
+           and patch_id in self.rendered_info[page_no][1]:
+            debug("duplicated rendering. skipping")
             return
 
         # crop to container's size
@@ -335,14 +639,8 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         # roi = QtCore.QRect(1,1,containerSize.width()-2, containerSize.height()-2)
         # image = image.copy(roi)
 
-        self.page_items[page_no].addPixmap(QtGui.QPixmap.fromImage(image), roi.x(), roi.y(), dpi)
-        
-        if page_no in self.rendered_info:
-            dpi0, roi_list = self.rendered_info[page_no]
-            assert(dpi == dpi0)
-            roi_list.append(roi)
-        else:
-            self.rendered_info[page_no] = [dpi, [roi]]
+        # the pixmap is already kept in the shared tile cache by the render service
+        self.addTile(page_no, dpi, patch_id, pixmap, roi.x(), roi.y())
 
         # # Request to render next page
         # if self.current_page <= page_no < (self.current_page + self.max_preload - 2):
@@ -360,12 +658,33 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
 
         # debug("Rendered Images: ", self.rendered_pages)
 
+    def addTile(self, page_no, dpi, patch_id, pixmap, dx, dy):
+        key = (self.doc_id, page_no, dpi, patch_id)
+        self.page_items[page_no].addPixmap(pixmap, dx, dy, dpi, key)
+        self.tile_cache.attach(key, self)
+        #
+        if page_no in self.rendered_info:
+            dpi0, patch_ids = self.rendered_info[page_no]
+            assert(dpi == dpi0)
+            patch_ids.add(patch_id)
+        else:
+            self.rendered_info[page_no] = [dpi, set([patch_id])]
+
+    def onTileEvicted(self, key):
+        # called by the shared tile cache, drop our references to the pixmap
+        doc_id, page_no, dpi, patch_id = key
+        if doc_id != self.doc_id or self.page_items[page_no] is None:
+            return
+        self.page_items[page_no].removeTile(key)
+        if page_no in self.rendered_info and self.rendered_info[page_no][0] == dpi:
+            self.rendered_info[page_no][1].discard(patch_id)
+
     def __rearrangePages(self):
         if len(self.current_pages_size_pix) == 0:
             return
 
-        pages_width_pix = np.array(self.current_pages_size_pix)[:, 0]
-        pages_height_pix = np.array(self.current_pages_size_pix)[:, 1]
+        pages_width_pix = self.current_pages_size_pix[:, 0]
+        pages_height_pix = self.current_pages_size_pix[:, 1]
 
         rowNum = math.ceil((self.page_counts + self.leading_empty_pages) / self.view_column_count)
         pages_width_pix = np.concatenate((np.zeros((self.leading_empty_pages)), pages_width_pix))
@@ -382,39 +701,38 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         rowHeights = pages_height_pix.max(axis=1)
         colWidths = pages_width_pix.max(axis=0)
 
-        rowCumHeights = np.cumsum(rowHeights)
-        colCumWidths = np.cumsum(colWidths)
-
-        self.current_pages_rect = []
-        for i in range(self.page_counts):
-            row = int((i + self.leading_empty_pages) / self.view_column_count)
-            col = int((i + self.leading_empty_pages) % self.view_column_count)
-
-            startx = colCumWidths[col - 1] if col > 0 else 0
-            starty = rowCumHeights[row - 1] if row > 0 else 0
-
-            # add spacing 
-            startx += (self.horispacing * (col + 1))
-            starty += (self.vertspacing * (row + 1))
-
-            # center it
-            startx += (colWidths[col] - pages_width_pix[row][col]) / 2
-            starty += (rowHeights[row] - pages_height_pix[row][col]) / 2
-
-            # save page rect, False means uninitialized
-            self.current_pages_rect.append([False, startx, starty, pages_width_pix[row][col], pages_height_pix[row][col]])
-            
-            # make all pages invisible first
-            if self.page_items[i]:
-                self.page_items[i].setVisible(False)
+        # the start of each row and column, with spacing
+        rowIdx = np.arange(rowNum)
+        colIdx = np.arange(self.view_column_count)
+        rowStarts = np.concatenate(([0], np.cumsum(rowHeights)[:-1])) + self.vertspacing * (rowIdx + 1)
+        colStarts = np.concatenate(([0], np.cumsum(colWidths)[:-1])) + self.horispacing * (colIdx + 1)
+
+        # all pages at once, centered in their cells
+        cellIdx = np.arange(self.page_counts) + self.leading_empty_pages
+        rows = cellIdx // self.view_column_count
+        cols = cellIdx % self.view_column_count
+        widths = pages_width_pix[rows, cols]
+        heights = pages_height_pix[rows, cols]
+        startx = colStarts[cols] + (colWidths[cols] - widths) / 2
+        starty = rowStarts[rows] + (rowHeights[rows] - heights) / 2
+        self.current_pages_rect = np.stack((startx, starty, widths, heights), axis=1)
+
+        # make the placed pages invisible, they are initialized again when needed
+        for i in np.flatnonzero(self.pages_initialized):
+            self.page_items[i].setVisible(False)
+        self.pages_initialized[:] = False
+
+        # the rows are sorted by y, getPagesInRows() searches in them
+        self.row_tops = rowStarts
+        self.row_bottoms = rowStarts + rowHeights
 
         sceneWidthFix = colWidths.sum() + (self.view_column_count + 1) * self.horispacing
         sceneHeightFix = rowHeights.sum() + (rowNum + 1) * self.vertspacing
         self.scene.setSceneRect(0, 0, sceneWidthFix, sceneHeightFix)
         
-        # after rearrangement, the cached rendering information is useless
-        # that means, everything should be re-rendered
-        self.rendered_info = {}
+        # the rendered tiles of a page are kept by initializePage() if its dpi level is unchanged
+        self.disk_checked_patches = set()
+        self.last_scroll_state = None # the scroll values jump, not a movement
 
     def viewAtPageAnchor(self, relocationInfo):
         page_no, x_ratio, y_ratio, x_view, y_view = relocationInfo
@@ -423,7 +741,7 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         dx_center = viewRect.width() / 2 - x_view
         dy_center = viewRect.height() / 2 - y_view
         # 
-        _, new_x, new_y, new_w, new_h = self.current_pages_rect[page_no]
+        new_x, new_y, new_w, new_h = self.current_pages_rect[page_no]
         scene_cx = new_x + x_ratio * new_w + dx_center
         scene_cy = new_y + y_ratio * new_h + dy_center
         self.centerOn(scene_cx, scene_cy)
@@ -434,19 +752,19 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         scene_pos = self.mapToScene(view_x, view_y)
         item = self.itemAt(view_x, view_y)
         if item:
-            item = item.parentItem() if item.parentItem() else item
+            item = item.topLevelItem() # the transient items are grandchildren of the page
             assert(isinstance(item, PageGraphicsItem))
-            page_no = self.page_items.index(item)
+            page_no = item.pageIdx
         else:
             # at empty places, find the nearest page
-            page_rects = np.array(self.current_pages_rect)[:, 1:]
+            page_rects = self.current_pages_rect
             pages_cx = page_rects[:, 0] + page_rects[:, 2] / 2
             pages_cy = page_rects[:, 1] + page_rects[:, 3] / 2
             distance = np.abs(pages_cx - scene_pos.x()) + np.abs(pages_cy - scene_pos.y()) # L1 distance is enough
             page_no = int(np.argmin(distance))
         # 
         # compute relative position
-        _, x, y, w, h = self.current_pages_rect[page_no]
+        x, y, w, h = self.current_pages_rect[page_no]
         x_ratio = (scene_pos.x() - x) / w
         y_ratio = (scene_pos.y() - y) / h
 
@@ -469,13 +787,10 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
                 relocationInfo = [0,0,0,0,0]
 
         # compute DPI
+        time_0 = time.time()
         self.computePagesDPI()
-        # time_a = time.time()
-        # debug("A ", time_a - time_0)
-
         self.__rearrangePages()
-        # time_b = time.time()
-        # debug("B ", time_b - time_a)
+        debug("Layout of %d pages in %.2f ms" % (self.page_counts, (time.time() - time_0) * 1000))
 
         # set viewport after rearranging (make page position under cursor unchanged)
         self.viewAtPageAnchor(relocationInfo)
@@ -586,7 +901,7 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         # make the page as the first visible one (it can not guarantee for multi-column cases)
         visRect = self.viewport().rect() # visible area
         visRect = self.mapToScene(visRect).boundingRect() # change to scene coordinates
-        flag, x, y, w, h = self.current_pages_rect[pg_no]
+        x, y, w, h = self.current_pages_rect[pg_no]
         scene_cx = x + visRect.width() / 2
         scene_cy = y + visRect.height() / 2
         self.centerOn(scene_cx, scene_cy)
@@ -601,16 +916,22 @@ class BaseDocGraphicsView(QtWidgets.QGraphicsView):
         debug('All renders are destroyed')
 
     def destroyRenders(self):
-        for rd in self.render_list:
-            rd.stop()
-        self.render_list = []
-        self.render_num = 0
+        # the render service is shared and stopped by its owner, only stop receiving tiles here
+        self.tile_cache.detach(self)
+        if self.render_service is not None:
+            self.render_service.tilesRendered.disconnect(self.onTilesRendered)
+            self.render_service = None
+        if self.tile_disk_reader is not None:
+            self.tile_disk_reader.tileLoaded.disconnect(self.onTileLoadedFromDisk)
+            self.tile_disk_reader.close()
+            self.tile_disk_reader = None
 
     def onScrollValueChanged(self):
         self.scrollValueChanged_flag = True
 
     def scrollValueChangedHandler(self):
         if self.scrollValueChanged_flag:
+            self.updateScrollVelocity()
             self.onViewportChanged()
             self.scrollValueChanged_flag = False
 
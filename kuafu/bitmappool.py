@@ -0,0 +1,93 @@
+from PyQt5 import QtGui
+from collections import OrderedDict
+from utils import debug
+import pypdfium as PDFIUM
+
+DEFAULT_BITMAP_POOL_BYTES = 64 * 1024 * 1024
+MAX_WRAPPED_BITMAPS = 64
+
+class BitmapPool(object):
+    """
+    Reusable PDFium bitmaps of a PdfInternalWorker, bucketed by the tile size.
+    The patches of a page have only a few different sizes, so the same bitmaps and backing buffers
+    are used again and again while scrolling, instead of being allocated for every tile.
+    Two kinds of bitmaps are kept:
+    the wrappers over the shared tile slots (no pixel memory of their own, keyed by the address and size),
+    and the bitmaps over QImage buffers for the tiles not fitting in a slot, which are capped in bytes.
+    """
+    def __init__(self, max_bytes=DEFAULT_BITMAP_POOL_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0 # of the free buffers
+        self.wrapped_bitmaps = OrderedDict() # (address, width, height, stride) -> bitmap
+        self.free_buffers = OrderedDict() # (width, height) -> list of [image, bitmap], the least recently used first
+        self.lent_buffers = {} # address -> [image, bitmap]
+
+    def wrap(self, img):
+        # return a bitmap over the memory of img, which must stay at the same address (e.g. a shared tile slot)
+        key = (int(img.constBits()), img.width(), img.height(), img.bytesPerLine())
+        bitmap = self.wrapped_bitmaps.get(key)
+        if bitmap is not None:
+            self.wrapped_bitmaps.move_to_end(key)
+            return bitmap
+        bitmap = PDFIUM.FPDFBitmap_CreateEx(key[1], key[2], PDFIUM.FPDFBitmap_BGRx, key[0], key[3])
+        self.wrapped_bitmaps[key] = bitmap
+        if len(self.wrapped_bitmaps) > MAX_WRAPPED_BITMAPS:
+            _, oldest = self.wrapped_bitmaps.popitem(last=False)
+            PDFIUM.FPDFBitmap_Destroy(oldest)
+        return bitmap
+
+    def acquire(self, width, height):
+        # return [image, bitmap] sharing one buffer, give it back by release(image) when the image is not used anymore
+        bucket = self.free_buffers.get((width, height))
+        if bucket:
+            entry = bucket.pop()
+            if len(bucket) == 0:
+                del self.free_buffers[(width, height)]
+            self.total_bytes -= entry[0].byteCount()
+        else:
+            img = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+            # constBits() never detaches, the address is fixed as long as the image is not modified by Qt
+            bitmap = PDFIUM.FPDFBitmap_CreateEx(width, height, PDFIUM.FPDFBitmap_BGRx, int(img.constBits()), img.bytesPerLine())
+            entry = [img, bitmap]
+        self.lent_buffers[int(entry[0].constBits())] = entry
+        return entry
+
+    def release(self, img):
+        # images not acquired from the pool (e.g. in shared tile slots) are ignored
+        entry = self.lent_buffers.pop(int(img.constBits()), None)
+        if entry is None:
+            return
+        nbytes = img.byteCount()
+        if nbytes > self.max_bytes:
+            PDFIUM.FPDFBitmap_Destroy(entry[1])
+            return
+        size = (img.width(), img.height())
+        self.free_buffers.setdefault(size, []).append(entry)
+        self.free_buffers.move_to_end(size)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes:
+            oldest_size = next(iter(self.free_buffers))
+            bucket = self.free_buffers[oldest_size]
+            oldest = bucket.pop(0)
+            if len(bucket) == 0:
+                del self.free_buffers[oldest_size]
+            self.total_bytes -= oldest[0].byteCount()
+            PDFIUM.FPDFBitmap_Destroy(oldest[1])
+
+    def clear(self):
+        for bitmap in self.wrapped_bitmaps.values():
+            PDFIUM.FPDFBitmap_Destroy(bitmap)
+        for bucket in self.free_buffers.values():
+            for img, bitmap in bucket:
+                PDFIUM.FPDFBitmap_Destroy(bitmap)
+        # the images still lent out own their buffers and stay valid, only the bitmaps over them are gone,
+        # release() ignores them afterwards
+        for img, bitmap in self.lent_buffers.values():
+            PDFIUM.FPDFBitmap_Destroy(bitmap)
+        debug("bitmap pool cleared: %d wrapped, %d bytes free, %d lent" % (
+            len(self.wrapped_bitmaps), self.total_bytes, len(self.lent_buffers)
+            ))
+        self.wrapped_bitmaps = OrderedDict()
+        self.free_buffers = OrderedDict()
+        self.lent_buffers = {}
+        self.total_bytes = 0
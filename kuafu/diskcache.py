@@ -0,0 +1,184 @@
+from PyQt5 import QtCore
+from PyQt5 import QtGui
+from utils import debug, file_digest
+import os
+import queue
+import struct
+import threading
+
+DEFAULT_DISK_CACHE_BYTES = 512 * 1024 * 1024
+
+# magic, dpi, roi (x, y, w, h), image width, height, bytes per line and QImage format
+TILE_HEADER = struct.Struct('<4sdddddIIII')
+TILE_MAGIC = b'KFT1'
+# the tiles waiting to be written, more are dropped rather than holding their pixels in memory
+MAX_PENDING_WRITES = 64
+
+def disk_cache_key(doc_id):
+    # the content hash of a document (filename, size, mtime_ns) with its modification time,
+    # file_digest() only reads the head and tail, an edit in the middle must not serve the old tiles
+    filename, size, mtime_ns = doc_id
+    if mtime_ns is None:
+        return None
+    try:
+        return "%s_%d" % (file_digest(filename), mtime_ns)
+    except OSError:
+        return None
+
+class TileDiskCache(object):
+    """
+    Rendered tiles stored as raw pixels under the application data path,
+    keyed by disk_cache_key() of the document, the page number, the quantized dpi and the patch id.
+    The modification time of a file is used as its last access time for the LRU eviction.
+    It is shared by all processes, the workers write tiles and the views read them.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.written_bytes = 0 # since the last trim
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def tile_path(self, doc_hash, page_no, dpi, patch_id):
+        dpi_bucket = int(round(dpi * 16)) # 1/16 dpi is far below a pixel for any page
+        return os.path.join(self.cache_dir, "%s_%d_%d_%d.tile" % (doc_hash, page_no, dpi_bucket, patch_id))
+
+    def load(self, doc_hash, page_no, dpi, patch_id):
+        # return [dpi, roi, image] of the cached tile, or None
+        path = self.tile_path(doc_hash, page_no, dpi, patch_id)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path) # mark as recently used
+        except OSError:
+            return None
+        if len(data) < TILE_HEADER.size:
+            return None
+        magic, tile_dpi, x, y, w, h, width, height, stride, fmt = TILE_HEADER.unpack_from(data)
+        if magic != TILE_MAGIC or len(data) != TILE_HEADER.size + stride * height:
+            return None
+        # copy out of the file data, QPixmap.fromImage() would share the memory for the native formats
+        image = QtGui.QImage(data[TILE_HEADER.size:], width, height, stride, QtGui.QImage.Format(fmt)).copy()
+        return [tile_dpi, QtCore.QRectF(x, y, w, h), image]
+
+    def store(self, doc_hash, page_no, dpi, patch_id, roi, img):
+        path = self.tile_path(doc_hash, page_no, dpi, patch_id)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        ptr = img.constBits()
+        ptr.setsize(img.byteCount())
+        header = TILE_HEADER.pack(
+            TILE_MAGIC, dpi, roi.x(), roi.y(), roi.width(), roi.height(),
+            img.width(), img.height(), img.bytesPerLine(), int(img.format())
+            )
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(ptr)
+            os.replace(tmp_path, path) # other processes never see a partial file
+        except OSError as e:
+            debug("failed to write tile cache %s: %s" % (path, e))
+            return
+        #
+        self.written_bytes += TILE_HEADER.size + img.byteCount()
+        if self.written_bytes > self.max_bytes / 16:
+            self.trim()
+
+    def trim(self):
+        # remove the least recently used tiles until the total size is below the cap
+        self.written_bytes = 0
+        files = []
+        total_bytes = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith('.tile'):
+                        continue
+                    stat = entry.stat()
+                    files.append([stat.st_mtime, stat.st_size, entry.path])
+                    total_bytes += stat.st_size
+        except OSError:
+            return
+        if total_bytes <= self.max_bytes:
+            return
+        files.sort()
+        for mtime, size, path in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass # may be removed by another process already
+            total_bytes -= size
+            if total_bytes <= self.max_bytes:
+                break
+        debug("tile cache trimmed to %d bytes" % total_bytes)
+
+class TileDiskWriter(object):
+    """
+    The tiles stored to a TileDiskCache by a thread of the worker, the render loop only queues copies of them.
+    """
+    def __init__(self, disk_cache):
+        self.disk_cache = disk_cache
+        self.queue = queue.Queue(MAX_PENDING_WRITES)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def store(self, doc_hash, page_no, dpi, patch_id, roi, img):
+        # the image may be backed by a pooled bitmap which is reused after the call
+        try:
+            self.queue.put_nowait([doc_hash, page_no, dpi, patch_id, roi, img.copy()])
+        except queue.Full:
+            debug("tile cache writes pending, tile of page %d dropped" % page_no)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.disk_cache.store(*item)
+
+    def close(self):
+        # the pending tiles are written first
+        self.queue.put(None)
+        self.thread.join()
+
+class TileDiskReader(QtCore.QObject):
+    """
+    The tiles of a TileDiskCache loaded by a thread of the GUI process,
+    so that neither the file reads nor the hashing of the document stall the views.
+    """
+    tileLoaded = QtCore.pyqtSignal(object, int, float, int, list) # doc_id, page_no, dpi, patch_id, [tile_dpi, roi, image]
+
+    def __init__(self, disk_cache):
+        super(TileDiskReader, self).__init__()
+        self.disk_cache = disk_cache
+        self.doc_keys = {} # doc_id -> disk_cache_key(), only touched by the thread
+        self.generation = 0 # of the latest viewport, the lookups of older ones are skipped
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, generation, doc_id, page_no, dpi, patch_id):
+        self.generation = max(self.generation, generation)
+        self.queue.put([generation, doc_id, page_no, dpi, patch_id])
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            generation, doc_id, page_no, dpi, patch_id = item
+            if generation < self.generation:
+                # scrolled away before the lookup, the tile is rendered anyway if it comes back into view
+                continue
+            if doc_id not in self.doc_keys:
+                self.doc_keys = {doc_id: disk_cache_key(doc_id)}
+            doc_hash = self.doc_keys[doc_id]
+            if doc_hash is None:
+                continue
+            tile = self.disk_cache.load(doc_hash, page_no, dpi, patch_id)
+            if tile is not None:
+                # queued to the GUI thread, the QImage is turned into a QPixmap there
+                self.tileLoaded.emit(doc_id, page_no, dpi, patch_id, tile)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
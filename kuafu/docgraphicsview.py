@@ -9,8 +9,8 @@ from utils import debug
 class DocGraphicsView(BaseDocGraphicsView):
     pageRelocationRequest = QtCore.pyqtSignal(int, float, float)
 
-    def __init__(self, parent, render_num=2):
-        super(DocGraphicsView, self).__init__(parent, render_num)
+    def __init__(self, parent):
+        super(DocGraphicsView, self).__init__(parent)
 
         self.scene.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.white)) # set background
         self.textSelectionMode = False
@@ -21,12 +21,12 @@ class DocGraphicsView(BaseDocGraphicsView):
         scene_pos = self.mapToScene(view_x, view_y)
         item = self.itemAt(view_x, view_y)
         if item:
-            item = item.parentItem() if item.parentItem() else item
+            item = item.topLevelItem() # the transient items are grandchildren of the page
             assert(isinstance(item, PageGraphicsItem))
-            page_no = self.page_items.index(item)
+            page_no = item.pageIdx
             #
-            _, x, y, w, h = self.current_pages_rect[page_no]
-            scalingRatio = self.current_rendering_dpi[page_no] / 72.0
+            x, y, w, h = self.current_pages_rect[page_no]
+            scalingRatio = self.current_display_dpi[page_no] / 72.0
             hasText = item.textUnder((scene_pos.x() - x) / scalingRatio, (scene_pos.y() - y) / scalingRatio)
         return hasText
 
@@ -36,12 +36,12 @@ class DocGraphicsView(BaseDocGraphicsView):
         scene_pos = self.mapToScene(view_x, view_y)
         item = self.itemAt(view_x, view_y)
         if item:
-            item = item.parentItem() if item.parentItem() else item
+            item = item.topLevelItem() # the transient items are grandchildren of the page
             assert(isinstance(item, PageGraphicsItem))
-            page_no = self.page_items.index(item)
+            page_no = item.pageIdx
             #
-            _, x, y, w, h = self.current_pages_rect[page_no]
-            scalingRatio = self.current_rendering_dpi[page_no] / 72.0
+            x, y, w, h = self.current_pages_rect[page_no]
+            scalingRatio = self.current_display_dpi[page_no] / 72.0
             dest = item.linkUnder((scene_pos.x() - x) / scalingRatio, (scene_pos.y() - y) / scalingRatio)
         return dest
 
@@ -0,0 +1,95 @@
+from utils import debug, file_digest
+import os
+import numpy as np
+
+DEFAULT_DOC_INFO_BYTES = 64 * 1024 * 1024
+
+class DocInfoCache(object):
+    """
+    The page sizes and the table of contents of the documents, kept in .npz sidecars under the application data path.
+    A sidecar is keyed by the file size, the modification time and the content hash of the document,
+    the sizes are stored as a float32 array and the TOC as a flat table (levels, titles, pages).
+    It lets a reopened document be laid out at once, the workers still read both in the background
+    and the sidecar is rewritten if they differ.
+    Like the tile cache, the modification time of a sidecar is its last access time, and the least recently used
+    ones are removed when the total size is above the cap.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_DOC_INFO_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def sidecar_path(self, filename):
+        stat = os.stat(filename)
+        return os.path.join(self.cache_dir, "%s_%d_%d.npz" % (file_digest(filename), stat.st_size, stat.st_mtime_ns))
+
+    def load(self, filename):
+        # return [pages_size_inch, toc] of the document, or None
+        try:
+            path = self.sidecar_path(filename)
+            with np.load(path, allow_pickle=False) as data:
+                pages_size_inch = data['sizes'].astype(np.float64)
+                levels = data['toc_levels'].tolist()
+                titles = data['toc_titles'].tolist()
+                pages = data['toc_pages'].tolist()
+            os.utime(path) # mark as recently used
+        except (OSError, KeyError, ValueError):
+            return None
+        toc = [[lvl, title, page, None] for lvl, title, page in zip(levels, titles, pages)]
+        return [pages_size_inch, toc]
+
+    def store(self, filename, pages_size_inch, toc):
+        try:
+            path = self.sidecar_path(filename)
+        except OSError:
+            return
+        tmp_path = "%s.%d.tmp.npz" % (path, os.getpid())
+        try:
+            np.savez(
+                tmp_path,
+                sizes=np.asarray(pages_size_inch, dtype=np.float32).reshape(-1, 2),
+                toc_levels=np.array([item[0] for item in toc], dtype=np.int32),
+                toc_titles=np.array([item[1] for item in toc], dtype=np.str_),
+                toc_pages=np.array([item[2] for item in toc], dtype=np.int32),
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            debug("failed to write document info %s: %s" % (path, e))
+            return
+        debug("document info stored: %d pages, %d toc items" % (len(pages_size_inch), len(toc)))
+        self.trim(os.path.basename(path))
+
+    def trim(self, current_name):
+        # the sidecars of earlier versions of the same content (same digest) are outdated,
+        # the others are removed by the least recent use until the total size is below the cap
+        digest = current_name.split('_')[0]
+        files = []
+        total_bytes = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    # the files being written by other processes are left alone
+                    if not entry.name.endswith('.npz') or entry.name.endswith('.tmp.npz'):
+                        continue
+                    if entry.name != current_name and entry.name.split('_')[0] == digest:
+                        self._remove(entry.path)
+                        continue
+                    stat = entry.stat()
+                    total_bytes += stat.st_size
+                    if entry.name != current_name:
+                        files.append([stat.st_mtime, stat.st_size, entry.path])
+        except OSError:
+            return
+        files.sort()
+        for mtime, size, path in files:
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass # may be removed by another process already
@@ -6,8 +6,9 @@ from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 
 from utils import debug
-from pdfworker import PdfWorker
+from renderservice import sharedRenderService
 from toc import TocManager
+from docinfocache import DocInfoCache
 
 import os
 import numpy as np
@@ -33,16 +34,30 @@ class LibraryView(QtWidgets.QWidget, Ui_librarywidget):
         self.app_data_path = app_data_path
         self.filename = None
         self.viewStatus = None
-        self.pdfInfoReader = PdfWorker()
-        self.pdfInfoReader.pageSizesReceived.connect(self.onPageSizesReceived)
-        self.pdfInfoReader.bookmarksReceived.connect(self.onBookmarksReceived)
-        self.pdfInfoReader.textObjectsReceived.connect(self.onTextObjectsReceived)
-        self.pdfInfoReader.linkObjectsReceived.connect(self.onLinkObjectsReceived)
-        self.pdfInfoReader.annotObjectsReceived.connect(self.onAnnotObjectsReceived)
+        # the same workers render the tiles of all views
+        self.render_service = sharedRenderService()
+        self.render_service.pageSizesReceived.connect(self.onPageSizesReceived)
+        self.render_service.bookmarksReceived.connect(self.onBookmarksReceived)
+        self.render_service.textObjectsReceived.connect(self.onTextObjectsReceived)
+        self.render_service.linkObjectsReceived.connect(self.onLinkObjectsReceived)
+        self.render_service.annotObjectsReceived.connect(self.onAnnotObjectsReceived)
 
         self.splitter_doc.setSizes([1, 0]) # the second view is folded by default
         self.splitter_doc.setCollapsible(0, False) 
 
+        # rendered tiles are kept on disk, so that reopening a document paints at once
+        tile_cache_dir = os.path.join(self.app_data_path, 'tiles')
+        self.doc_graphicsview_1.setTileCacheDir(tile_cache_dir)
+        self.doc_graphicsview_2.setTileCacheDir(tile_cache_dir)
+        self.thumb_graphicsview.setTileCacheDir(tile_cache_dir)
+        # the page sizes and the TOC too, so that reopening a document lays it out at once
+        self.doc_info_cache = DocInfoCache(os.path.join(self.app_data_path, 'docinfo'))
+        self.cached_doc_info = None
+        self.doc_id = None # file_identity() of the document loaded in the render service
+        self.received_sizes = None
+        self.received_size_counts = 0
+        self.received_toc = None
+
         self.pushButton_prev.clicked.connect(self.onPrevViewClicked)
         self.pushButton_next.clicked.connect(self.onNextViewClicked)
 
@@ -166,20 +181,29 @@ class LibraryView(QtWidgets.QWidget, Ui_librarywidget):
         viewStatus = self.loadDocumentViewStatus(filename)
         self.viewStatus = [viewStatus, filename]
         self.pageTextLoadedFlag = []
-        self.pdfInfoReader.setDocument(filename)
-        self.pdfInfoReader.requestGetPageSizes()
-        self.pdfInfoReader.requestGetBookmarks()
-
-    def onPageSizesReceived(self, filename, pages_size_inch):
-        debug("onPageSizesReceived:")
-        viewStatus, vfilename = self.viewStatus
-        if filename != vfilename:
-            return
+        self.render_service.setDocument(filename)
+        self.doc_id = self.render_service.doc_id
+        # 
+        # lay out from the sidecar if any, the workers still read the sizes and the TOC to check it
+        self.received_sizes = None
+        self.received_size_counts = 0
+        self.received_toc = None
+        self.cached_doc_info = self.doc_info_cache.load(filename)
+        if self.cached_doc_info is not None:
+            pages_size_inch, toc = self.cached_doc_info
+            debug("Document info from sidecar: %d pages" % len(pages_size_inch))
+            self.setupDocumentViews(pages_size_inch.copy())
+            self.tocManager.setToc(toc)
+            self.tocManager.update(self.current_page_idx)
         # 
-        page_counts = len(pages_size_inch)
-        self.pageTextLoadedFlag = [False] * page_counts
+        self.render_service.requestGetPageSizes()
+        self.render_service.requestGetBookmarks()
+
+    def setupDocumentViews(self, pages_size_inch):
+        viewStatus, _ = self.viewStatus
+        self.pageTextLoadedFlag = [False] * len(pages_size_inch)
         # for i in range(page_counts):
-        #     self.pdfInfoReader.requestGetAnnotationObjects(i)
+        #     self.render_service.requestGetAnnotationObjects(i)
         # 
         status = viewStatus['docView1'] if viewStatus else None
         self.doc_graphicsview_1.setDocument(self.filename, self.screen_dpi, pages_size_inch, status)
@@ -194,30 +218,78 @@ class LibraryView(QtWidgets.QWidget, Ui_librarywidget):
         else:
             self.splitter_doc.setSizes([1, 0]) # the second view is folded by default
 
+    def onPageSizesReceived(self, filename, doc_id, page_counts, start, pages_size_inch):
+        debug("onPageSizesReceived: %d pages from %d" % (len(pages_size_inch), start))
+        # the chunks of another document, or of the file before it was rewritten
+        if doc_id != self.doc_id:
+            return
+        # 
+        end = start + len(pages_size_inch)
+        if start > 0 and (self.received_sizes is None or len(self.received_sizes) != page_counts):
+            return # the rest of a pass started before the current one, which starts again from the first page
+        if start == 0:
+            self.received_sizes = np.zeros((page_counts, 2))
+            self.received_size_counts = 0
+            if self.cached_doc_info is not None and len(self.cached_doc_info[0]) != page_counts:
+                self.cached_doc_info = None
+        self.received_sizes[start:end] = pages_size_inch
+        self.received_size_counts += len(pages_size_inch)
+        # 
+        if start > 0 or self.cached_doc_info is not None:
+            # the real sizes of the pages laid out with estimated or cached ones,
+            # the cached ones are float32 and are kept if they match
+            cached = self.cached_doc_info
+            if cached is None or not np.allclose(cached[0][start:end], pages_size_inch, rtol=1e-5, atol=0):
+                self.doc_graphicsview_1.updatePageSizes(start, pages_size_inch)
+                self.doc_graphicsview_2.updatePageSizes(start, pages_size_inch)
+                self.thumb_graphicsview.updatePageSizes(start, pages_size_inch)
+        else:
+            # the first chunk, the other pages take the size of the first page until their chunks arrive
+            estimated_sizes = np.zeros((page_counts, 2))
+            if page_counts > 0:
+                estimated_sizes[:] = pages_size_inch[0]
+                estimated_sizes[:len(pages_size_inch)] = pages_size_inch
+            self.setupDocumentViews(estimated_sizes)
+        # 
+        if self.received_size_counts >= page_counts:
+            self.storeDocInfo(filename)
+
     def onBookmarksReceived(self, filename, toc):
         debug("onBookmarksReceived")
-        self.tocManager.setToc(toc)
-        self.tocManager.update(self.current_page_idx)
+        if filename != self.viewStatus[1]:
+            return
+        self.received_toc = [list(item) for item in toc]
+        if self.cached_doc_info is None or self.cached_doc_info[1] != self.received_toc:
+            self.tocManager.setToc(toc)
+            self.tocManager.update(self.current_page_idx)
+        self.storeDocInfo(filename)
+
+    def storeDocInfo(self, filename):
+        # once both the sizes and the TOC are read, rewrite the sidecar if it was missing or stale
+        if self.received_toc is None or self.received_sizes is None:
+            return
+        if self.received_size_counts < len(self.received_sizes):
+            return
+        cached = self.cached_doc_info
+        if cached is not None and cached[1] == self.received_toc and \
+            np.allclose(cached[0], self.received_sizes, rtol=1e-5, atol=0):
+            return
+        self.doc_info_cache.store(filename, self.received_sizes, self.received_toc)
+        self.cached_doc_info = [self.received_sizes, self.received_toc]
 
     def onTextObjectsReceived(self, filename, page_no, text_objects):
         if not os.path.samefile(filename, self.filename):
             return
 
-        self.doc_graphicsview_1.initializePage(page_no)
-        self.doc_graphicsview_1.page_items[page_no].setTextObjects(text_objects)
-        # 
-        self.doc_graphicsview_2.initializePage(page_no)
-        self.doc_graphicsview_2.page_items[page_no].setTextObjects(text_objects)
+        self.doc_graphicsview_1.setPageTextObjects(page_no, text_objects)
+        self.doc_graphicsview_2.setPageTextObjects(page_no, text_objects)
 
     def onLinkObjectsReceived(self, filename, page_no, link_objects):
         if not os.path.samefile(filename, self.filename):
             return
 
-        self.doc_graphicsview_1.initializePage(page_no)
-        self.doc_graphicsview_1.page_items[page_no].setLinkObjects(link_objects)
-        # 
-        self.doc_graphicsview_2.initializePage(page_no)
-        self.doc_graphicsview_2.page_items[page_no].setLinkObjects(link_objects)
+        self.doc_graphicsview_1.setPageLinkObjects(page_no, link_objects)
+        self.doc_graphicsview_2.setPageLinkObjects(page_no, link_objects)
 
     def onAnnotObjectsReceived(self, filename, page_no, annot_objects):
         if not os.path.samefile(filename, self.filename):
@@ -246,8 +318,8 @@ class LibraryView(QtWidgets.QWidget, Ui_librarywidget):
         for page_no in visible_regions:
             if not self.pageTextLoadedFlag[page_no]:
                 self.pageTextLoadedFlag[page_no] = True
-                # self.pdfInfoReader.requestGetTextObjects(page_no)
-                self.pdfInfoReader.requestGetLinkObjects(page_no)
+                # self.render_service.requestGetTextObjects(page_no)
+                self.render_service.requestGetLinkObjects(page_no)
 
     def OnDoc1FocusIn(self):
         # debug("OnDoc1FocusIn")
@@ -432,7 +504,7 @@ class LibraryView(QtWidgets.QWidget, Ui_librarywidget):
         self.doc_graphicsview_1.close()
         self.doc_graphicsview_2.close()
         self.thumb_graphicsview.close()
-        self.pdfInfoReader.stop()
+        self.render_service.stop()
 
     def loadDocumentViewStatus(self, filename):
         dataFileName = self.app_data_path + "/" + hashlib.md5(filename.encode('utf-8')).hexdigest() + '.json'
@@ -0,0 +1,42 @@
+from collections import deque
+import socket
+
+class LocalConnection(object):
+    """
+    The results channel of a PdfInternalWorker running as a thread of the GUI process,
+    with the part of the interface of multiprocessing.Connection used by PdfWorker (send, poll, recv and fileno).
+    The messages are passed as they are, without pickling,
+    and a byte is written to a socket pair to wake up the QSocketNotifier of the GUI side.
+    """
+    def __init__(self):
+        self.messages = deque()
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def send(self, message):
+        self.messages.append(message)
+        try:
+            self.writer.send(b'\0')
+        except BlockingIOError:
+            pass # the reader has not consumed the earlier bytes yet, it will be woken up by them
+
+    def poll(self):
+        return len(self.messages) > 0
+
+    def recv(self):
+        # consume the wake up bytes before the message, so that a message sent afterwards wakes up the reader again
+        try:
+            self.reader.recv(4096)
+        except BlockingIOError:
+            pass
+        if len(self.messages) == 0:
+            raise EOFError
+        return self.messages.popleft()
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
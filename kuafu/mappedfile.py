@@ -0,0 +1,67 @@
+import os
+import mmap
+import ctypes
+import numpy as np
+import pypdfium as PDFIUM
+
+# the callback type of FPDF_FILEACCESS.m_GetBlock
+GET_BLOCK_FUNC = dict(PDFIUM.FPDF_FILEACCESS._fields_)['m_GetBlock']
+
+class MappedDocumentFile(object):
+    """
+    A PDF file mapped into memory and served to PDFium by FPDF_LoadCustomDocument.
+    PDFium reads the blocks it needs straight from the mapping instead of doing its own buffered file reads,
+    and as all workers map the same file, they share its pages in the OS page cache, which are only
+    read from the storage (e.g. a slow network mount) once.
+    Reading the mapping past the end of a file truncated afterwards raises SIGBUS, which kills the process,
+    so the worker checks changed() before each rendering or command using the document, and closes a changed one.
+    A file truncated in between still kills the worker, which is restarted by the GUI side then.
+    It must be closed after the document.
+    """
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            stat = os.fstat(self.file.fileno())
+            self.size = stat.st_size
+            self.mtime_ns = stat.st_mtime_ns
+            self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # e.g. an empty file, or a file system not supporting mmap
+            self.file.close()
+            raise
+        # PDFium jumps around in the file, the read-around of the page faults would read megabytes for a few bytes,
+        # the blocks are prefetched as a whole in _get_block() instead
+        if hasattr(self.mapping, 'madvise'):
+            self.mapping.madvise(mmap.MADV_RANDOM)
+        # the mapping is read-only, its address is taken through a numpy view
+        self.view = np.frombuffer(self.mapping, dtype=np.uint8)
+        self.address = self.view.ctypes.data
+        # the callback and the struct must stay alive as long as the document
+        self.get_block_func = GET_BLOCK_FUNC(self._get_block)
+        self.file_access = PDFIUM.FPDF_FILEACCESS(self.size, self.get_block_func, None)
+
+    def changed(self):
+        # a file replaced by a new one keeps the mapped one alive, only a file rewritten in place changes here
+        try:
+            stat = os.fstat(self.file.fileno())
+        except OSError:
+            return True
+        return stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns
+
+    def _get_block(self, param, position, buf, size):
+        if position + size > self.size:
+            return 0
+        if size > mmap.PAGESIZE and hasattr(self.mapping, 'madvise'):
+            start = position - position % mmap.PAGESIZE
+            self.mapping.madvise(mmap.MADV_WILLNEED, start, position + size - start)
+        ctypes.memmove(buf, self.address + position, size)
+        return 1
+
+    def load_document(self, password=None):
+        return PDFIUM.FPDF_LoadCustomDocument(ctypes.byref(self.file_access), password)
+
+    def close(self):
+        # the numpy view holds an export of the mapping, which can not be closed before
+        del self.view
+        self.mapping.close()
+        self.file.close()
@@ -3,27 +3,15 @@ from PyQt5 import QtCore
 from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 
-import cv2
-import numpy as np
 
 from utils import debug
+from spatialindex import GridIndex
+from quadtree import patch_id, is_descendant, covering_range
 import math
 
-def cvImg2QImg(cvImg):
-    height, width, channel = cvImg.shape
-    assert(channel == 4)
-    bytesPerLine = channel * width
-    qImg = QtGui.QImage(cvImg.data, width, height, bytesPerLine, QtGui.QImage.Format_RGBA8888)
-    return qImg
-
-def QImg2cvImg(qImg):
-    qImg = qImg.convertToFormat(QtGui.QImage.Format_RGBA8888)
-    width = qImg.width()
-    height = qImg.height()
-    ptr = qImg.bits() # enforce deep copy
-    ptr.setsize(qImg.byteCount())
-    arr = np.array(ptr).reshape(height, width, 4)
-    return arr
+def scaling_mode(scale):
+    # tiles at the displayed size are drawn pixel for pixel, only scaled ones need the smoothing
+    return QtCore.Qt.FastTransformation if scale == 1.0 else QtCore.Qt.SmoothTransformation
 
 class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
     def __init__(self, pageIdx, parent=None):
@@ -50,16 +38,29 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
         # text object
         self.text_objects = None
         self.link_objects = None
+        self.text_index = None # GridIndex of the text lines
+        self.link_index = None # GridIndex of the link rects
 
-        # pixmaps
+        # pixmaps, rendered at a dpi level near the displayed one and scaled by render_scale
+        self.render_width = 0
+        self.render_height = 0
+        self.render_scale = 1.0
         self.patch_basesize = 1000
-        self.patch_rects = []
+        self.patch_level = 0 # the grid of patches is 2^level x 2^level
         self.patch_row_num = 0
         self.patch_col_num = 0
+        self.patch_step_w = 0
+        self.patch_step_h = 0
         
         # for smoothing transitions
         self.cached_pixmaps = {}
         self.current_items = {}
+        # parent of the transient items, clipping the scaled pixmaps to the page
+        self.transientLayer = QtWidgets.QGraphicsRectItem()
+        self.transientLayer.setRect(0, 0, 0, 0)
+        self.transientLayer.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        self.transientLayer.setFlag(QtWidgets.QGraphicsItem.ItemClipsChildrenToShape)
+        self.transientLayer.setParentItem(self)
 
         # mask
         self.maskItem = QtWidgets.QGraphicsRectItem()
@@ -74,12 +75,19 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
 
         # 
         self.setZValue(0)
+        self.transientLayer.setZValue(1)
         self.borderItem.setZValue(3)
         self.maskItem.setZValue(4)
         # 0: self, 1: transient, 2: current, 3: border, 4: mask
 
-    def initialize(self, x, y, width, height):
-        self.patch_rects = self.compute_patch_rects(width, height)
+    def initialize(self, x, y, width, height, render_width, render_height, render_scale):
+        # the page is displayed at (width, height) and rendered at (render_width, render_height),
+        # return True if the rendering size is unchanged, the current pixmaps are kept then
+        keep_current = (render_width, render_height) == (self.render_width, self.render_height)
+        self.render_width = render_width
+        self.render_height = render_height
+        self.render_scale = render_scale
+        self.compute_patch_grid(render_width, render_height)
 
         # may be called many times before the first addPixmap()
         current_width = self.rect().width()
@@ -88,6 +96,7 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
         self.setPos(x, y)
         self.setRect(0, 0, width, height)
         self.borderItem.setRect(0, 0, width, height)
+        self.transientLayer.setRect(0, 0, width, height)
 
         # set mask item accordingly
         mask_rect = self.maskItem.rect()
@@ -105,18 +114,27 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
                 associated_item.setParentItem(None)
                 self.cached_pixmaps[pid]['item'] = None
 
-        # remove all current items (move their pixmaps to cache)
-        for pid in self.current_items:
-            self.current_items[pid]['item'].setParentItem(None)
-            self.cached_pixmaps[pid] = self.current_items[pid]
-            self.cached_pixmaps[pid]['item'] = None
-        self.current_items = {}
-
         # update the ratio in cached pixmaps
         for pid in self.cached_pixmaps:
             self.cached_pixmaps[pid]['ratio'] *= ratio_thistime
 
+        if keep_current:
+            # the same tiles, only scaled differently
+            for pid in self.current_items:
+                self.current_items[pid]['ratio'] = render_scale
+                self.current_items[pid]['item'].setTransform(QtGui.QTransform.fromScale(render_scale, render_scale))
+                self.current_items[pid]['item'].setTransformationMode(scaling_mode(render_scale))
+        else:
+            # remove all current items (move their pixmaps to cache)
+            for pid in self.current_items:
+                self.current_items[pid]['item'].setParentItem(None)
+                self.cached_pixmaps[pid] = self.current_items[pid]
+                self.cached_pixmaps[pid]['item'] = None
+                self.cached_pixmaps[pid]['ratio'] *= ratio_thistime
+            self.current_items = {}
+
         self.setVisible(True)
+        return keep_current
 
     def setBorderHighlight(self, active):
         if active:
@@ -138,11 +156,16 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
 
     def setTextObjects(self, objects):
         self.text_objects = objects
+        # indexed once, the hit-testing is done on every mouse move
+        self.text_index = GridIndex(objects[2]) if objects else None
 
     def setLinkObjects(self, objects):
         self.link_objects = objects
+        self.link_index = GridIndex([rect for _, rect in objects]) if objects else None
 
     def updateTransientItems(self, visibleRect):
+        # the cached pixmaps are scaled by the transforms of their items, no pixel is touched here,
+        # the scene takes care of the sub-pixel positions and the transient layer clips them to the page
         for pid in self.cached_pixmaps:
             pixmap = self.cached_pixmaps[pid]['pixmap']
             raw_dx = self.cached_pixmaps[pid]['dx']
@@ -155,168 +178,80 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
             w = pixmap.width() * ratio
             h = pixmap.height() * ratio
             vrect = QtCore.QRectF(x, y, w, h) # virtual rect
-            irect = visibleRect.intersected(vrect) # intersected rect
             # 
-            if irect.isEmpty(): # remove associated transient item if unvisible
+            if not visibleRect.intersects(vrect): # remove associated transient item if unvisible
                 if associated_item:
                     associated_item.setParentItem(None)
                     self.cached_pixmaps[pid]['item'] = None
-            else:               
-                # crop the visible part
-                if False:
-                    # Qt version, sub-pixel is not supported, heavy jitter effect when drag
-                    crop_x = (irect.x() - vrect.x()) / ratio
-                    crop_y = (irect.y() - vrect.y()) / ratio
-                    crop_w = irect.width() / ratio
-                    crop_h = irect.height() / ratio
-                    cropped_pixmap = pixmap.copy(crop_x, crop_y, crop_w, crop_h)
-                    # resize to current scale
-                    resized_pixmap = cropped_pixmap.scaled(math.ceil(irect.width()), math.ceil(irect.height()))
-                else:
-                    # OpenCV version, support sub-pixel accuracy
-                    cvImg = QImg2cvImg(QtGui.QImage(pixmap))
-                    # 
-                    offset_x = irect.x() - vrect.x()
-                    offset_y = irect.y() - vrect.y()
-                    M = np.array([[ratio, 0.0, -offset_x], [0.0, ratio, -offset_y], [0.0, 0.0, 1.0]])
-                    cvImg = cv2.warpAffine(
-                        cvImg, M[:2], (math.ceil(irect.width()), math.ceil(irect.height())),
-                        flags=cv2.INTER_NEAREST,
-                        borderMode=cv2.BORDER_REPLICATE
-                    )
-                    # 
-                    qImg = cvImg2QImg(cvImg)
-                    resized_pixmap = QtGui.QPixmap.fromImage(qImg)
-
-                # debug, draw some mask
-                # if True:
-                if False:
-                    painter = QtGui.QPainter()
-                    painter.begin(resized_pixmap)
-                    painter.fillRect(resized_pixmap.rect(), QtGui.QColor(255, 0, 0, 100))
-                    painter.end()
-                    debug("Add transient patch: %d" % pid)
-
-                if associated_item:
-                    associated_item.setPixmap(resized_pixmap)
-                    associated_item.setOffset(irect.x(), irect.y())
-                else:
-                    # add to scene
-                    item = QtWidgets.QGraphicsPixmapItem(resized_pixmap, parent=self)
-                    item.setOffset(irect.x(), irect.y())
-                    item.setZValue(1)
-                    self.cached_pixmaps[pid]['item'] = item
+                continue
+            if not associated_item:
+                associated_item = QtWidgets.QGraphicsPixmapItem(pixmap, parent=self.transientLayer)
+                associated_item.setOffset(raw_dx, raw_dy)
+                self.cached_pixmaps[pid]['item'] = associated_item
+            associated_item.setTransform(QtGui.QTransform.fromScale(ratio, ratio))
 
     def get_roi_patches(self, roi_rect):
+        # roi_rect is in item coordinates, the patches are in the rendering coordinates.
+        # only the patches overlapping roi_rect are visited, their range is computed from the grid steps
         patch_positions = []
         patches = []
-        for i in range(self.patch_row_num):
-            for j in range(self.patch_col_num):
-                pRect = self.patch_rects[i][j]
-                interRect = roi_rect.intersected(pRect)
-                if not interRect.isEmpty():
-                    patches.append(pRect)
-                    patch_positions.append([i, j])
+        if roi_rect.isEmpty():
+            return patch_positions, patches
+        s = self.render_scale
+        roi_rect = QtCore.QRectF(roi_rect.x() / s, roi_rect.y() / s, roi_rect.width() / s, roi_rect.height() / s)
+        i0, i1 = covering_range(roi_rect.top(), roi_rect.bottom(), self.patch_step_h, self.patch_row_num)
+        j0, j1 = covering_range(roi_rect.left(), roi_rect.right(), self.patch_step_w, self.patch_col_num)
+        for i in range(i0, i1):
+            for j in range(j0, j1):
+                patches.append(self.get_patch_rect(i, j))
+                patch_positions.append([i, j])
         return patch_positions, patches
+
+    def get_patch_rect(self, i, j):
+        return QtCore.QRectF(j * self.patch_step_w, i * self.patch_step_h, self.patch_step_w, self.patch_step_h)
     
     def get_patch_id(self, i, j, col_num):
         # assert row_num == col_num
-        layerBase = col_num * col_num
-        offset = i * col_num + j
-        return int(layerBase + offset)
+        return patch_id(col_num.bit_length() - 1, i, j)
 
     def get_containing_patch_id(self, x, y):
-        for i in range(self.patch_row_num):
-            for j in range(self.patch_col_num):
-                pRect = self.patch_rects[i][j]
-                if pRect.contains(x, y):
-                    return self.get_patch_id(i, j, self.patch_col_num)
-        return None
-
-    def getParentPatchId(self, patch_id):
-        # get the parent patch id of patch_id
-        if patch_id == 1: # 1 is the root id, return itself
-            return 1
-        # get current column number
-        col_num = int(math.log2(math.sqrt(patch_id)))
-        col_num = int(math.pow(2, col_num))
-        # get current offset
-        offset = patch_id - (col_num * col_num)
-        i = int(offset / col_num)
-        j = int(offset % col_num)
-        parent_i = int(i / 2)
-        parent_j = int(j / 2)
-        parent_col_num = int(col_num / 2)
-        parent_id = self.get_patch_id(parent_i, parent_j, parent_col_num)
-        return parent_id
-
-    def isChildPatch(self, child_patch_id, parent_patch_id):
-        # test whether child_patch_id is a child of parent_patch_id
-        pid = self.getParentPatchId(child_patch_id)
-        while pid > 1 and pid >= parent_patch_id:
-            if pid == parent_patch_id:
-                return True
-            pid = self.getParentPatchId(pid)
-        return False
-
-    def compute_patch_rects(self, width, height):
-        rects = []
+        if self.patch_col_num == 0:
+            return None
+        if not (0 <= x <= self.patch_col_num * self.patch_step_w and 0 <= y <= self.patch_row_num * self.patch_step_h):
+            return None
+        i = min(int(y // self.patch_step_h), self.patch_row_num - 1)
+        j = min(int(x // self.patch_step_w), self.patch_col_num - 1)
+        return patch_id(self.patch_level, i, j)
+
+    def compute_patch_grid(self, width, height):
         # the width (and also the height) will be divided to [1,2,4,8,16,...] peices
-
         length = min(width, height)
         if length >= self.patch_basesize:
-            splitCnt = int(math.pow(2, int(math.log2(length / self.patch_basesize) + 0.5)))
+            self.patch_level = int(math.log2(length / self.patch_basesize) + 0.5)
         else:
-            splitCnt = 1
-
-        self.patch_row_num = splitCnt
-        self.patch_col_num = splitCnt
-
-        horiStep = int(width / self.patch_col_num)
-        vertStep = int(height / self.patch_row_num)
-        for i in range(self.patch_row_num):
-            tmpRects = []
-            for j in range(self.patch_col_num):
-                x = j*horiStep
-                y = i*vertStep
-                w = horiStep
-                h = vertStep
-                # 
-                if x + w > width:
-                    w = width - x
-                if y + h > height:
-                    h = height - y
-                tmpRects.append(QtCore.QRectF(x, y, w, h))
-            rects.append(tmpRects)
+            self.patch_level = 0
 
-        return rects
+        self.patch_row_num = 1 << self.patch_level
+        self.patch_col_num = 1 << self.patch_level
+        self.patch_step_w = int(width / self.patch_col_num)
+        self.patch_step_h = int(height / self.patch_row_num)
 
     def textUnder(self, x, y):
         # the x and y are in the raw image coordinate without any scaling
-        if self.text_objects:
-            chars, char_rects, merged_rects = self.text_objects
-            for i in range(len(merged_rects)):
-                rawRect, startIdx, endIdx = merged_rects[i]
-            # for i in range(len(char_rects)):
-            #     rawRect = char_rects[i]
-                rect = QtCore.QRect(rawRect[0], rawRect[1], rawRect[2], rawRect[3])
-                if rect.contains(x, y):
-                    # for idx in range(startIdx, endIdx):
-                        # pass
-                    return True
+        if self.text_index:
+            return len(self.text_index.query(x, y)) > 0
         return False
 
     def linkUnder(self, x, y):
         # the x and y are in the raw image coordinate without any scaling
-        if self.link_objects:
-            for item in self.link_objects:
-                dest_pg_no, rawRect = item
-                rect = QtCore.QRect(rawRect[0], rawRect[1], rawRect[2], rawRect[3])
-                if rect.contains(x, y):
-                    return dest_pg_no
+        if self.link_index:
+            hits = self.link_index.query(x, y)
+            if len(hits) > 0:
+                dest_pg_no, rawRect = self.link_objects[hits[0]] # the first one as before
+                return dest_pg_no
         return None
 
-    def addPixmap(self, pixmap, dx, dy, dpi):
+    def addPixmap(self, pixmap, dx, dy, dpi, key=None):
         # 
         # debug
         if False:
@@ -324,13 +259,13 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
             if self.text_objects:
                 painter = QtGui.QPainter()
                 painter.begin(pixmap)
-                chars, char_rects, merged_rects = self.text_objects
+                text, char_rects, line_rects, line_ranges = self.text_objects
                 if False:
                 # if True:
                     pen = QtGui.QPen(QtGui.QColor(255, 0, 0, 255))
                     pen.setWidth(1)
                     painter.setPen(pen)
-                    for i in range(len(chars)):
+                    for i in range(len(text)):
                         rawRect = char_rects[i]
                         ratio = dpi / 72.0
                         rect = QtCore.QRect(rawRect[0]*ratio + dx, rawRect[1]*ratio + dy, rawRect[2]*ratio, rawRect[3]*ratio)
@@ -341,8 +276,8 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
                     pen = QtGui.QPen(QtGui.QColor(0, 0, 255, 255))
                     pen.setWidth(1)
                     painter.setPen(pen)
-                    for i in range(len(merged_rects)):
-                        rawRect, startIdx, endIdx = merged_rects[i]
+                    for i in range(len(line_rects)):
+                        rawRect = line_rects[i]
                         ratio = dpi / 72.0
                         rect = QtCore.QRect(rawRect[0]*ratio + dx, rawRect[1]*ratio + dy, rawRect[2]*ratio, rawRect[3]*ratio)
                         painter.drawRect(rect)
@@ -360,23 +295,28 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
         # 
         item = QtWidgets.QGraphicsPixmapItem(pixmap, parent=self)
         item.setOffset(dx, dy)
+        item.setTransform(QtGui.QTransform.fromScale(self.render_scale, self.render_scale))
+        item.setTransformationMode(scaling_mode(self.render_scale))
         item.setZValue(2)
 
         current_id = self.get_containing_patch_id(dx + pixmap.width() / 2, dy + pixmap.height() / 2)
         # debug("Add current patch id: ", current_id)
+        if current_id in self.current_items:
+            self.current_items[current_id]['item'].setParentItem(None)
 
         self.current_items[current_id] = {
             "item": item,
             "pixmap": pixmap,
             "dx": dx,
             "dy": dy,
-            "ratio": 1.0,
+            "ratio": self.render_scale,
+            "key": key, # key in the shared tile cache
         }
 
         # remove cached pixmaps which are child of the current
         pidToRemove = []
         for cached_id in self.cached_pixmaps:
-            if cached_id == current_id or self.isChildPatch(cached_id, current_id):
+            if cached_id == current_id or is_descendant(cached_id, current_id):
                 pidToRemove.append(cached_id)
                 # debug("Remove cached patch id: ", cached_id)
         for pid in pidToRemove:
@@ -395,6 +335,41 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
                 outStr += ("%d " % pid)
             debug(outStr)
         
+    def addCachedPixmap(self, pid, pixmap, dx, dy, ratio, key=None):
+        # add a pixmap to the transient layer, e.g. a tile loaded from the disk cache or a coarse page
+        if pid in self.current_items or pid in self.cached_pixmaps:
+            return
+        self.cached_pixmaps[pid] = {
+            "item": None,
+            "pixmap": pixmap,
+            "dx": dx,
+            "dy": dy,
+            "ratio": ratio,
+            "key": key, # key in the shared tile cache
+        }
+
+    def isBlank(self):
+        # nothing to show yet, neither current nor transient pixmaps
+        return len(self.current_items) == 0 and len(self.cached_pixmaps) == 0
+
+    def tileKeys(self):
+        # keys of all pixmaps (current and transient) in the shared tile cache
+        keys = [self.current_items[pid]['key'] for pid in self.current_items]
+        keys += [self.cached_pixmaps[pid]['key'] for pid in self.cached_pixmaps]
+        return [key for key in keys if key is not None]
+
+    def removeTile(self, key):
+        # the pixmap was evicted from the shared tile cache
+        for pid in self.current_items:
+            if self.current_items[pid]['key'] == key:
+                self.current_items[pid]['item'].setParentItem(None)
+                self.current_items.pop(pid)
+                break
+        for pid in self.cached_pixmaps:
+            if self.cached_pixmaps[pid]['key'] == key:
+                self.removeCachedPixmap(pid)
+                break
+
     def removeCachedPixmap(self, pid):
         if pid in self.cached_pixmaps:
             associated_item = self.cached_pixmaps[pid]['item']
@@ -402,11 +377,37 @@ class PageGraphicsItem(QtWidgets.QGraphicsRectItem):
                 associated_item.setParentItem(None)
             self.cached_pixmaps.pop(pid)
 
+    def reset(self):
+        # drop everything of the page, the item is reused for another one by the view
+        for pid in self.current_items:
+            self.current_items[pid]['item'].setParentItem(None)
+        self.current_items = {}
+        for pid in list(self.cached_pixmaps):
+            self.removeCachedPixmap(pid)
+        self.render_width = 0
+        self.render_height = 0
+        self.render_scale = 1.0
+        self.patch_level = 0
+        self.patch_row_num = 0
+        self.patch_col_num = 0
+        self.patch_step_w = 0
+        self.patch_step_h = 0
+        self.setTextObjects(None)
+        self.setLinkObjects(None)
+        self.setRect(0, 0, 0, 0)
+        self.borderItem.setRect(0, 0, 0, 0)
+        self.transientLayer.setRect(0, 0, 0, 0)
+        self.maskItem.setRect(0, 0, 0, 0)
+        self.setBorderHighlight(False)
+        self.setToolTip("")
+        self.setVisible(False)
+
     def clear(self):
         self.setRect(0, 0, 0, 0)
         self.maskItem.setRect(0, 0, 0, 0)
 
-        self.patch_rects = []
+        self.patch_row_num = 0
+        self.patch_col_num = 0
         self.cached_pixmaps = {}
         self.current_items = {}
         cachedItems = self.childItems()
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from utils import debug
+import pypdfium as PDFIUM
+
+DEFAULT_PAGE_CACHE_COUNT = 8
+
+class PageHandleCache(object):
+    """
+    LRU cache of the loaded FPDF_PAGE handles (and their text pages) of one document in a PdfInternalWorker.
+    Parsing a page may take hundreds of milliseconds for heavy vector pages,
+    so the handle is loaded once and reused by all tiles and page objects of the page.
+    It must be cleared before the document is closed.
+    """
+    def __init__(self, max_count=DEFAULT_PAGE_CACHE_COUNT):
+        self.max_count = max_count
+        self.doc = None
+        self.pages = OrderedDict() # page_no -> [page, text page or None], the least recently used first
+
+    def set_document(self, doc):
+        self.clear()
+        self.doc = doc
+
+    def _get_entry(self, page_no):
+        entry = self.pages.get(page_no)
+        if entry is not None:
+            self.pages.move_to_end(page_no)
+            return entry
+        entry = [PDFIUM.FPDF_LoadPage(self.doc, page_no), None]
+        self.pages[page_no] = entry
+        while len(self.pages) > self.max_count:
+            oldest_no, oldest = self.pages.popitem(last=False)
+            self._close(oldest)
+            debug("page handle %d closed" % oldest_no)
+        return entry
+
+    def get_page(self, page_no):
+        return self._get_entry(page_no)[0]
+
+    def get_text_page(self, page_no):
+        entry = self._get_entry(page_no)
+        if entry[1] is None:
+            entry[1] = PDFIUM.FPDFText_LoadPage(entry[0])
+        return entry[1]
+
+    def _close(self, entry):
+        page, textpage = entry
+        if textpage is not None:
+            PDFIUM.FPDFText_ClosePage(textpage)
+        PDFIUM.FPDF_ClosePage(page)
+
+    def clear(self):
+        for entry in self.pages.values():
+            self._close(entry)
+        self.pages = OrderedDict()
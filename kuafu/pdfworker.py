@@ -1,9 +1,17 @@
 from PyQt5 import QtCore
 from PyQt5 import QtGui
-from multiprocessing import Process, Queue
-from utils import debug
+from multiprocessing import Process, Queue, Pipe
+from utils import debug, file_identity
+from diskcache import TileDiskCache, TileDiskWriter, disk_cache_key
+from sharedtiles import SharedTileRing, LocalTileRing
+from localconnection import LocalConnection
+from renderscheduler import RenderScheduler
+from renderbatch import unpack_render_requests
+import sys
 import time
-import cv2
+import queue
+import threading
+import contextlib
 import numpy as np
 
 # https://hzqtc.github.io/2012/04/poppler-vs-mupdf.html
@@ -13,14 +21,37 @@ import numpy as np
 # PyMuPDF will fail in opening some files
 
 PDF_BACKEND = 'PDFIUM'
+
+# results are broadcast to all views, so a request for a tile sent within this time is dropped
+RECENT_RESULT_SECONDS = 1.0
+# the page sizes are sent in chunks between the renderings, the first chunk is enough for the first screen
+PAGE_SIZES_FIRST_CHUNK = 64
+PAGE_SIZES_CHUNK = 4096
+# the rendered tiles are sent together, at most this time after the first one of a batch is ready
+TILE_BATCH_SECONDS = 0.008
 # PDF_BACKEND = 'POPPLER'
 # PDF_BACKEND = 'MUPDF'
 
+# each worker is a process with its own copy of the document and PDFium, 
+# or a thread of the GUI process ('THREAD') sharing its memory without IPC.
+# PDFium is not thread safe, the threads only render one at a time, so more than one of them is no faster,
+# but the GUI thread is never blocked by PDFium
+WORKER_BACKEND = 'PROCESS'
+# WORKER_BACKEND = 'THREAD'
+# taken by the workers running as threads around all PDFium calls, reentrant for the nested calls
+PDFIUM_LOCK = threading.RLock()
+# PDFium reads the document from a memory mapping of the file, shared by all workers in the OS page cache,
+# only for the worker processes
+MAP_DOCUMENT_FILE = True
+
 if PDF_BACKEND == 'PDFIUM':
     # follow https://github.com/BlockSigner/wowpng, and https://github.com/bblanchon/pdfium-binaries
     import ctypes
     import pypdfium as PDFIUM
     PDFIUM.FPDF_InitLibraryWithConfig(PDFIUM.FPDF_LIBRARY_CONFIG(2, None, None, 0))
+    from bitmappool import BitmapPool
+    from pagecache import PageHandleCache
+    from mappedfile import MappedDocumentFile
 
 elif PDF_BACKEND == 'POPPLER':
     from popplerqt5 import Poppler
@@ -33,29 +64,54 @@ class PdfInternalWorker(Process):
     # considering realtime, the request may be dropped
     # rendered = QtCore.pyqtSignal(str, int, float, QtGui.QImage)
 
-    def __init__(self, commandQ, resultsQ):
+    def __init__(self, commandQ, resultsConn, tile_ring, pdf_lock=None):
         super(PdfInternalWorker, self).__init__()
         #
         self.commandQ = commandQ
-        self.resultsQ = resultsQ
+        self.resultsConn = resultsConn
+        self.tile_ring = tile_ring
+        # only needed if the worker is run in a thread
+        self.pdf_lock = pdf_lock if pdf_lock is not None else contextlib.nullcontext()
 
         self.doc = None
+        self.mapped_file = None # MappedDocumentFile of the document, None if PDFium reads the file itself
+        self.map_document_file = MAP_DOCUMENT_FILE
         self.filename = None
+        self.doc_id = None # file_identity() of the document given by the GUI side, sent back with the tiles
+        self.doc_hash = None
+        self.tile_writer = None # TileDiskWriter of the disk tile cache, if enabled
         # 
         # self.painter = QtGui.QPainter()
         # self.link_color = QtGui.QColor(0,0,127, 40)
         # 
         self.exit_flag = False
 
-        self.requests_queue = {}
+        self.scheduler = RenderScheduler()
+        self.bitmap_pool = BitmapPool() if PDF_BACKEND == 'PDFIUM' else None
+        self.page_cache = PageHandleCache() if PDF_BACKEND == 'PDFIUM' else None
+        self.recent_results = {} # key -> time sent, for merging with the requests arriving during rendering
+        self.page_sizes_sent = None # the page sizes from this page on are still to be sent, None if all sent
+        self.rendered_tiles = [] # [page_no, dpi, patch_id, roi, tile, img] rendered but not sent yet
+        self.rendered_tiles_time = 0 # when the first of them was ready
+        self.render_seconds = 0 # how long the last rendering took, the expected time of the next one
         
         # self.mutex = QtCore.QMutex()
 
-    def set_document(self, filename):
+    def set_document(self, filename, doc_id):
         self.filename = filename
-        self.requests_queue = {}
+        self.doc_id = doc_id
+        self.scheduler.clear()
+        self.recent_results = {}
+        self.page_sizes_sent = None
+        if self.tile_writer:
+            self.doc_hash = disk_cache_key(doc_id)
         if PDF_BACKEND == 'PDFIUM':
-            self.doc = PDFIUM.FPDF_LoadDocument(self.filename, None)
+            with self.pdf_lock:
+                if self.bitmap_pool:
+                    self.bitmap_pool.clear()
+                self.close_document()
+                self.doc = self.load_document_pdfium(self.filename)
+                self.page_cache.set_document(self.doc)
         elif PDF_BACKEND == 'POPPLER':
             password = ''
             self.doc = Poppler.Document.load(self.filename, password.encode(), password.encode())
@@ -67,109 +123,99 @@ class PdfInternalWorker(Process):
         elif PDF_BACKEND == 'MUPDF':
             self.doc = fitz.open(self.filename)
 
-    def get_page_sizes_mupdf(self, doc):
+    def load_document_pdfium(self, filename):
+        # from the mapping of the file if possible, otherwise PDFium opens the file by itself
+        if self.map_document_file:
+            try:
+                mapped_file = MappedDocumentFile(filename)
+            except (OSError, ValueError) as e:
+                debug("failed to map %s: %s" % (filename, e))
+            else:
+                doc = mapped_file.load_document()
+                if doc:
+                    self.mapped_file = mapped_file
+                    return doc
+                mapped_file.close()
+        return PDFIUM.FPDF_LoadDocument(filename, None)
+
+    def check_document(self):
+        # the mapped file is checked once before each use of the document, not on every block read.
+        # a file rewritten in place is closed before its mapping faults, nothing is read until the next SET
+        if self.mapped_file is not None and self.mapped_file.changed():
+            debug("%s changed on disk, document closed" % self.filename)
+            with self.pdf_lock:
+                self.close_document()
+            self.scheduler.clear()
+            self.page_sizes_sent = None
+        return self.doc is not None
+
+    def close_document(self):
+        # the cached pages must be closed before the document, and the document before its mapped file
+        if PDF_BACKEND == 'PDFIUM' and self.doc is not None:
+            self.page_cache.clear()
+            PDFIUM.FPDF_CloseDocument(self.doc)
+            self.doc = None
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+            self.mapped_file = None
+
+    def get_page_sizes_mupdf(self, doc, start, end):
         pages_size_inch = []
-        page_counts = len(doc)
-        for i in range(page_counts):
+        for i in range(start, end):
             page_rect = doc[i].MediaBox
             pg_width = page_rect.width / 72.0 # width in inch
             pg_height = page_rect.height / 72.0
             pages_size_inch.append([pg_width, pg_height])
         return pages_size_inch
 
-    def get_page_sizes_poppler(self, doc):
+    def get_page_sizes_poppler(self, doc, start, end):
         pages_size_inch = []
-        page_counts = doc.numPages()  
-        for i in range(page_counts):
+        for i in range(start, end):
             pageSz = doc.page(i).pageSizeF()
             pg_width = pageSz.width() / 72.0 # width in inch
             pg_height = pageSz.height() / 72.0
             pages_size_inch.append([pg_width, pg_height])  
         return pages_size_inch
 
-    def get_page_sizes_pdfium(self, doc):
+    def get_page_sizes_pdfium(self, doc, start, end):
         pages_size_inch = []
-        page_counts = PDFIUM.FPDF_GetPageCount(doc)
         width = ctypes.c_double()
         height = ctypes.c_double()
-        for i in range(page_counts):
+        for i in range(start, end):
             PDFIUM.FPDF_GetPageSizeByIndex(doc, i, ctypes.byref(width), ctypes.byref(height))
             pg_width = width.value / 72.0 # width in inch
             pg_height = height.value / 72.0
             pages_size_inch.append([pg_width, pg_height])
         return pages_size_inch
 
-    def get_page_sizes(self):
-        # extract page sizes for all pages
+    def get_page_count(self):
         if PDF_BACKEND == 'PDFIUM':
-            return self.get_page_sizes_pdfium(self.doc)
+            return PDFIUM.FPDF_GetPageCount(self.doc)
         elif PDF_BACKEND == 'POPPLER':
-            return self.get_page_sizes_poppler(self.doc)
+            return self.doc.numPages()
         elif PDF_BACKEND == 'MUPDF':
-            return self.get_page_sizes_mupdf(self.doc)
-
-    def save_rendering_command(self, page_no, dpi, roi, visible_regions):
-        if page_no in self.requests_queue:
-            # remove old command with the same page number but different dpi                        
-            dpi_list, roi_list = self.requests_queue[page_no]
-            assert(len(dpi_list) == len(roi_list))
-            cnt = len(dpi_list)
-            duplicate_flag = False
-            for i in range(cnt):
-                if dpi_list[i] != dpi:
-                    dpi_list[i] = None # mark deleted item as None
-                    roi_list[i] = None
-                elif roi_list[i] == roi:
-                    duplicate_flag = True
-            if not duplicate_flag:
-                dpi_list.append(dpi)
-                roi_list.append(roi)
-        else:
-            self.requests_queue[page_no] = [[dpi], [roi]]
-            
-        # only garentee current visible pages
-        emptyKeys = []
-        for page_no in self.requests_queue:
-            if page_no not in visible_regions:
-                emptyKeys.append(page_no)
-                continue
-            dpi_list, roi_list = self.requests_queue[page_no]
-            assert(len(dpi_list) == len(roi_list))
-            cnt = len(dpi_list)            
-            for i in range(cnt):
-                roi = roi_list[i]
-                if roi is None:
-                    continue
-                if roi.intersected(visible_regions[page_no]).isEmpty():
-                    roi_list[i] = None # mark deleted item as None
-                    dpi_list[i] = None            
-        for page_no in emptyKeys:
-            self.requests_queue.pop(page_no)
-
-    def get_command_from_queue(self):
-        if len(self.requests_queue) == 0:
-            return None
-        emptyKeys = []
-        command = None
-        for page_no in self.requests_queue:
-            dpi_list, roi_list = self.requests_queue[page_no]
-            dpi = None
-            roi = None
-            while dpi is None:
-                if len(dpi_list) == 0:
-                    break
-                dpi = dpi_list.pop(0)
-                roi = roi_list.pop(0)
-            if dpi is None:
-                assert(len(dpi_list) == 0 and len(roi_list) == 0)
-                emptyKeys.append(page_no)
-            else:
-                command = [page_no, dpi, roi]
-                break
-        for page_no in emptyKeys:
-            self.requests_queue.pop(page_no)
-        return command
-        
+            return len(self.doc)
+
+    def get_page_sizes(self, start, end):
+        # extract page sizes of the pages in [start, end), as an (N, 2) array in inch
+        if PDF_BACKEND == 'PDFIUM':
+            pages_size_inch = self.get_page_sizes_pdfium(self.doc, start, end)
+        elif PDF_BACKEND == 'POPPLER':
+            pages_size_inch = self.get_page_sizes_poppler(self.doc, start, end)
+        elif PDF_BACKEND == 'MUPDF':
+            pages_size_inch = self.get_page_sizes_mupdf(self.doc, start, end)
+        return np.array(pages_size_inch, dtype=np.float64).reshape(-1, 2)
+
+    def send_page_sizes(self):
+        # the next chunk of page sizes, a small first one for the first paint
+        page_counts = self.get_page_count()
+        start = self.page_sizes_sent
+        chunk = PAGE_SIZES_FIRST_CHUNK if start == 0 else PAGE_SIZES_CHUNK
+        end = min(start + chunk, page_counts)
+        pages_size_inch = self.get_page_sizes(start, end)
+        self.resultsConn.send(['PAGESIZES_RES', self.filename, self.doc_id, page_counts, start, pages_size_inch])
+        self.page_sizes_sent = end if end < page_counts else None
+
     def get_toc_item_poppler(self, doc, node):
         element = node.toElement()
         title = element.tagName()
@@ -318,6 +364,7 @@ class PdfInternalWorker(Process):
     def _rect_transform_pdfium(self, rotation, crop_box, pdf_rect):
         # transform rect to image coordinate in format [x,y,w,h]
         # crop_box and pdf_rect are in PDF coordinate
+        # pdf_rect may also be four arrays (e.g. boxes.T), then all rects are transformed at once
         left, top, right, bottom = pdf_rect
         crop_left, crop_top, crop_right, crop_bottom = crop_box
         # 
@@ -358,90 +405,64 @@ class PdfInternalWorker(Process):
         # 
         return rect
 
-    def _merge_char_rects(self, char_rects, chars, font_weights):
-        # assume no rotation, and the rects are in PDF coordinate (Y is different from common image coordinate)
-        charCnt = len(char_rects)
-        assert(len(chars) == charCnt)
-        assert(len(font_weights) == charCnt)
+    def _merge_char_rects(self, text, boxes):
+        # merge the boxes of the characters into lines, a line ends after '\n' or the hyphen '\x02'.
+        # boxes are in PDF coordinate (Y is different from common image coordinate) as [left, top, right, bottom],
+        # return the merged boxes and the [start, end) character ranges of the lines
+        charCnt = len(boxes)
         if charCnt == 0:
-            return []
-        # 
-        rects = []
-        endFlag = True
-        startIdx = 0
-        current_rect = [0, 0, 0, 0] # left, top, right, bottom
-        for i in range(charCnt):
-            left, top, right, bottom = char_rects[i]
-            # 
-            if i == 0:
-                current_rect = [left, top, right, bottom]
-                continue
-            # 
-            # check if we need to end constructing of the current rect
-            # \x02 is the Hyphen '-'
-            if chars[i-1] == '\n' or chars[i-1] == '\x02':
-                endFlag = True
-            else:
-                endFlag = False
-            # 
-            if endFlag:
-                rects.append([current_rect, startIdx, i])  # save the current rect and start a new one
-                startIdx = i
-                current_rect = [left, top, right, bottom]
-            else:
-                # append to the current rect
-                new_left = min(current_rect[0], left)
-                new_top =  max(current_rect[1], top)
-                new_right = max(current_rect[2], right)
-                new_bottom = min(current_rect[3], bottom)
-                current_rect = [new_left, new_top, new_right, new_bottom]
-            # 
-            if i == (charCnt - 1): # save the last one
-                rects.append([current_rect, startIdx, charCnt])
-        # 
-        return rects
+            return np.zeros((0, 4)), np.zeros((0, 2), dtype=np.int32)
+        codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        ends = np.flatnonzero((codes[:-1] == ord('\n')) | (codes[:-1] == 2)) + 1
+        starts = np.concatenate(([0], ends)).astype(np.int32)
+        merged = np.stack([
+            np.minimum.reduceat(boxes[:, 0], starts),
+            np.maximum.reduceat(boxes[:, 1], starts),
+            np.maximum.reduceat(boxes[:, 2], starts),
+            np.minimum.reduceat(boxes[:, 3], starts),
+            ], axis=1)
+        ranges = np.stack([starts, np.append(starts[1:], charCnt)], axis=1)
+        return merged, ranges
 
     def get_text_objects(self, doc, page_no):
+        # return [text, char rects, line rects, line ranges],
+        # the rects are in image coordinate as arrays of [x, y, w, h], the ranges are [start, end) in text
         text_objects = []
-        chars = []
-        fontweights = []
-        char_rects = []
-        merged_rects = []
         if PDF_BACKEND == 'PDFIUM':
-            page = PDFIUM.FPDF_LoadPage(doc, page_no)
-            textpage = PDFIUM.FPDFText_LoadPage(page)
+            page = self.page_cache.get_page(page_no)
+            textpage = self.page_cache.get_text_page(page_no)
             charCnt = PDFIUM.FPDFText_CountChars(textpage)
             # 
             crop_box = self._get_page_crop_box_pdfium(page)
             rotation = PDFIUM.FPDFPage_GetRotation(page)
             # 
-            for i in range(charCnt):
-                iChar = chr(PDFIUM.FPDFText_GetUnicode(textpage, i))
-                left = ctypes.c_double()
-                bottom = ctypes.c_double()
-                right = ctypes.c_double()
-                top = ctypes.c_double()
-                PDFIUM.FPDFText_GetCharBox(
-                    textpage, i, 
-                    ctypes.byref(left), ctypes.byref(right), 
-                    ctypes.byref(bottom), ctypes.byref(top)
-                )
-                ftWeights = PDFIUM.FPDFText_GetFontWeight(textpage, i)
-                # print('Font weights for %s : %d' % (iChar, ftWeights))
-                chars.append(iChar)
-                fontweights.append(ftWeights)
-                char_rects.append([left.value, top.value, right.value, bottom.value])
-            merged_rects = self._merge_char_rects(char_rects, chars, fontweights)
+            # all characters at once, in UTF-16 with a terminating zero
+            textBuf = (ctypes.c_ushort * (charCnt + 1))()
+            PDFIUM.FPDFText_GetText(textpage, 0, charCnt, textBuf)
+            text = bytes(textBuf)[:charCnt * 2].decode('utf-16-le', 'surrogatepass')
+            if len(text) != charCnt:
+                # some characters are out of the BMP, take them one by one to keep the indices
+                text = ''.join(chr(PDFIUM.FPDFText_GetUnicode(textpage, i)) for i in range(charCnt))
             # 
-            # transform rects to image coordinate
+            # there is no bulk API for the boxes, but the ctypes arguments are created only once
+            left = ctypes.c_double()
+            bottom = ctypes.c_double()
+            right = ctypes.c_double()
+            top = ctypes.c_double()
+            left_ref, right_ref, bottom_ref, top_ref = ctypes.byref(left), ctypes.byref(right), ctypes.byref(bottom), ctypes.byref(top)
+            get_char_box = PDFIUM.FPDFText_GetCharBox
+            boxes = []
             for i in range(charCnt):
-                char_rects[i] = self._rect_transform_pdfium(rotation, crop_box, char_rects[i])
-            for i in range(len(merged_rects)):
-                merged_rects[i][0] = self._rect_transform_pdfium(rotation, crop_box, merged_rects[i][0])
+                get_char_box(textpage, i, left_ref, right_ref, bottom_ref, top_ref)
+                boxes.append((left.value, top.value, right.value, bottom.value))
+            boxes = np.array(boxes, dtype=np.float64).reshape(charCnt, 4)
+            merged_boxes, line_ranges = self._merge_char_rects(text, boxes)
+            # 
+            # transform rects to image coordinate, for all of them at once
+            char_rects = np.stack(self._rect_transform_pdfium(rotation, crop_box, boxes.T), axis=1)
+            line_rects = np.stack(self._rect_transform_pdfium(rotation, crop_box, merged_boxes.T), axis=1)
             # 
-            text_objects = [chars, char_rects, merged_rects]
-            PDFIUM.FPDFText_ClosePage(textpage)
-            PDFIUM.FPDF_ClosePage(page)
+            text_objects = [text, char_rects, line_rects, line_ranges]
         elif PDF_BACKEND == 'POPPLER':
             # Not implemented
             pass
@@ -454,7 +475,7 @@ class PdfInternalWorker(Process):
         # TODO
         objects = []
         if PDF_BACKEND == 'PDFIUM':
-            page = PDFIUM.FPDF_LoadPage(doc, page_no)
+            page = self.page_cache.get_page(page_no)
             objCnt = PDFIUM.FPDFPage_CountObjects(page)
             for i in range(objCnt):
                 obj = PDFIUM.FPDFPage_GetObject(page, i)
@@ -472,7 +493,6 @@ class PdfInternalWorker(Process):
                     pass
                 else:
                     pass
-            PDFIUM.FPDF_ClosePage(page)
         elif PDF_BACKEND == 'POPPLER':
             # Not implemented
             pass
@@ -484,7 +504,7 @@ class PdfInternalWorker(Process):
     def get_link_objects(self, doc, page_no):
         link_objects = []
         if PDF_BACKEND == 'PDFIUM':
-            page = PDFIUM.FPDF_LoadPage(doc, page_no)
+            page = self.page_cache.get_page(page_no)
             # 
             crop_box = self._get_page_crop_box_pdfium(page)
             rotation = PDFIUM.FPDFPage_GetRotation(page)
@@ -506,7 +526,6 @@ class PdfInternalWorker(Process):
                 link_objects.append([dest_pg_no, rect])
                 # 
                 ret = PDFIUM.FPDFLink_Enumerate(page, ctypes.byref(start_pos), ctypes.byref(link_annot))
-            PDFIUM.FPDF_ClosePage(page)
         elif PDF_BACKEND == 'POPPLER':
             # Not implemented
             pass
@@ -519,7 +538,7 @@ class PdfInternalWorker(Process):
         # TODO
         annot_objects = []
         if PDF_BACKEND == 'PDFIUM':
-            page = PDFIUM.FPDF_LoadPage(doc, page_no)
+            page = self.page_cache.get_page(page_no)
             page_height = PDFIUM.FPDF_GetPageHeightF(page)
             # 
             crop_box = self._get_page_crop_box_pdfium(page)
@@ -543,7 +562,6 @@ class PdfInternalWorker(Process):
                     pass
                 PDFIUM.FPDFPage_CloseAnnot(annot)
             # 
-            PDFIUM.FPDF_ClosePage(page)
         elif PDF_BACKEND == 'POPPLER':
             # Not implemented
             pass
@@ -552,52 +570,85 @@ class PdfInternalWorker(Process):
             pass
         return annot_objects
 
-    def receive_commands(self):
-        # collect all commands in queue
+    def receive_commands(self, block):
+        # collect all commands in queue, wait for the first one if block is True
         while True:
             try:
-                item = self.commandQ.get(block=False)
+                item = self.commandQ.get(block=block)
             except:
                 # will raise the Queue.Empty exception if the queue is empty
                 break
+            block = False
             command, params = item
-            if command == 'SET':
-                filename = params[0]
-                self.set_document(filename)
-                # debug('[SET] for ', self.filename)
-            elif command == 'PAGESIZES':
-                pages_size_inch = self.get_page_sizes()
-                self.resultsQ.put(['PAGESIZES_RES', self.filename, pages_size_inch])
-                # debug('[PAGESIZES] for ', self.filename)
-            elif command == 'TOC':
+            self.handle_command(command, params)
+
+    def handle_command(self, command, params):
+        if command == 'SET':
+            filename, doc_id = params
+            self.send_rendered_tiles() # still of the previous document
+            self.set_document(filename, doc_id)
+            # debug('[SET] for ', self.filename)
+        elif command == 'TILECACHE':
+            cache_dir, max_bytes = params
+            if self.tile_writer:
+                self.tile_writer.close()
+            self.tile_writer = TileDiskWriter(TileDiskCache(cache_dir, max_bytes))
+            if self.filename:
+                self.doc_hash = disk_cache_key(self.doc_id)
+        elif command == 'PAGESIZES':
+            # sent by send_page_sizes() in run()
+            self.page_sizes_sent = 0
+            # debug('[PAGESIZES] for ', self.filename)
+        elif command == 'TOC':
+            if not self.check_document():
+                return
+            # PDFium is not thread safe, the workers running as threads take turns
+            with self.pdf_lock:
                 toc = self.getTableOfContents()
-                self.resultsQ.put(['TOC_RES', self.filename, toc])
-                # debug('[TOC] for ', self.filename)
-            elif command == 'RENDER':
-                page_no, dpi, roi, visible_regions =params
-                self.save_rendering_command(page_no, dpi, roi, visible_regions)
-                # debug('[RENDER] for ', self.filename)
-            elif command == 'TEXTOBJECTS':
-                page_no = params[0]
+            self.resultsConn.send(['TOC_RES', self.filename, toc])
+            # debug('[TOC] for ', self.filename)
+        elif command == 'VIEWPORT':
+            owner, generation, requests = params
+            # the older requests of the owner are outdated, even if none of the new tiles comes to this worker
+            if not self.scheduler.advance(owner, generation):
+                return
+            now = time.time()
+            for page_no, patch_id, dpi, priority, x, y, w, h in unpack_render_requests(requests):
+                key = (page_no, dpi, x, y, w, h)
+                if now - self.recent_results.get(key, 0) < RECENT_RESULT_SECONDS:
+                    continue # just rendered for another view
+                self.scheduler.push(owner, generation, priority, key, [page_no, dpi, QtCore.QRectF(x, y, w, h), patch_id])
+            # debug('[VIEWPORT] for ', self.filename)
+        elif command == 'TEXTOBJECTS':
+            page_no = params[0]
+            if not self.check_document():
+                return
+            with self.pdf_lock:
                 objects = self.get_text_objects(self.doc, page_no)
-                if len(objects) > 0:
-                    self.resultsQ.put(['TEXTOBJECTS_RES', self.filename, page_no, objects])
-            elif command == 'LINKOBJECTS':
-                page_no = params[0]
+            if len(objects) > 0:
+                self.resultsConn.send(['TEXTOBJECTS_RES', self.filename, page_no, objects])
+        elif command == 'LINKOBJECTS':
+            page_no = params[0]
+            if not self.check_document():
+                return
+            with self.pdf_lock:
                 objects = self.get_link_objects(self.doc, page_no)
-                if len(objects) > 0:
-                    self.resultsQ.put(['LINKOBJECTS_RES', self.filename, page_no, objects])
-            elif command == 'ANNOTOBJECTS':
-                page_no = params[0]
+            if len(objects) > 0:
+                self.resultsConn.send(['LINKOBJECTS_RES', self.filename, page_no, objects])
+        elif command == 'ANNOTOBJECTS':
+            page_no = params[0]
+            if not self.check_document():
+                return
+            with self.pdf_lock:
                 objects = self.get_annot_objects(self.doc, page_no)
-                if len(objects) > 0:
-                    self.resultsQ.put(['ANNOTOBJECTS_RES', self.filename, page_no, objects])
-            elif command == 'STOP':
-                self.exit_flag = True
-                # debug('[STOP] for ', self.filename)
-            else:
-                # not supported command
-                assert(0)
+            if len(objects) > 0:
+                self.resultsConn.send(['ANNOTOBJECTS_RES', self.filename, page_no, objects])
+        elif command == 'STOP':
+            self.exit_flag = True
+            # debug('[STOP] for ', self.filename)
+        else:
+            # not supported command
+            assert(0)
 
     def render_mupdf(self, doc, page_no, dpi, roi):
         page = doc.loadPage(page_no)
@@ -657,7 +708,7 @@ class PdfInternalWorker(Process):
         return img, roi
 
     def render_pdfium(self, doc, page_no, dpi, roi):
-        page = PDFIUM.FPDF_LoadPage(doc, page_no)
+        page = self.page_cache.get_page(page_no)
         page_width = PDFIUM.FPDF_GetPageWidthF(page)
         page_height = PDFIUM.FPDF_GetPageHeightF(page)
         # 
@@ -676,10 +727,18 @@ class PdfInternalWorker(Process):
         debug("Render (PDFium) In: ", zoom_ratio)
         # time_0 = time.time()
         
-        # prepare white bitmap
+        # render into a free shared tile slot if possible, otherwise into a pooled QImage,
+        # both are in the native byte order of PDFium (BGRx), no conversion is needed.
+        # the bitmaps are reused, the pooled image is given back in run() after the tile is sent
         img_width = int((x2 - x1)*zoom_ratio + 0.5)
         img_height = int((y2 - y1)*zoom_ratio + 0.5)
-        bitmap = PDFIUM.FPDFBitmap_Create(img_width, img_height, 0)
+        tile = None
+        target = self.tile_ring.alloc_image(img_width, img_height)
+        if target is not None:
+            tile, img = target
+            bitmap = self.bitmap_pool.wrap(img)
+        else:
+            img, bitmap = self.bitmap_pool.acquire(img_width, img_height)
         PDFIUM.FPDFBitmap_FillRect(bitmap, 0, 0, img_width, img_height, 0xFFFFFFFF)
 
         # compute transform matrix and clip region
@@ -690,35 +749,68 @@ class PdfInternalWorker(Process):
 
         # render
         PDFIUM.FPDF_RenderPageBitmapWithMatrix(bitmap, page, matrix, valid_region, PDFIUM.FPDF_LCD_TEXT | PDFIUM.FPDF_ANNOT)
-        
-        # convert rendered image
-        buffer = PDFIUM.FPDFBitmap_GetBuffer(bitmap)
-        buffer_ = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_ubyte * (img_width * img_height * 4)))
-        # 
-        cvImg = np.frombuffer(buffer_.contents, dtype=np.uint8)
-        cvImg = cvImg.reshape(img_height, img_width, 4)
-        cvImg = cv2.cvtColor(cvImg, cv2.COLOR_BGRA2RGBA)
-        img = QtGui.QImage(cvImg.data, img_width, img_height, img_width*4, QtGui.QImage.Format_RGBA8888)
         # 
         debug("Render (PDFium) Out: ", img.width(), img.height())
         # time_a = time.time()
         # debug("render time ", time_a - time_0)
 
-        # release resources
-        if bitmap is not None:
-            PDFIUM.FPDFBitmap_Destroy(bitmap)
-        PDFIUM.FPDF_ClosePage(page)
+        # the bitmap is kept in the pool and the page in the page cache
 
         roi.setCoords(x1 * zoom_ratio, y1 * zoom_ratio, x2 * zoom_ratio, y2 * zoom_ratio) # write back roi
-        return img, roi
+        return img, roi, tile
 
     def render(self, page_no, dpi, roi):
+        # return the image, the real roi and the descriptor of the shared tile slot holding the image (None if not)
         if PDF_BACKEND == 'PDFIUM':
             return self.render_pdfium(self.doc, page_no, dpi, roi)
         elif PDF_BACKEND == 'POPPLER':
-            return self.render_poppler(self.doc, page_no, dpi, roi)
+            img, roi = self.render_poppler(self.doc, page_no, dpi, roi)
+            return img, roi, None
         elif PDF_BACKEND == 'MUPDF':
-            return self.render_mupdf(self.doc, page_no, dpi, roi)
+            img, roi = self.render_mupdf(self.doc, page_no, dpi, roi)
+            return img, roi, None
+
+    def remember_result(self, key):
+        now = time.time()
+        if len(self.recent_results) > 256:
+            self.recent_results = {k: t for k, t in self.recent_results.items() if now - t < RECENT_RESULT_SECONDS}
+        self.recent_results[key] = now
+
+    def render_tile(self, command):
+        page_no, dpi, roi, patch_id = command
+        key = (page_no, dpi, roi.x(), roi.y(), roi.width(), roi.height())
+
+        time_0 = time.time()
+        with self.pdf_lock:
+            img, roi, tile = self.render(page_no, dpi, roi)
+        self.render_seconds = time.time() - time_0
+        
+        # raw pixels go to the shared tile slots, only the descriptor goes through the queue
+        if tile is None:
+            tile = self.tile_ring.put_image(img)
+        
+        if len(self.rendered_tiles) == 0:
+            self.rendered_tiles_time = time.time()
+        self.rendered_tiles.append([page_no, dpi, patch_id, roi, tile, img])
+        self.remember_result(key)
+
+    def send_rendered_tiles(self):
+        if len(self.rendered_tiles) == 0:
+            return
+        results = [[page_no, dpi, patch_id, roi, tile] for page_no, dpi, patch_id, roi, tile, img in self.rendered_tiles]
+        self.resultsConn.send(['RENDER_RES', self.filename, self.doc_id, results])
+        debug("%d tiles sent in a batch after %.1f ms" % (len(results), (time.time() - self.rendered_tiles_time) * 1000))
+        # 
+        # keep a copy on disk for reopening, after the results have been sent.
+        # the slots are not reused before the next rendering, so the images are still valid
+        if self.tile_writer and self.doc_hash:
+            for page_no, dpi, patch_id, roi, tile, img in self.rendered_tiles:
+                self.tile_writer.store(self.doc_hash, page_no, dpi, patch_id, roi, img)
+        if self.bitmap_pool:
+            with self.pdf_lock:
+                for page_no, dpi, patch_id, roi, tile, img in self.rendered_tiles:
+                    self.bitmap_pool.release(img)
+        self.rendered_tiles = []
 
     def run(self):
         """ render(int, float)
@@ -727,109 +819,221 @@ class PdfInternalWorker(Process):
         debug('PdfInternalWorker entered.')
 
         while self.exit_flag == False:
-            QtCore.QThread.msleep(20)
-
-            self.receive_commands()
-
-            # no file or no request even after reading pipe
-            if self.doc is None or len(self.requests_queue) == 0:
-                continue
-
-            # render the first one in queue
-            # debug("Request List: ", self.requests_list)
-            
-            command = self.get_command_from_queue()
-            if command is None:
-                continue
-            
-            page_no, dpi, roi = command
-
-            img, roi = self.render(page_no, dpi, roi)
-            
-            # QImage to QByteArray
-            img_byte_array = QtCore.QByteArray()
-            img_buffer = QtCore.QBuffer(img_byte_array)
-            img_buffer.open(QtCore.QIODevice.WriteOnly)
-            img.save(img_buffer, "png", quality=100)
-            
-            self.resultsQ.put(['RENDER_RES', self.filename, page_no, dpi, roi, img_byte_array])
-
+            # sleep in the queue until new commands arrive if there is nothing to render
+            idle = self.doc is None or (len(self.scheduler) == 0 and self.page_sizes_sent is None and len(self.rendered_tiles) == 0)
+            self.receive_commands(block=idle)
+            if self.doc is not None:
+                self.check_document()
+
+            # one chunk of page sizes at a time, the visible tiles are rendered in between
+            if self.doc is not None and self.page_sizes_sent is not None:
+                with self.pdf_lock:
+                    self.send_page_sizes()
+
+            # render the one nearest to the viewport focus
+            command = None
+            if self.doc is not None and len(self.scheduler) > 0:
+                command = self.scheduler.pop()
+            if command is not None:
+                self.render_tile(command)
+
+            # flush the batch before the next rendering if it would be too old after it,
+            # if nothing else is queued, or if the shared slots are all held by it
+            if len(self.rendered_tiles) > 0 and (
+                len(self.scheduler) == 0
+                or time.time() - self.rendered_tiles_time + self.render_seconds >= TILE_BATCH_SECONDS
+                or not self.tile_ring.has_free_slot()
+                ):
+                self.send_rendered_tiles()
+
+        with self.pdf_lock:
+            if self.bitmap_pool:
+                self.bitmap_pool.clear()
+            self.close_document()
+        if self.tile_writer:
+            self.tile_writer.close()
+        self.tile_ring.close()
         debug('PdfInternalWorker exited.')
 
 class PdfWorker(QtCore.QObject):
-    pageSizesReceived = QtCore.pyqtSignal(str, list)
+    pageSizesReceived = QtCore.pyqtSignal(str, object, int, int, object) # filename, doc_id, page counts, start, (N, 2) array
     bookmarksReceived = QtCore.pyqtSignal(str, list)
-    renderedImageReceived = QtCore.pyqtSignal(str, int, float, QtCore.QRectF, QtGui.QImage)
+    renderedImagesReceived = QtCore.pyqtSignal(object, list) # doc_id, [[page_no, dpi, patch_id, roi, image], ...]
     textObjectsReceived = QtCore.pyqtSignal(str, int, list)
     linkObjectsReceived = QtCore.pyqtSignal(str, int, list)
     annotObjectsReceived = QtCore.pyqtSignal(str, int, list)
     # 
-    def __init__(self):
+    def __init__(self, backend=WORKER_BACKEND):
         super(PdfWorker, self).__init__()
-        self.commandQ = Queue()
-        self.resultsQ = Queue()
-        self.worker = PdfInternalWorker(self.commandQ, self.resultsQ)
-        self.worker.start()
-
-        # read the queue periodically
-        self.queue_timer = QtCore.QTimer(self)
-        self.queue_timer.timeout.connect(self._retrieveQueueResults)
-        self.queue_timer.start(20)
+        self.backend = backend
+        # the state sent to the worker, sent again to a restarted one
+        self.document = None # [filename, doc_id]
+        self.tile_cache_args = None # [cache_dir, max_bytes]
+        self.viewports = {} # owner -> [generation, requests] of the latest viewport
+        self.stopped = False
+        self.runner_notifier = None
+        self._startRunner()
+
+    def _startRunner(self):
+        if self.backend == 'THREAD':
+            # the same loop in a thread of this process, the commands and results are passed without pickling
+            self.commandQ = queue.Queue()
+            self.resultsConn = LocalConnection()
+            self.tile_ring = LocalTileRing()
+            self.worker = PdfInternalWorker(self.commandQ, self.resultsConn, self.tile_ring, PDFIUM_LOCK)
+            # a fault on a mapping of a file truncated between the checks would take the GUI down with it
+            self.worker.map_document_file = False
+            self.runner = threading.Thread(target=self.worker.run, daemon=True)
+        else:
+            self.commandQ = Queue()
+            self.resultsConn, workerConn = Pipe(duplex=False)
+            self.tile_ring = SharedTileRing()
+            self.worker = PdfInternalWorker(self.commandQ, workerConn, self.tile_ring)
+            self.runner = self.worker
+        self.runner.start()
+        if self.backend != 'THREAD':
+            # only the process writes the results, a message cut off by its death ends in EOFError instead of blocking
+            workerConn.close()
+
+        if sys.platform == 'win32':
+            # QSocketNotifier does not work with pipe handles on Windows, read the pipe periodically
+            self.results_timer = QtCore.QTimer(self)
+            self.results_timer.timeout.connect(self._retrieveQueueResults)
+            self.results_timer.timeout.connect(self._checkRunner)
+            self.results_timer.start(20)
+            self.results_notifier = None
+        else:
+            # wake up only when the worker has written something
+            self.results_timer = None
+            self.results_notifier = QtCore.QSocketNotifier(self.resultsConn.fileno(), QtCore.QSocketNotifier.Read, self)
+            self.results_notifier.activated.connect(self._retrieveQueueResults)
+            if self.backend != 'THREAD':
+                # and when the process has died, e.g. of a SIGBUS on a document truncated while being read
+                self.runner_notifier = QtCore.QSocketNotifier(self.runner.sentinel, QtCore.QSocketNotifier.Read, self)
+                self.runner_notifier.activated.connect(self._checkRunner)
+
+        if self.tile_cache_args is not None:
+            self.commandQ.put(['TILECACHE', self.tile_cache_args])
+        # unless the file has been rewritten since, then it waits for the GUI side to set the new one
+        if self.document is not None and file_identity(self.document[0]) == self.document[1]:
+            self.commandQ.put(['SET', self.document])
+            for owner, (generation, requests) in self.viewports.items():
+                self.commandQ.put(['VIEWPORT', [owner, generation, requests]])
 
     def __del__(self):
         self.stop()
 
-    def setDocument(self, filename):
-        self.commandQ.put(['SET', [filename]])
+    def _checkRunner(self):
+        # restart a worker that has died, with the document and the pending tiles of the dead one
+        if self.stopped or self.runner.is_alive():
+            return
+        debug("PdfWorker runner died (%s), restarted" % getattr(self.runner, 'exitcode', None))
+        # the results left in the pipe are dropped, their tiles are requested again with the viewports
+        self._closeRunner()
+        self.resultsConn.close()
+        if self.backend != 'THREAD':
+            # nobody reads the queue any more, do not wait for it at exit
+            self.commandQ.cancel_join_thread()
+        self._startRunner()
+
+    def _closeRunner(self):
+        if self.results_timer:
+            self.results_timer.stop()
+            self.results_timer.deleteLater()
+            self.results_timer = None
+        if self.results_notifier:
+            self.results_notifier.setEnabled(False)
+            self.results_notifier.deleteLater()
+            self.results_notifier = None
+        if self.runner_notifier:
+            self.runner_notifier.setEnabled(False)
+            self.runner_notifier.deleteLater()
+            self.runner_notifier = None
+        if not self.tile_ring.closed:
+            self.tile_ring.close()
+            self.tile_ring.unlink()
+
+    def _send(self, command, params):
+        self._checkRunner()
+        self.commandQ.put([command, params])
+
+    def setDocument(self, filename, doc_id):
+        self.document = [filename, doc_id]
+        self.viewports = {}
+        self._send('SET', self.document)
+
+    def setTileCache(self, cache_dir, max_bytes):
+        self.tile_cache_args = [cache_dir, max_bytes]
+        self._send('TILECACHE', self.tile_cache_args)
 
     def requestGetPageSizes(self):
-        self.commandQ.put(['PAGESIZES', [None]])
+        self._send('PAGESIZES', [None])
 
     def requestGetBookmarks(self):
-        self.commandQ.put(['TOC', [None]])
+        self._send('TOC', [None])
         
-    def requestRenderPage(self, page_no, dpi, roi, visible_regions):
-        self.commandQ.put(['RENDER', [page_no, dpi, roi, visible_regions]])
+    def requestViewport(self, owner, generation, requests):
+        # the packed tiles of a RenderBatch, requests of older generations of the same owner will be cancelled,
+        # and smaller priority values are rendered first
+        self.viewports[owner] = [generation, requests]
+        self._send('VIEWPORT', [owner, generation, requests])
 
     def requestGetTextObjects(self, page_no):
-        self.commandQ.put(['TEXTOBJECTS', [page_no]])
+        self._send('TEXTOBJECTS', [page_no])
 
     def requestGetLinkObjects(self, page_no):
-        self.commandQ.put(['LINKOBJECTS', [page_no]])
+        self._send('LINKOBJECTS', [page_no])
 
     def requestGetAnnotationObjects(self, page_no):
-        self.commandQ.put(['ANNOTOBJECTS', [page_no]])
+        self._send('ANNOTOBJECTS', [page_no])
 
     def stop(self):
-        self.commandQ.put(['STOP', []])
-        self.worker.join()
+        self.stopped = True
+        if self.runner.is_alive():
+            self.commandQ.put(['STOP', []])
+            # keep draining the pipe, the worker may be blocked in sending a big message
+            while self.runner.is_alive():
+                try:
+                    while self.resultsConn.poll():
+                        self.resultsConn.recv()
+                except (EOFError, OSError):
+                    pass # its end of the pipe is closed, it is exiting
+                self.runner.join(0.02)
+        self._closeRunner()
 
     def _retrieveQueueResults(self):
-        while True:
+        while self.resultsConn.poll():
             try:
-                item = self.resultsQ.get(block=False)
-            except:
-                # will raise the Queue.Empty exception if the queue is empty
+                item = self.resultsConn.recv()
+            except (EOFError, OSError):
+                # the worker has exited, maybe in the middle of a message, it is restarted by _checkRunner()
+                if self.results_notifier:
+                    self.results_notifier.setEnabled(False)
                 break
             # 
             message = item[0]
             filename = item[1]
             # 
             if message == 'PAGESIZES_RES':
-                pages_size_inch = item[2]
-                self.pageSizesReceived.emit(filename, pages_size_inch)
+                doc_id, page_counts, start, pages_size_inch = item[2:]
+                self.pageSizesReceived.emit(filename, doc_id, page_counts, start, pages_size_inch)
             elif message == 'TOC_RES':
                 toc = item[2]
                 self.bookmarksReceived.emit(filename, toc)
             elif message == 'RENDER_RES':
-                page_no, dpi, roi, img_byte_array = item[2:]
-
-                # QByteArray to QImage
-                img_buffer = QtCore.QBuffer(img_byte_array)
-                img_buffer.open(QtCore.QIODevice.ReadOnly)
-                image = QtGui.QImageReader(img_buffer).read()
-                # 
-                self.renderedImageReceived.emit(filename, page_no, dpi, roi, image)
+                doc_id, results = item[2:]
+
+                # wrap the shared tile slots without copying,
+                # the receivers must copy the images (e.g. QPixmap.fromImage()) if they want to keep them
+                images = []
+                for page_no, dpi, patch_id, roi, tile in results:
+                    image = self.tile_ring.get_image(tile)
+                    if image is not None:
+                        images.append([page_no, dpi, patch_id, roi, image])
+                if len(images) > 0:
+                    self.renderedImagesReceived.emit(doc_id, images)
+                for page_no, dpi, patch_id, roi, tile in results:
+                    self.tile_ring.release(tile)
             elif message == 'TEXTOBJECTS_RES':
                 page_no, objects = item[2:]
                 self.textObjectsReceived.emit(filename, page_no, objects)
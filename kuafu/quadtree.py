@@ -0,0 +1,35 @@
+"""
+Addressing of the patches of a page, which form a quadtree.
+At level L the page is split into 2^L x 2^L patches, and patch (i, j) (row, column) has the id
+
+    4^L + i * 2^L + j
+
+so the ids of a level lie in [4^L, 2 * 4^L) and the root (the whole page) is 1.
+The ancestor of (L, i, j) at level L - k is (L - k, i >> k, j >> k), all relations are computed with bit operations.
+"""
+
+def patch_id(level, i, j):
+    return (1 << (2 * level)) + (i << level) + j
+
+def patch_address(pid):
+    # (level, i, j) of a patch id
+    level = (pid.bit_length() - 1) >> 1
+    offset = pid - (1 << (2 * level))
+    return level, offset >> level, offset & ((1 << level) - 1)
+
+def is_descendant(pid, ancestor_pid):
+    # whether the patch pid is inside ancestor_pid, at a deeper level
+    level, i, j = patch_address(pid)
+    ancestor_level, ancestor_i, ancestor_j = patch_address(ancestor_pid)
+    shift = level - ancestor_level
+    if shift <= 0:
+        return False
+    return (i >> shift) == ancestor_i and (j >> shift) == ancestor_j
+
+def covering_range(start, end, step, count):
+    # [first, last) of the cells of size step (count of them from 0) overlapping [start, end)
+    if end <= start or step <= 0:
+        return 0, 0
+    first = min(max(int(start // step), 0), count)
+    last = min(int(-(-end // step)), count)
+    return first, max(first, last)
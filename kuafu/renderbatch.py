@@ -0,0 +1,36 @@
+import numpy as np
+
+# one record for each tile in the VIEWPORT messages from the views to a PdfInternalWorker,
+# the roi (x, y, w, h) is in the rendering coordinates of the page
+RENDER_REQUEST_DTYPE = np.dtype([
+    ('page_no', '<i4'),
+    ('patch_id', '<i4'),
+    ('dpi', '<f8'),
+    ('priority', '<f8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('w', '<f8'),
+    ('h', '<f8'),
+    ])
+
+class RenderBatch(object):
+    """
+    The tiles requested by a view in one viewport change, split by the workers they are routed to.
+    Each worker gets them in a single VIEWPORT message as packed RENDER_REQUEST_DTYPE records,
+    instead of one pickled command (with a QRectF) for each tile.
+    """
+    def __init__(self, generation, worker_num):
+        self.generation = generation
+        self.requests = [[] for i in range(worker_num)]
+        self.count = 0
+
+    def add(self, worker_idx, page_no, dpi, roi, patch_id, priority):
+        self.requests[worker_idx].append((page_no, patch_id, dpi, priority, roi.x(), roi.y(), roi.width(), roi.height()))
+        self.count += 1
+
+    def pack(self, worker_idx):
+        return np.array(self.requests[worker_idx], dtype=RENDER_REQUEST_DTYPE).tobytes()
+
+def unpack_render_requests(data):
+    # [(page_no, patch_id, dpi, priority, x, y, w, h), ...]
+    return np.frombuffer(data, dtype=RENDER_REQUEST_DTYPE).tolist()
@@ -0,0 +1,66 @@
+import heapq
+import itertools
+
+class RenderScheduler(object):
+    """
+    Priority queue of the rendering requests in PdfInternalWorker.
+    The request with the smallest priority value (the distance to the viewport focus) is rendered first.
+    Requests come from several owners (the views), each owner has its own generation,
+    and the queued requests of an owner become outdated once a request of a newer generation arrives.
+    Identical requests of different owners are merged into one entry and rendered once.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.heap = [] # entries of [priority, sequence number, key, owners, command]
+        self.entries = {} # key -> entry, used to merge duplicated requests
+        self.generations = {} # owner -> the latest generation
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_alive(self, entry):
+        # an entry is still wanted if any of its owners has not moved to a newer generation
+        for owner, generation in entry[3].items():
+            if self.generations[owner] == generation:
+                return True
+        return False
+
+    def advance(self, owner, generation):
+        # a new viewport of this owner makes its older requests outdated, they are dropped lazily when popped.
+        # return False if the generation is already outdated
+        if generation < self.generations.get(owner, -1):
+            return False # too late, the viewport has already changed
+        self.generations[owner] = generation
+        return True
+
+    def push(self, owner, generation, priority, key, command):
+        if not self.advance(owner, generation):
+            return
+        #
+        owners = {owner: generation}
+        entry = self.entries.get(key)
+        if entry is not None and self.is_alive(entry):
+            entry[3][owner] = generation
+            if entry[0] <= priority:
+                return # already queued with a higher priority
+            owners = entry[3]
+        if entry is not None:
+            entry[4] = None # mark the old entry as removed, it will be skipped when popped
+        entry = [priority, next(self.counter), key, owners, command]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+
+    def pop(self):
+        # return the command with the highest priority, None if the queue is empty
+        while len(self.heap) > 0:
+            entry = heapq.heappop(self.heap)
+            command = entry[4]
+            if command is None:
+                continue
+            self.entries.pop(entry[2])
+            if self.is_alive(entry):
+                return command
+        return None
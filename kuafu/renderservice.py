@@ -0,0 +1,138 @@
+from PyQt5 import QtCore
+from PyQt5 import QtGui
+
+from pdfworker import PdfWorker, WORKER_BACKEND
+from tilecache import shared_tile_cache
+from renderbatch import RenderBatch
+from utils import debug, file_identity
+
+import os
+
+def default_worker_num(backend=WORKER_BACKEND):
+    # the threads render one at a time under PDFIUM_LOCK, more of them would only cost document handles
+    if backend == 'THREAD':
+        return 1
+    # one worker for each core, leaving one for the GUI, but not too many document handles
+    return max(1, min((os.cpu_count() or 2) - 1, 4))
+
+class RenderService(QtCore.QObject):
+    """
+    The pool of PdfWorker processes (or threads, see WORKER_BACKEND) shared by all views and the LibraryView.
+    Every worker keeps one handle of the current document, which is only reloaded when the file changes.
+    A tile is always routed to the same worker, so the identical requests of different views
+    are merged in its scheduler and rendered once. The tiles of a viewport change are collected
+    between beginViewport() and submitViewport(), and sent as one message to each worker. The rendered tiles are put into the shared
+    tile cache and broadcast to all views by tilesRendered, in the batches sent by the workers.
+    Page sizes, bookmarks and page objects are always requested from the first worker.
+    A worker that dies (e.g. of a document truncated while being read) is restarted by its PdfWorker,
+    with the document and the latest viewports sent to it.
+    """
+    tilesRendered = QtCore.pyqtSignal(object, list) # doc_id, [[page_no, dpi, patch_id, roi, pixmap], ...]
+    pageSizesReceived = QtCore.pyqtSignal(str, object, int, int, object)
+    bookmarksReceived = QtCore.pyqtSignal(str, list)
+    textObjectsReceived = QtCore.pyqtSignal(str, int, list)
+    linkObjectsReceived = QtCore.pyqtSignal(str, int, list)
+    annotObjectsReceived = QtCore.pyqtSignal(str, int, list)
+
+    def __init__(self, worker_num=None, backend=WORKER_BACKEND):
+        super(RenderService, self).__init__()
+        if worker_num is None:
+            worker_num = default_worker_num(backend)
+        self.filename = None
+        self.doc_id = None # file_identity() of the loaded document
+        self.tile_cache_args = None
+        self.tile_cache = shared_tile_cache
+        self.pending_batches = {} # owner -> RenderBatch of the current viewport change
+        self.worker_list = []
+        for i in range(worker_num):
+            tmpWorker = PdfWorker(backend)
+            tmpWorker.renderedImagesReceived.connect(self.onRenderedImagesReceived)
+            self.worker_list.append(tmpWorker)
+        #
+        info_worker = self.worker_list[0]
+        info_worker.pageSizesReceived.connect(self.pageSizesReceived)
+        info_worker.bookmarksReceived.connect(self.bookmarksReceived)
+        info_worker.textObjectsReceived.connect(self.textObjectsReceived)
+        info_worker.linkObjectsReceived.connect(self.linkObjectsReceived)
+        info_worker.annotObjectsReceived.connect(self.annotObjectsReceived)
+        debug("Render service started with %d workers (%s)" % (worker_num, backend))
+
+    def workerCount(self):
+        return len(self.worker_list)
+
+    def setDocument(self, filename):
+        # all views of a library show the same document, load it only once in each worker,
+        # unless the file has been rewritten since
+        doc_id = file_identity(filename)
+        if doc_id == self.doc_id:
+            return
+        self.filename = filename
+        self.doc_id = doc_id
+        for wk in self.worker_list:
+            wk.setDocument(filename, doc_id)
+
+    def setTileCache(self, cache_dir, max_bytes):
+        if [cache_dir, max_bytes] == self.tile_cache_args:
+            return
+        self.tile_cache_args = [cache_dir, max_bytes]
+        for wk in self.worker_list:
+            wk.setTileCache(cache_dir, max_bytes)
+
+    def requestGetPageSizes(self):
+        self.worker_list[0].requestGetPageSizes()
+
+    def requestGetBookmarks(self):
+        self.worker_list[0].requestGetBookmarks()
+
+    def requestGetTextObjects(self, page_no):
+        self.worker_list[0].requestGetTextObjects(page_no)
+
+    def requestGetLinkObjects(self, page_no):
+        self.worker_list[0].requestGetLinkObjects(page_no)
+
+    def requestGetAnnotationObjects(self, page_no):
+        self.worker_list[0].requestGetAnnotationObjects(page_no)
+
+    def beginViewport(self, owner, generation):
+        self.pending_batches[owner] = RenderBatch(generation, len(self.worker_list))
+
+    def requestRenderPage(self, owner, page_no, dpi, roi, patch_id, priority):
+        # the neighbouring patches go to different workers, and the same patch always goes to the same one
+        worker_idx = (page_no + patch_id) % len(self.worker_list)
+        self.pending_batches[owner].add(worker_idx, page_no, dpi, roi, patch_id, priority)
+        return worker_idx
+
+    def submitViewport(self, owner):
+        batch = self.pending_batches.pop(owner, None)
+        if batch is None:
+            return
+        # every worker gets the new generation, an empty batch still cancels the older requests of the owner
+        for i, wk in enumerate(self.worker_list):
+            wk.requestViewport(owner, batch.generation, batch.pack(i))
+
+    def onRenderedImagesReceived(self, doc_id, images):
+        # the tiles of the previous document, or of the file before it was rewritten
+        if doc_id != self.doc_id:
+            return
+        # the images only wrap the memory of the worker, copy them to the shared cache once for all views.
+        # QPixmap.fromImage() shares the memory of an image in the native format (RGB32), so copy explicitly
+        tiles = []
+        for page_no, dpi, patch_id, roi, image in images:
+            key = (doc_id, page_no, dpi, patch_id)
+            pixmap = self.tile_cache.insert(key, QtGui.QPixmap.fromImage(image.copy()), roi.x(), roi.y())
+            tiles.append([page_no, dpi, patch_id, roi, pixmap])
+        self.tilesRendered.emit(doc_id, tiles)
+
+    def stop(self):
+        for wk in self.worker_list:
+            wk.stop()
+        self.worker_list = []
+
+_render_service = None
+
+def sharedRenderService():
+    # created on the first use, after the QApplication
+    global _render_service
+    if _render_service is None or _render_service.workerCount() == 0:
+        _render_service = RenderService()
+    return _render_service
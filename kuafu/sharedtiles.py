@@ -0,0 +1,161 @@
+from PyQt5 import QtGui
+from PyQt5 import sip
+from multiprocessing import shared_memory
+from utils import debug
+import numpy as np
+
+# the patches from PageGraphicsItem.compute_patch_grid() are around 1000 pixels in the short side,
+# bigger tiles (or tiles rendered when all slots are busy) are sent as raw bytes instead
+TILE_SLOT_COUNT = 4
+TILE_SLOT_BYTES = 1536 * 2048 * 4
+
+SLOT_FREE = 0
+SLOT_BUSY = 1
+
+class SharedTileRing(object):
+    """
+    A ring of tile slots in shared memory, which is written by PdfInternalWorker and read by PdfWorker.
+    Only a small descriptor (slot id, geometry and generation) goes through the queue,
+    and the image is wrapped in the GUI side without copying.
+    The pixels are kept in QImage.Format_RGB32, the native byte order of PDFium (BGRx in memory),
+    so PDFium can render into a slot directly.
+    """
+    def __init__(self, slot_count=TILE_SLOT_COUNT, slot_bytes=TILE_SLOT_BYTES):
+        self.slot_count = slot_count
+        self.slot_bytes = slot_bytes
+        # one (state, generation) pair for each slot
+        self.header_shm = shared_memory.SharedMemory(create=True, size=slot_count * 8)
+        self.data_shm = shared_memory.SharedMemory(create=True, size=slot_count * slot_bytes)
+        self._attach()
+        self.header[:, :] = 0
+        self.next_slot = 0
+        self.closed = False
+
+    def __getstate__(self):
+        # only the names are pickled, the memory is attached again in the other process
+        return [self.slot_count, self.slot_bytes, self.header_shm.name, self.data_shm.name]
+
+    def __setstate__(self, state):
+        self.slot_count, self.slot_bytes, header_name, data_name = state
+        self.header_shm = shared_memory.SharedMemory(name=header_name)
+        self.data_shm = shared_memory.SharedMemory(name=data_name)
+        self._attach()
+        self.next_slot = 0
+        self.closed = False
+
+    def _attach(self):
+        self.header = np.ndarray((self.slot_count, 2), dtype=np.uint32, buffer=self.header_shm.buf)
+        self.data = np.ndarray((self.slot_count, self.slot_bytes), dtype=np.uint8, buffer=self.data_shm.buf)
+
+    def _acquire_slot(self):
+        # find a free slot in round-robin order, None if all of them are still in use by the GUI side
+        for k in range(self.slot_count):
+            slot_id = (self.next_slot + k) % self.slot_count
+            if self.header[slot_id, 0] == SLOT_FREE:
+                self.next_slot = (slot_id + 1) % self.slot_count
+                self.header[slot_id, 1] += 1 # new generation
+                self.header[slot_id, 0] = SLOT_BUSY
+                return slot_id, int(self.header[slot_id, 1])
+        return None, None
+
+    def has_free_slot(self):
+        return bool((self.header[:, 0] == SLOT_FREE).any())
+
+    def alloc_image(self, width, height):
+        # called in the worker process, return [descriptor, QImage over a free slot] to render into directly,
+        # None if the image is too big or all slots are busy
+        stride = width * 4
+        if stride * height > self.slot_bytes:
+            return None
+        slot_id, generation = self._acquire_slot()
+        if slot_id is None:
+            return None
+        # wrap the address (not the buffer), otherwise QImage takes the memory as read-only and bits() detaches it
+        address = self.data[slot_id].ctypes.data
+        img = QtGui.QImage(sip.voidptr(address), width, height, stride, QtGui.QImage.Format_RGB32)
+        return ['SHM', width, height, stride, slot_id, generation], img
+
+    def put_image(self, img):
+        # called in the worker process, copy the raw pixels of a QImage and return the descriptor
+        img = img.convertToFormat(QtGui.QImage.Format_RGB32)
+        width = img.width()
+        height = img.height()
+        stride = width * 4
+        ptr = img.constBits()
+        ptr.setsize(img.byteCount())
+        src = np.frombuffer(ptr, dtype=np.uint8).reshape(height, img.bytesPerLine())[:, :stride]
+        #
+        slot_id = None
+        if stride * height <= self.slot_bytes:
+            slot_id, generation = self._acquire_slot()
+        if slot_id is None:
+            debug("no free tile slot for %d x %d, fall back to raw bytes" % (width, height))
+            return ['RAW', width, height, stride, src.tobytes()]
+        #
+        dst = self.data[slot_id, :stride * height].reshape(height, stride)
+        dst[:, :] = src
+        return ['SHM', width, height, stride, slot_id, generation]
+
+    def get_image(self, tile):
+        # called in the GUI process, the returned QImage shares the memory of the slot,
+        # it is only valid before release() is called
+        kind, width, height, stride = tile[:4]
+        if kind == 'RAW':
+            return QtGui.QImage(tile[4], width, height, stride, QtGui.QImage.Format_RGB32)
+        slot_id, generation = tile[4:]
+        if self.header[slot_id, 0] != SLOT_BUSY or self.header[slot_id, 1] != generation:
+            debug("outdated tile slot %d (generation %d). skipping" % (slot_id, generation))
+            return None
+        buf = self.data[slot_id, :stride * height]
+        return QtGui.QImage(buf.data, width, height, stride, QtGui.QImage.Format_RGB32)
+
+    def release(self, tile):
+        # give the slot back to the worker
+        if tile[0] == 'SHM':
+            slot_id, generation = tile[4:]
+            if self.header[slot_id, 1] == generation:
+                self.header[slot_id, 0] = SLOT_FREE
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        del self.header
+        del self.data
+        self.header_shm.close()
+        self.data_shm.close()
+
+    def unlink(self):
+        self.header_shm.unlink()
+        self.data_shm.unlink()
+
+class LocalTileRing(object):
+    """
+    The counterpart of SharedTileRing for a PdfInternalWorker running as a thread of the GUI process.
+    The memory is shared already, a tile is passed as a QImage, copied once out of the pooled bitmap
+    which the worker reuses for the next tile.
+    """
+    def __init__(self):
+        self.closed = False
+
+    def has_free_slot(self):
+        return True
+
+    def alloc_image(self, width, height):
+        # always render into the bitmap pool
+        return None
+
+    def put_image(self, img):
+        return ['IMAGE', img.width(), img.height(), img.bytesPerLine(), img.copy()]
+
+    def get_image(self, tile):
+        return tile[4]
+
+    def release(self, tile):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def unlink(self):
+        pass
@@ -0,0 +1,64 @@
+import math
+import numpy as np
+
+class GridIndex(object):
+    """
+    A uniform grid over axis-aligned rects [x, y, w, h], for point queries on the text and link objects of a page.
+    It is built once with numpy when the objects arrive, each cell keeps the indices of the rects overlapping it
+    (in a CSR layout), so a query only tests the few rects of one cell.
+    """
+    def __init__(self, rects):
+        self.rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        count = len(self.rects)
+        self.cols = 0
+        self.rows = 0
+        if count == 0:
+            return
+        rx, ry, rw, rh = self.rects.T
+        self.x0 = rx.min()
+        self.y0 = ry.min()
+        width = max((rx + rw).max() - self.x0, 1e-6)
+        height = max((ry + rh).max() - self.y0, 1e-6)
+        # about one rect per cell if they were spread evenly
+        cell_size = math.sqrt(width * height / count)
+        self.cols = min(int(width / cell_size) + 1, 1024)
+        self.rows = min(int(height / cell_size) + 1, 1024)
+        self.cell_w = width / self.cols
+        self.cell_h = height / self.rows
+        #
+        # the range of cells covered by each rect
+        c0, r0 = self._cell_of(rx, ry)
+        c1, r1 = self._cell_of(rx + rw, ry + rh)
+        span_w = c1 - c0 + 1
+        counts = span_w * (r1 - r0 + 1)
+        # expand to (cell, rect) pairs
+        rect_ids = np.repeat(np.arange(count), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (r0[rect_ids] + offsets // span_w[rect_ids]) * self.cols + (c0[rect_ids] + offsets % span_w[rect_ids])
+        # a stable sort keeps the rects of a cell in their original order
+        order = np.argsort(cells, kind='stable')
+        self.items = rect_ids[order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.cols * self.rows + 1))
+
+    def _cell_of(self, x, y):
+        col = np.clip(((x - self.x0) / self.cell_w).astype(np.int64), 0, self.cols - 1)
+        row = np.clip(((y - self.y0) / self.cell_h).astype(np.int64), 0, self.rows - 1)
+        return col, row
+
+    def query(self, x, y):
+        # the indices (in the original order) of the rects containing the point
+        if self.cols == 0:
+            return []
+        if x < self.x0 or y < self.y0:
+            return []
+        # clipped as in _cell_of(), a point just inside the far edge may round to the next cell,
+        # the points beyond the rects are rejected by the test below
+        col = min(int((x - self.x0) / self.cell_w), self.cols - 1)
+        row = min(int((y - self.y0) / self.cell_h), self.rows - 1)
+        cell = row * self.cols + col
+        result = []
+        for idx in self.items[self.starts[cell]:self.starts[cell + 1]]:
+            rx, ry, rw, rh = self.rects[idx]
+            if rx <= x < rx + rw and ry <= y < ry + rh:
+                result.append(int(idx))
+        return result
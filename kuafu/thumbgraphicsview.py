@@ -11,8 +11,8 @@ class ThumbGraphicsView(BaseDocGraphicsView):
     pageRelocationFinished = QtCore.pyqtSignal()
     zoomRequest = QtCore.pyqtSignal(bool, int, float, float)
 
-    def __init__(self, parent, render_num=2):
-        super(ThumbGraphicsView, self).__init__(parent, render_num)
+    def __init__(self, parent):
+        super(ThumbGraphicsView, self).__init__(parent)
 
         self.scene.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.white)) # set background
 
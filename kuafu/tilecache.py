@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from utils import debug
+
+DEFAULT_TILE_CACHE_BYTES = 512 * 1024 * 1024
+
+class TileCache(object):
+    """
+    LRU cache of rendered tiles shared by all BaseDocGraphicsView instances, bounded by the bytes of the pixmaps.
+    A tile is keyed by (doc_id, page_no, dpi, patch_id), where doc_id is the file_identity() of the document,
+    so the tiles of a file rewritten in place are never shown for the new one. The views showing a tile are registered as holders
+    and get onTileEvicted(key) called when it is evicted, so that they drop their references too.
+    The views touch the tiles of their visible pages on every viewport change,
+    so the off-screen tiles are always the first to be evicted.
+    """
+    def __init__(self, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict() # key -> [pixmap, dx, dy, bytes, holders], the least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def setMaxBytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def lookup(self, key):
+        # return [pixmap, dx, dy] of the tile, or None
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[:3]
+
+    def insert(self, key, pixmap, dx, dy):
+        # return the pixmap kept in the cache, which is the existing one if the tile is already cached
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        nbytes = pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        self.entries[key] = [pixmap, dx, dy, nbytes, set()]
+        self.total_bytes += nbytes
+        self._evict()
+        return pixmap
+
+    def attach(self, key, holder):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[4].add(holder)
+
+    def detach(self, holder):
+        # the holder has dropped all its tiles (e.g. a new document is set)
+        for entry in self.entries.values():
+            entry[4].discard(holder)
+
+    def release(self, key, holder):
+        # the holder has dropped one tile (e.g. the item of the page is recycled)
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[4].discard(holder)
+
+    def touch(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry[3]
+        for holder in entry[4]:
+            holder.onTileEvicted(key)
+
+    def removePages(self, doc_id, page_nos):
+        # e.g. the tiles rendered for the estimated sizes of the pages
+        keys = [key for key in self.entries if key[0] == doc_id and key[1] in page_nos]
+        for key in keys:
+            self.remove(key)
+
+    def _evict(self):
+        # the most recent one is always kept, even if it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.remove(key)
+            debug("Tile evicted: ", key)
+
+shared_tile_cache = TileCache()
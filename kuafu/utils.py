@@ -1,4 +1,27 @@
+import hashlib
+import os
+
 DEBUG = False
 # DEBUG = True
 def debug(*args):
-    if DEBUG: print(*args)
\ No newline at end of file
+    if DEBUG: print(*args)
+
+def file_identity(filename):
+    # the path, size and modification time of a document, which change when the file is rewritten
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return (filename, None, None)
+    return (filename, stat.st_size, stat.st_mtime_ns)
+
+def file_digest(filename, sample_size=1024*1024):
+    # content hash of a document, only the size and the head and tail parts are read
+    # so that it is cheap enough even for huge scanned files
+    file_size = os.path.getsize(filename)
+    md5 = hashlib.md5(str(file_size).encode('utf-8'))
+    with open(filename, 'rb') as f:
+        md5.update(f.read(sample_size))
+        if file_size > sample_size:
+            f.seek(max(sample_size, file_size - sample_size))
+            md5.update(f.read(sample_size))
+    return md5.hexdigest()
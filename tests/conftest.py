@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# the modules of kuafu import each other by their plain names, as when the application is run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kuafu'))
+
+@pytest.fixture(scope='module')
+def pdfium_library():
+    # as at the import of pdfworker, for the modules calling PDFium directly
+    PDFIUM = pytest.importorskip('pypdfium')
+    PDFIUM.FPDF_InitLibraryWithConfig(PDFIUM.FPDF_LIBRARY_CONFIG(2, None, None, 0))
+    yield PDFIUM
+    PDFIUM.FPDF_DestroyLibrary()
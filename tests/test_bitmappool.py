@@ -0,0 +1,33 @@
+import pytest
+
+PDFIUM = pytest.importorskip('pypdfium')
+from bitmappool import BitmapPool
+
+pytestmark = pytest.mark.usefixtures('pdfium_library')
+
+def test_release_reuses_buffer():
+    pool = BitmapPool()
+    img, bitmap = pool.acquire(64, 32)
+    pool.release(img)
+    assert pool.total_bytes == img.byteCount()
+    img2, bitmap2 = pool.acquire(64, 32)
+    assert img2 is img
+    assert pool.total_bytes == 0
+    pool.release(img2)
+    pool.clear()
+
+def test_clear_destroys_lent_bitmaps():
+    pool = BitmapPool()
+    img, bitmap = pool.acquire(64, 32)
+    img.fill(0xff0000)
+    pool.clear()
+    assert pool.lent_buffers == {}
+    # the image outlives its bitmap, a late release is ignored instead of pooling a destroyed bitmap
+    assert img.pixel(0, 0) & 0xffffff == 0xff0000
+    pool.release(img)
+    assert pool.free_buffers == {}
+    assert pool.total_bytes == 0
+    img2, bitmap2 = pool.acquire(64, 32)
+    assert img2 is not img
+    pool.release(img2)
+    pool.clear()
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from docinfocache import DocInfoCache
+
+TOC = [[1, 'Introduction', 0, None], [2, 'Background', 1, None]]
+
+def write_document(path, content, mtime_ns):
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def sidecars(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.npz'))
+
+def test_round_trip(tmp_path):
+    cache = DocInfoCache(str(tmp_path / 'docinfo'))
+    doc = str(tmp_path / 'a.pdf')
+    write_document(doc, b'a' * 100, 10 ** 18)
+    assert cache.load(doc) is None
+    cache.store(doc, [[8.5, 11.0], [11.0, 8.5]], TOC)
+    pages_size_inch, toc = cache.load(doc)
+    assert np.allclose(pages_size_inch, [[8.5, 11.0], [11.0, 8.5]])
+    assert toc == TOC
+
+def test_store_removes_outdated_sidecar(tmp_path):
+    cache_dir = str(tmp_path / 'docinfo')
+    cache = DocInfoCache(cache_dir)
+    doc = str(tmp_path / 'a.pdf')
+    write_document(doc, b'a' * 100, 10 ** 18)
+    cache.store(doc, [[8.5, 11.0]], TOC)
+    first = sidecars(cache_dir)
+    # the same content touched, only the newest sidecar is kept
+    write_document(doc, b'a' * 100, 2 * 10 ** 18)
+    cache.store(doc, [[8.5, 11.0]], TOC)
+    second = sidecars(cache_dir)
+    assert len(first) == 1 and len(second) == 1
+    assert first != second
+    assert cache.load(doc) is not None
+
+def test_trim_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path / 'docinfo')
+    cache = DocInfoCache(cache_dir)
+    docs = []
+    for i in range(4):
+        doc = str(tmp_path / ('%d.pdf' % i))
+        write_document(doc, bytes([i]) * 100, 10 ** 18)
+        cache.store(doc, np.ones((1000, 2)), TOC)
+        docs.append(doc)
+    size = os.path.getsize(os.path.join(cache_dir, sidecars(cache_dir)[0]))
+    # oldest first, but the first document is used again
+    for i, doc in enumerate(docs):
+        path = cache.sidecar_path(doc)
+        os.utime(path, (i, i))
+    cache.load(docs[0])
+    # room for about two sidecars
+    cache.max_bytes = size * 2 + size // 2
+    doc = str(tmp_path / '4.pdf')
+    write_document(doc, b'\x04' * 100, 10 ** 18)
+    cache.store(doc, np.ones((1000, 2)), TOC)
+    assert cache.load(doc) is not None
+    assert cache.load(docs[0]) is not None
+    assert all(cache.load(doc) is None for doc in docs[1:])
@@ -0,0 +1,79 @@
+import ctypes
+import os
+
+import pytest
+
+PDFIUM = pytest.importorskip('pypdfium')
+from mappedfile import MappedDocumentFile
+
+pytestmark = pytest.mark.usefixtures('pdfium_library')
+
+def make_pdf(page_count):
+    # a minimal document of empty letter pages, with a valid cross-reference table
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join("%d 0 R" % (3 + i) for i in range(page_count))
+    objects.append(("<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, page_count)).encode())
+    for i in range(page_count):
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>")
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % (i + 1) + obj + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return data
+
+@pytest.fixture
+def pdf_file(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    # a few pages of memory, the truncated tail of the mapping is not backed by the file any more
+    path.write_bytes(make_pdf(200))
+    return str(path)
+
+def read_block(mapped_file, position, size):
+    buf = ctypes.create_string_buffer(size)
+    ok = mapped_file._get_block(None, position, ctypes.cast(buf, ctypes.POINTER(ctypes.c_ubyte)), size)
+    return ok, buf.raw
+
+def test_load_document(pdf_file):
+    mapped_file = MappedDocumentFile(pdf_file)
+    doc = mapped_file.load_document()
+    assert doc
+    assert PDFIUM.FPDF_GetPageCount(doc) == 200
+    PDFIUM.FPDF_CloseDocument(doc)
+    mapped_file.close()
+
+def test_read_block(pdf_file):
+    mapped_file = MappedDocumentFile(pdf_file)
+    with open(pdf_file, 'rb') as f:
+        data = f.read()
+    assert read_block(mapped_file, 0, 16) == (1, data[:16])
+    assert read_block(mapped_file, len(data) - 8, 8) == (1, data[-8:])
+    # past the end of the file
+    assert read_block(mapped_file, len(data) - 8, 16)[0] == 0
+    mapped_file.close()
+
+def test_truncated_file(pdf_file):
+    mapped_file = MappedDocumentFile(pdf_file)
+    assert not mapped_file.changed()
+    # rewritten in place, the tail pages of the mapping are gone and touching them would raise SIGBUS,
+    # the worker sees the change before its next read and closes the document
+    with open(pdf_file, 'r+b') as f:
+        f.truncate(16)
+    assert mapped_file.changed()
+    mapped_file.close()
+
+def test_replaced_file(pdf_file):
+    mapped_file = MappedDocumentFile(pdf_file)
+    with open(pdf_file, 'rb') as f:
+        data = f.read()
+    # a new file moved over the old one, the mapped file stays readable
+    with open(pdf_file + '.tmp', 'wb') as f:
+        f.write(make_pdf(1))
+    os.replace(pdf_file + '.tmp', pdf_file)
+    assert not mapped_file.changed()
+    assert read_block(mapped_file, 0, len(data)) == (1, data)
+    mapped_file.close()
@@ -0,0 +1,57 @@
+from quadtree import patch_id, patch_address, is_descendant, covering_range
+
+def test_patch_id_round_trip():
+    seen = set()
+    for level in range(8):
+        for i in range(1 << level):
+            for j in range(1 << level):
+                pid = patch_id(level, i, j)
+                assert patch_address(pid) == (level, i, j)
+                # the ids of a level lie in [4^L, 2 * 4^L)
+                assert (1 << (2 * level)) <= pid < (2 << (2 * level))
+                seen.add(pid)
+    assert len(seen) == sum(4 ** level for level in range(8))
+
+def test_root():
+    assert patch_id(0, 0, 0) == 1
+    assert patch_address(1) == (0, 0, 0)
+
+def test_is_descendant():
+    for level in range(1, 6):
+        for i in range(1 << level):
+            for j in range(1 << level):
+                pid = patch_id(level, i, j)
+                assert is_descendant(pid, 1)
+                for ancestor_level in range(level):
+                    shift = level - ancestor_level
+                    for ai in range(1 << ancestor_level):
+                        for aj in range(1 << ancestor_level):
+                            inside = (i >> shift, j >> shift) == (ai, aj)
+                            assert is_descendant(pid, patch_id(ancestor_level, ai, aj)) == inside
+
+def test_is_descendant_not_reflexive():
+    pid = patch_id(3, 5, 2)
+    assert not is_descendant(pid, pid)
+    assert not is_descendant(1, pid)
+    # the same level is never inside
+    assert not is_descendant(patch_id(2, 0, 0), patch_id(2, 0, 1))
+
+def test_covering_range_cell_edges():
+    # cells [0, 10), [10, 20), ... [90, 100)
+    assert covering_range(0, 10, 10, 10) == (0, 1)
+    assert covering_range(10, 20, 10, 10) == (1, 2)
+    assert covering_range(9.5, 10.5, 10, 10) == (0, 2)
+    assert covering_range(10, 10.001, 10, 10) == (1, 2)
+    assert covering_range(0, 100, 10, 10) == (0, 10)
+
+def test_covering_range_clipped():
+    assert covering_range(-30, 5, 10, 10) == (0, 1)
+    assert covering_range(95, 130, 10, 10) == (9, 10)
+    # outside of the cells
+    assert covering_range(120, 130, 10, 10) == (10, 10)
+    assert covering_range(-30, -20, 10, 10) == (0, 0)
+
+def test_covering_range_empty():
+    assert covering_range(5, 5, 10, 10) == (0, 0)
+    assert covering_range(6, 5, 10, 10) == (0, 0)
+    assert covering_range(0, 5, 0, 10) == (0, 0)
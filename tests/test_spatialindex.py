@@ -0,0 +1,56 @@
+import numpy as np
+
+from spatialindex import GridIndex
+
+def brute_force(rects, x, y):
+    return [idx for idx, (rx, ry, rw, rh) in enumerate(rects) if rx <= x < rx + rw and ry <= y < ry + rh]
+
+def test_empty():
+    index = GridIndex([])
+    assert index.query(0, 0) == []
+
+def test_half_open_rects():
+    # two rects sharing an edge at x = 10
+    index = GridIndex([[0, 0, 10, 10], [10, 0, 10, 10]])
+    assert index.query(0, 0) == [0]
+    assert index.query(9.999, 5) == [0]
+    assert index.query(10, 5) == [1]
+    assert index.query(19.999, 9.999) == [1]
+    # the right and bottom edges are outside
+    assert index.query(20, 5) == []
+    assert index.query(5, 10) == []
+    assert index.query(-0.001, 5) == []
+
+def test_overlapping_rects_in_order():
+    rects = [[0, 0, 100, 100], [40, 40, 20, 20], [45, 45, 5, 5]]
+    index = GridIndex(rects)
+    assert index.query(47, 47) == [0, 1, 2]
+    assert index.query(55, 55) == [0, 1]
+    assert index.query(5, 5) == [0]
+
+def test_cell_edges_against_brute_force():
+    rng = np.random.default_rng(0)
+    # rects on a coarse lattice, so that many of them start and end exactly at the cell boundaries
+    xy = rng.integers(0, 50, size=(300, 2)) * 4.0
+    wh = rng.integers(1, 10, size=(300, 2)) * 4.0
+    rects = np.hstack([xy, wh])
+    index = GridIndex(rects)
+    points = [(x, y) for x in np.arange(-4, 240, 2.0) for y in np.arange(-4, 240, 6.0)]
+    # the cell boundaries themselves, and just before them
+    points += [(index.x0 + c * index.cell_w, index.y0 + r * index.cell_h) for c in range(index.cols + 1) for r in range(index.rows + 1)]
+    points += [(np.nextafter(x, -np.inf), np.nextafter(y, -np.inf)) for x, y in points]
+    for x, y in points:
+        assert index.query(x, y) == brute_force(rects, x, y)
+
+def test_random_rects_against_brute_force():
+    rng = np.random.default_rng(1)
+    xy = rng.uniform(0, 600, size=(500, 2))
+    wh = rng.uniform(0.5, 40, size=(500, 2))
+    rects = np.hstack([xy, wh])
+    index = GridIndex(rects)
+    for x, y in rng.uniform(-10, 650, size=(2000, 2)):
+        assert index.query(x, y) == brute_force(rects, x, y)
+    # the corners of every rect, the top left one is inside, the bottom right one is not
+    for idx, (rx, ry, rw, rh) in enumerate(rects):
+        assert idx in index.query(rx, ry)
+        assert idx not in index.query(rx + rw, ry + rh)